@@ -0,0 +1,71 @@
+"""
+Import-time benchmark.  Each target is imported in a fresh interpreter
+several times and the median wall time is reported as JSON, along with
+the heavy modules the import pulled in.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --repeat 10 --max-ms 300
+
+With --max-ms the script exits non-zero if any median is over the limit.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+TARGETS = [
+    "toolla.chat",
+    "toolla.anthropic_client",
+    "toolla.openai_client",
+    "toolla.openai_compatible_client",
+    "toolla.ollama_guided_client",
+]
+
+# Modules that should only load once a backend that needs them is used
+HEAVY_MODULES = ["anthropic", "openai", "requests", "httpx", "httpx2"]
+
+_probe = """
+import sys, time
+start = time.perf_counter()
+import {target}
+elapsed = time.perf_counter() - start
+loaded = [m for m in {heavy!r} if m in sys.modules]
+print(elapsed, ",".join(loaded))
+"""
+
+def measure(target: str, repeat: int):
+    times = []
+    loaded = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", _probe.format(target=target, heavy=HEAVY_MODULES)],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.split()
+        times.append(float(out[0]) * 1000)
+        loaded = out[1].split(",") if len(out) > 1 else []
+    return {
+        "target": target,
+        "median_ms": round(statistics.median(times), 2),
+        "min_ms": round(min(times), 2),
+        "max_ms": round(max(times), 2),
+        "repeat": repeat,
+        "heavy_modules": loaded,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("targets", nargs="*", default=TARGETS)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    results = [measure(target, args.repeat) for target in args.targets]
+    print(json.dumps(results, indent=2))
+    if args.max_ms is not None and any(r["median_ms"] > args.max_ms for r in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Load test of Chat against the local mock provider servers: runs many chat
+calls concurrently and reports latency percentiles and throughput.
+
+    python benchmarks/load_test.py --provider anthropic --concurrency 32 --calls 500
+    python benchmarks/load_test.py --provider ollama --latency lognormal:0.05,0.6
+    python benchmarks/load_test.py --provider openai --async --stream --error-rate 0.05
+
+Each call is a fresh clone of one chat, so calls share the provider client
+and its connection pool as they would in an application.  With --tools the
+server answers every call with an `add` tool call and then a text reply, so
+a call is two requests.  Latency is --latency seconds per request, either a
+number or fixed:S, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from toolla.chat import Chat, AsyncChat
+from toolla.mock_server import (
+    MockServer,
+    fixed_latency,
+    lognormal_latency,
+    text_reply,
+    tool_reply,
+    uniform_latency,
+)
+
+MODELS = {
+    "anthropic": "claude-3-5-sonnet-20240620",
+    "openai": "gpt-4o",
+    "openai-compatible": "llama3.1",
+    "ollama": "llama3.1",
+}
+
+def add(x: int, y: int) -> int:
+    """
+    Add two integers.
+
+    x: The first number.
+    y: The second number.
+    """
+    return x + y
+
+def parse_latency(value: str, seed: int):
+    kind, _, params = value.partition(":")
+    if not params:
+        return fixed_latency(float(kind))
+    numbers = [float(p) for p in params.split(",")]
+    if kind == "fixed":
+        return fixed_latency(*numbers)
+    if kind == "uniform":
+        return uniform_latency(*numbers, seed=seed)
+    if kind == "lognormal":
+        return lognormal_latency(*numbers, seed=seed)
+    raise ValueError(f"Unknown latency distribution {kind!r}")
+
+def percentile(sorted_values, q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(q / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+def make_chat(args, server: MockServer):
+    chat_cls = AsyncChat if args.use_async else Chat
+    tools = [add] if args.tools else []
+    model = MODELS[args.provider]
+    if args.provider == "ollama":
+        return chat_cls(model=model, tools=tools, base_url=server.url, ollama_guided=True)
+    if args.provider == "openai-compatible":
+        return chat_cls(model=model, tools=tools, api_key="mock", base_url=server.url + "/v1")
+
+    chat = chat_cls(model=model, tools=tools, api_key="mock", stream=args.stream)
+    # Point the SDK client at the mock server
+    if args.provider == "anthropic":
+        import anthropic
+        sdk_cls = anthropic.AsyncAnthropic if args.use_async else anthropic.Anthropic
+        base_url = server.url
+    else:
+        import openai
+        sdk_cls = openai.AsyncOpenAI if args.use_async else openai.OpenAI
+        base_url = server.url + "/v1"
+    # The rate limiter does the retrying, as it does for Chat's own clients
+    chat.client.client = sdk_cls(base_url=base_url, api_key="mock", max_retries=0)
+    return chat
+
+def timed_call(chat, prompt: str):
+    start = time.perf_counter()
+    try:
+        chat.clone()(prompt)
+        error = None
+    except Exception as e:
+        error = type(e).__name__
+    return time.perf_counter() - start, error
+
+async def timed_call_async(chat, prompt: str, semaphore):
+    async with semaphore:
+        start = time.perf_counter()
+        try:
+            await chat.clone()(prompt)
+            error = None
+        except Exception as e:
+            error = type(e).__name__
+        return time.perf_counter() - start, error
+
+def run_calls(args, chat):
+    prompts = [f"What is {i} + 2?" for i in range(args.calls)]
+    if args.use_async:
+        async def main():
+            semaphore = asyncio.Semaphore(args.concurrency)
+            return await asyncio.gather(*(timed_call_async(chat, p, semaphore) for p in prompts))
+        return asyncio.run(main())
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        return list(executor.map(lambda p: timed_call(chat, p), prompts))
+
+def summarize(outcomes, wall_seconds: float):
+    latencies = sorted(seconds for seconds, error in outcomes if error is None)
+    errors = {}
+    for _, error in outcomes:
+        if error is not None:
+            errors[error] = errors.get(error, 0) + 1
+    ms = lambda seconds: round(seconds * 1000, 3)
+    return {
+        "calls": len(outcomes),
+        "succeeded": len(latencies),
+        "errors": errors,
+        "wall_s": round(wall_seconds, 3),
+        "throughput_calls_per_s": round(len(latencies) / wall_seconds, 2) if wall_seconds else 0.0,
+        "latency_ms": {
+            "p50": ms(percentile(latencies, 50)),
+            "p90": ms(percentile(latencies, 90)),
+            "p99": ms(percentile(latencies, 99)),
+            "max": ms(latencies[-1]) if latencies else 0.0,
+            "mean": ms(sum(latencies) / len(latencies)) if latencies else 0.0,
+        },
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--provider", choices=sorted(MODELS), default="anthropic")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", default="0.05")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--retry-after", type=float, default=None)
+    parser.add_argument("--tools", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--stream", action="store_true", help="anthropic and openai only")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="use AsyncChat")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="write the report here instead of stdout")
+    args = parser.parse_args()
+
+    script = [text_reply("Done")]
+    if args.tools:
+        script = [tool_reply(("add", {"x": 1, "y": 2})), text_reply("The answer is 3")]
+    server = MockServer(
+        script=script,
+        latency=parse_latency(args.latency, args.seed),
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    with server:
+        chat = make_chat(args, server)
+        start = time.perf_counter()
+        outcomes = run_calls(args, chat)
+        wall_seconds = time.perf_counter() - start
+        server_stats = server.stats()
+
+    report = json.dumps({
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "python": platform.python_version(),
+        **summarize(outcomes, wall_seconds),
+        "server": server_stats,
+    }, indent=2)
+    if args.output:
+        Path(args.output).write_text(report)
+    else:
+        print(report)
+    if not any(error is None for _, error in outcomes):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
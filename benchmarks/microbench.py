@@ -0,0 +1,182 @@
+"""
+Microbenchmarks for the per-step overhead of toolla: tool schema building,
+docstring parsing, JSON extraction, history truncation and image encoding.
+
+    python benchmarks/microbench.py --output results.json
+    python benchmarks/microbench.py --filter schema --repeat 3
+    python benchmarks/microbench.py --compare before.json --output after.json
+
+Results are JSON with the commit, Python version and per-case timings in
+microseconds per call.  With --compare, each case is printed with its
+ratio to the same case in an earlier results file, and --max-regression
+makes the script exit non-zero if any case got slower than that ratio.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+from toolla.history import MessageHistory
+from toolla.messages import Message, TextPart, to_anthropic
+from toolla.registry import ToolSchemaRegistry
+from toolla.utils import (
+    build_claude_tool_schema,
+    build_openai_tool_schema,
+    extract_json_from_text,
+    load_file_base64,
+    parse_descriptions,
+)
+
+TOOL_COUNTS = [1, 10, 100, 500]
+HISTORY_SIZES = [10, 100, 1_000, 10_000]
+TEXT_SIZES = [10_000, 100_000, 1_000_000]
+IMAGE_SIZES = [1 << 20, 8 << 20, 32 << 20]
+
+def make_tool(i: int, params: int = 4):
+    """A documented tool function with `params` int arguments."""
+    names = [f"arg{j}" for j in range(params)]
+    doc = f"Tool number {i} that combines its arguments.\n\n" + "\n".join(
+        f"{name}: Argument {name} of tool {i}" for name in names
+    )
+    namespace = {}
+    exec(
+        f"def tool_{i}({', '.join(n + ': int' for n in names)}) -> int:\n"
+        f"    return 0\n",
+        namespace,
+    )
+    f = namespace[f"tool_{i}"]
+    f.__doc__ = doc
+    return f
+
+def make_reply(size: int) -> str:
+    """A long model reply with braces in its prose and a tool call at the end."""
+    prose = "The set {a, b} is shown as \"{a}\" here. "
+    call = '```json\n{"tool": "add", "inputs": {"x": 1, "y": "a } b"}}\n```'
+    return prose * (max(0, size - len(call)) // len(prose)) + call
+
+def cases(image_dir: Path):
+    """Yield (name, params, fn) for every benchmark case."""
+    for n in TOOL_COUNTS:
+        tools = [make_tool(i) for i in range(n)]
+        yield "build_claude_tool_schema", {"tools": n}, lambda tools=tools: [build_claude_tool_schema(f) for f in tools]
+        yield "build_openai_tool_schema", {"tools": n}, lambda tools=tools: [build_openai_tool_schema(f) for f in tools]
+        registry = ToolSchemaRegistry()
+        registry.tool_set(tools, "claude")
+        yield "registry_tool_set_warm", {"tools": n}, lambda tools=tools, registry=registry: registry.tool_set(tools, "claude")
+
+    for params in [1, 10, 50]:
+        doc = make_tool(0, params).__doc__
+        yield "parse_descriptions", {"params": params}, lambda doc=doc: parse_descriptions(doc)
+
+    for size in TEXT_SIZES:
+        reply = make_reply(size)
+        yield "extract_json_from_text", {"chars": size}, lambda reply=reply: extract_json_from_text(reply)
+
+    for n in HISTORY_SIZES:
+        message = Message("user", [TextPart("x" * 100)])
+        history = MessageHistory(max_chars=n * message.size, messages=[message] * n)
+
+        def append_and_truncate(history=history, message=message):
+            # The history stays full, so every append evicts one message
+            history.append(message)
+            history.enforce_budget()
+        yield "history_append_truncate", {"messages": n}, append_and_truncate
+        yield "history_serialize_anthropic", {"messages": n}, lambda history=history: history.serialize(to_anthropic)
+
+        def truncate_half(n=n, message=message):
+            history = MessageHistory(max_chars=n * message.size, messages=[message] * (2 * n))
+            history.enforce_budget()
+        yield "history_truncate_half", {"messages": n}, truncate_half
+
+    for size in IMAGE_SIZES:
+        path = image_dir / f"image-{size}.bin"
+        path.write_bytes(os.urandom(size))
+        yield "load_file_base64", {"bytes": size}, lambda path=path: load_file_base64(path)
+
+def measure(fn, repeat: int):
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    runs = [t / number * 1e6 for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "number": number,
+        "repeat": repeat,
+        "min_us": round(min(runs), 3),
+        "median_us": round(statistics.median(runs), 3),
+        "mean_us": round(statistics.mean(runs), 3),
+        "stdev_us": round(statistics.stdev(runs), 3) if len(runs) > 1 else 0.0,
+    }
+
+def case_id(result) -> str:
+    params = ",".join(f"{k}={v}" for k, v in sorted(result["params"].items()))
+    return f"{result['name']}[{params}]"
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path: str):
+    """Print each case's ratio to the baseline and return the worst one."""
+    baseline = {case_id(r): r for r in json.loads(Path(baseline_path).read_text())["results"]}
+    worst = 0.0
+    for result in results:
+        before = baseline.get(case_id(result))
+        if before is None:
+            continue
+        ratio = result["min_us"] / before["min_us"]
+        worst = max(worst, ratio)
+        print(
+            f"{case_id(result):55} {before['min_us']:>14.3f} -> {result['min_us']:>14.3f} us  x{ratio:.2f}",
+            file=sys.stderr,
+        )
+    return worst
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=None, help="write results here instead of stdout")
+    parser.add_argument("--compare", default=None, help="earlier results file to compare with")
+    parser.add_argument("--max-regression", type=float, default=None)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as image_dir:
+        for name, params, fn in cases(Path(image_dir)):
+            if args.filter not in name:
+                continue
+            result = {"name": name, "params": params, **measure(fn, args.repeat)}
+            results.append(result)
+            print(f"{case_id(result):55} {result['min_us']:>14.3f} us", file=sys.stderr)
+
+    report = json.dumps({
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }, indent=2)
+    if args.output:
+        Path(args.output).write_text(report)
+    else:
+        print(report)
+
+    if args.compare:
+        worst = compare(results, args.compare)
+        if args.max_regression is not None and worst > args.max_regression:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,50 @@
-import os
-from typing import Union, List, Dict
+import functools
+from typing import Union, List, Dict, Sequence
 from pathlib import Path
-from anthropic import Anthropic
-from anthropic.types import TextBlock, ToolUseBlock
+from concurrent.futures import Executor
 from toolla.utils import (
     get_image_mime_type,
-    load_file_base64,
-    build_claude_tool_schema
+    confirm_tool_call,
+    dispatch_tool_call,
+    dispatch_tool_call_async,
+    run_tool_calls,
+    run_tool_calls_async,
 )
-from toolla.exceptions import (
-    MessageTooLongException,
-    AbortedToolException
+from toolla.attachments import attachment_cache
+from toolla.cache import ResponseCache
+from toolla.dispatch import send, send_async
+from toolla.history import MessageHistory
+from toolla.messages import Message, TextPart, ImagePart, USER, ASSISTANT, to_anthropic
+from toolla.rate_limit import RateLimiter
+from toolla.registry import tool_registry
+from toolla.streaming import AnthropicStreamAccumulator, DispatchedCalls
+from toolla.transports import LoopBoundClient, transport_pool
+from toolla.steps import StepHook, run_steps, run_steps_async
+from toolla.results import ResultStore
+from toolla.tracing import Tracer
+
+# Anthropic keeps a cached prompt prefix for a few minutes after each use
+CACHE_CONTROL = {"type": "ephemeral"}
+
+USAGE_FIELDS = (
+    "input_tokens",
+    "output_tokens",
+    "cache_creation_input_tokens",
+    "cache_read_input_tokens",
 )
 
+def _with_cache_breakpoint(message: Dict) -> Dict:
+    """Copy of a Messages API dict with `cache_control` on its last block."""
+    content = message["content"]
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    content = list(content)
+    content[-1] = {**content[-1], "cache_control": CACHE_CONTROL}
+    return {**message, "content": content}
+
 class AnthropicClient:
+    serialize_message = staticmethod(to_anthropic)
+
     def __init__(
         self,
         model: str,
@@ -22,31 +53,153 @@ class AnthropicClient:
         max_steps = 10,
         print_output=False,
         api_key: Union[str, None] = None,
+        tool_executor: Union[Executor, None] = None,
+        hooks: Sequence[StepHook] = (),
+        tracer: Union[Tracer, None] = None,
+        result_store: Union[ResultStore, None] = None,
+        response_cache: Union[ResponseCache, None] = None,
+        rate_limiter: Union[RateLimiter, None] = None,
+        stream: bool = False,
+        prompt_caching: bool = True,
     ):
-        self.client = Anthropic(api_key=api_key or os.environ.get("ANTHROPIC_API_KEY"))
+        self.client = self._create_client(api_key)
         self.model = model
         self.system = system
+        self.stream = stream
+        self.prompt_caching = prompt_caching
+        self.usage = dict.fromkeys(USAGE_FIELDS, 0)
         self.max_steps = max_steps
-        self.messages = []
+        self.tool_executor = tool_executor
+        self.hooks = list(hooks)
+        self.tracer = tracer
+        self.result_store = result_store
+        self.response_cache = response_cache
+        self.rate_limiter = rate_limiter
+        if rate_limiter is not None:
+            # The limiter does the retrying, throttled or transient
+            self.client = self.client.with_options(max_retries=0)
         self.print_output = print_output
 
         # TODO change when expanding to other models
         self.max_tokens = 4096
         self.max_chars = 1_000_000
+        self.messages = MessageHistory(self.max_chars)
+
+        tool_set = tool_registry.tool_set(tools, "claude")
+        self.tools = tool_set.schemas
+        self.tool_fns = tool_set.fns
+        # The registry's schemas are shared, so the breakpoint goes on a copy
+        self.cached_tools = list(self.tools)
+        if self.cached_tools:
+            self.cached_tools[-1] = {**self.cached_tools[-1], "cache_control": CACHE_CONTROL}
+
+    def _create_client(self, api_key: Union[str, None]):
+        return transport_pool.anthropic_client(api_key)
+
+    def _add_user_message(self, prompt: str, image: Union[str, None]):
+        parts = [TextPart(prompt)]
+        if image:
+            fpath = Path(image)
+            parts.append(ImagePart(get_image_mime_type(fpath), attachment_cache.load(fpath)))
+        self.messages.append(Message(USER, parts))
+        self.messages.enforce_budget()
+
+    def _create_kwargs(self):
+        # TODO assert if tool choice set, then tools is not None
+        tools = self.tools or []
+        system = self.system or ''
+        messages = self.messages.serialize(to_anthropic)
+        if self.prompt_caching:
+            # Breakpoints after the tools, the system prompt and the history,
+            # so each step reads everything before its new message from cache
+            tools = self.cached_tools
+            if system:
+                system = [{"type": "text", "text": system, "cache_control": CACHE_CONTROL}]
+            if messages:
+                messages[-1] = _with_cache_breakpoint(messages[-1])
+        return dict(
+            model=self.model,
+            max_tokens=self.max_tokens,
+            tools=tools,
+            system=system,
+            messages=messages,
+        )
+
+    def _record_usage(self, usage):
+        """Add the token counts of one response, including prompt cache
+        reads and writes, to `self.usage`."""
+        if usage is None:
+            return
+        for field in USAGE_FIELDS:
+            self.usage[field] += getattr(usage, field, None) or 0
+
+    def _add_text(self, text: str):
+        self.messages.append(Message(ASSISTANT, text))
+        if self.print_output:
+            print(f"{text}\n")
+
+    def _dispatch_streamed_call(self, calls, name, inputs, disable_auto_execution):
+        if disable_auto_execution:
+            confirm_tool_call(name, inputs)
+        calls.add(name, inputs, dispatch_tool_call(self.tool_fns, name, inputs, self.tool_executor))
+
+    def _read_stream(self, stream, disable_auto_execution):
+        """Read a streamed response, starting each tool as soon as its
+        input is complete.  Returns the started calls."""
+        accumulator = AnthropicStreamAccumulator()
+        calls = DispatchedCalls()
+        for event in stream:
+            for name, inputs in accumulator.feed(event):
+                self._dispatch_streamed_call(calls, name, inputs, disable_auto_execution)
+        self._record_usage(accumulator.usage)
+        for text in accumulator.texts:
+            self._add_text(text)
+        return calls
+
+    def _collect_tool_calls(self, response, disable_auto_execution):
+        """Record the text of `response` and return every tool call in it
+        as (name, inputs) pairs."""
+        if self.stream:
+            return self._read_stream(response, disable_auto_execution)
+        self._record_usage(getattr(response, "usage", None))
+        calls = []
+        for content in response.content:
+            if content.type == "text":
+                self._add_text(content.text)
+            elif content.type == "tool_use":
+                calls.append((content.name, content.input))
+        if response.stop_reason != 'tool_use':
+            return []
+        if disable_auto_execution:
+            for name, inputs in calls:
+                confirm_tool_call(name, inputs)
+        return calls
+
+    def _send_args(self):
+        kwargs = self._create_kwargs()
+        if self.stream:
+            # A stream can only be read once, so streamed responses aren't cached
+            kwargs["stream"] = True
+            return kwargs, None
+        return kwargs, self.response_cache
+
+    def _request(self):
+        return self._send(*self._send_args())
+
+    def _send(self, kwargs, response_cache):
+        return send(
+            self.client.messages,
+            "anthropic",
+            kwargs,
+            rate_limiter=self.rate_limiter,
+            response_cache=response_cache,
+            estimated_tokens=self.messages.estimated_tokens,
+        )
+
+    def _run_tool_calls(self, calls):
+        # TODO add try catch block and return error
+        return run_tool_calls(self.tool_fns, calls, self.tool_executor)
 
-        # Build tool definitions from fns
-        if tools:
-            # TODO check that docstrings
-            # match functions and are valid 
-            self.tools = []
-            self.tool_fns = {}
-            for f in tools:
-                self.tool_fns[f.__name__] = f
-                tool_dict = build_claude_tool_schema(f)
-                self.tools.append(tool_dict)
-        else:
-            self.tools = []
-    
     def __call__(
         self,
         prompt: str,
@@ -54,71 +207,68 @@ class AnthropicClient:
         current_fn_response = None,
         disable_auto_execution = False,
     ):
-        message = {
-            "role": "user",
-            "content": [
-                { "type": "text", "text": prompt }
-            ]
-        }
-        self.messages.append(message)
-        if image:
-            fpath = Path(image)
-            mtype = get_image_mime_type(fpath)
-            image_string = load_file_base64(fpath) 
-            message["content"].append(
-                {
-                    "type": "image",
-                    "source": {
-                        "type": "base64",
-                        "media_type": mtype,
-                        "data": image_string
-                    }
-                }
-            )
-    
-        # A bit hacky, should calculate exact length given messages
-        while len(str(self.messages)) > self.max_chars:
-            self.messages.pop(0)
-            if not self.messages:
-                raise MessageTooLongException
+        return run_steps(
+            self,
+            prompt,
+            image=image,
+            current_fn_response=current_fn_response,
+            disable_auto_execution=disable_auto_execution,
+            hooks=self.hooks,
+        )
 
-        # TODO assert if tool choice set, then tools is not None
-        response = self.client.messages.create(
-            model="claude-3-5-sonnet-20240620",
-            max_tokens=self.max_tokens,
-            tools=self.tools or [],
-            system=self.system or '',
-            messages=self.messages,
+class AsyncAnthropicClient(AnthropicClient):
+    def _create_client(self, api_key: Union[str, None]):
+        # Looked up on use, so it comes from the running loop's pool
+        return LoopBoundClient(functools.partial(transport_pool.async_anthropic_client, api_key))
+
+    async def _request(self):
+        return await self._send(*self._send_args())
+
+    async def _send(self, kwargs, response_cache):
+        return await send_async(
+            self.client.messages,
+            "anthropic",
+            kwargs,
+            rate_limiter=self.rate_limiter,
+            response_cache=response_cache,
+            estimated_tokens=self.messages.estimated_tokens,
+        )
+
+    def _dispatch_streamed_call(self, calls, name, inputs, disable_auto_execution):
+        if disable_auto_execution:
+            confirm_tool_call(name, inputs)
+        calls.add(
+            name,
+            inputs,
+            dispatch_tool_call_async(self.tool_fns, name, inputs, self.tool_executor),
+        )
+
+    async def _read_stream(self, stream, disable_auto_execution):
+        accumulator = AnthropicStreamAccumulator()
+        calls = DispatchedCalls()
+        async for event in stream:
+            for name, inputs in accumulator.feed(event):
+                self._dispatch_streamed_call(calls, name, inputs, disable_auto_execution)
+        self._record_usage(accumulator.usage)
+        for text in accumulator.texts:
+            self._add_text(text)
+        return calls
+
+    async def _run_tool_calls(self, calls):
+        return await run_tool_calls_async(self.tool_fns, calls, self.tool_executor)
+
+    async def __call__(
+        self,
+        prompt: str,
+        image: Union[str, None] = None,
+        current_fn_response = None,
+        disable_auto_execution = False,
+    ):
+        return await run_steps_async(
+            self,
+            prompt,
+            image=image,
+            current_fn_response=current_fn_response,
+            disable_auto_execution=disable_auto_execution,
+            hooks=self.hooks,
         )
- 
-        for content in response.content:
-            if isinstance(content, TextBlock):
-                self.messages.append({
-                    "role": "assistant",
-                    "content": content.text,
-                })
-                if self.print_output:
-                    print(f"{content.text}\n")
-                if response.stop_reason == 'end_turn':
-                    return current_fn_response
-            elif isinstance(content, ToolUseBlock):
-                fn_inputs = content.input
-                # TODO add try catch block and return error
-                if disable_auto_execution:
-                    print(f"Function {content.name} is about to be called with inputs: {fn_inputs}")
-                    user_input = input("Do you want to run this function? (y/n): ")
-                    if user_input.lower() not in ['y', 'Y']:
-                        print("Function call aborted by user.")
-                        raise AbortedToolException
-                r = self.tool_fns[content.name](**fn_inputs)
-                if len(self.messages) < 2 * self.max_steps:
-                    if response.stop_reason == 'tool_use':
-                        return self(
-                            prompt=f"\nFunction {content.name} was called and returned a value of {r}",
-                            current_fn_response=r,
-                            disable_auto_execution=disable_auto_execution,
-                        )
-                else:
-                    print("Reached maxiumum number of steps, returning current tool response.")
-                    return None
-        return None
\ No newline at end of file
@@ -0,0 +1,82 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Tuple, Union
+from toolla.utils import load_file_base64
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def file_digest(fpath: Path) -> str:
+    """sha256 of a file's contents, read in chunks."""
+    digest = hashlib.sha256()
+    with open(fpath, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class AttachmentCache:
+    """
+    LRU cache of base64 encoded files, capped at `max_bytes` of encoded data.
+
+    Files are keyed by resolved path, mtime and size, so an edited file is
+    re-encoded.  With `by_content=True` they are keyed by a hash of their
+    contents instead, which lets identical files at different paths share
+    one entry at the cost of reading the file on every lookup.
+    """
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, by_content: bool = False):
+        self.max_bytes = max_bytes
+        self.by_content = by_content
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, fpath: Path) -> Tuple:
+        if self.by_content:
+            return ("sha256", file_digest(fpath))
+        stat = os.stat(fpath)
+        return (str(fpath.resolve()), stat.st_mtime_ns, stat.st_size)
+
+    def load(self, fpath: Union[str, Path]) -> str:
+        """Base64 contents of `fpath`, encoding it only on a cache miss."""
+        fpath = Path(fpath)
+        key = self._key(fpath)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+            self.misses += 1
+
+        data = load_file_base64(fpath)
+        if len(data) <= self.max_bytes:
+            with self._lock:
+                if key not in self._entries:
+                    self._entries[key] = data
+                    self.current_bytes += len(data)
+                self._evict()
+        return data
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes:
+            _, data = self._entries.popitem(last=False)
+            self.current_bytes -= len(data)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+        }
+
+attachment_cache = AttachmentCache()
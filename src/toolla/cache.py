@@ -0,0 +1,223 @@
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Union
+
+def cache_key(scope: str, kwargs: Dict[str, Any]) -> str:
+    """Stable hash of a request: model, system, messages, tools and the
+    remaining create() arguments, plus a scope naming the provider/endpoint."""
+    payload = json.dumps(
+        {"scope": scope, "kwargs": kwargs},
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _dump(response) -> Union[str, None]:
+    """JSON for the SQLite tier, or None if `response` can't be stored there."""
+    if hasattr(response, "model_dump_json"):
+        # A pydantic model, such as an SDK response
+        cls = type(response)
+        return json.dumps({
+            "class": f"{cls.__module__}:{cls.__qualname__}",
+            "json": response.model_dump_json(),
+        })
+    try:
+        data = json.dumps({"value": response})
+    except (TypeError, ValueError):
+        return None
+    # Tuples and the like would come back as something else
+    return data if json.loads(data)["value"] == response else None
+
+def _load(data: Union[str, bytes]):
+    entry = json.loads(data)
+    if "class" not in entry:
+        return entry["value"]
+    module_name, _, qualname = entry["class"].partition(":")
+    # Only from modules already imported, so a row can't import code
+    cls = sys.modules[module_name]
+    for name in qualname.split("."):
+        cls = getattr(cls, name)
+    if not (isinstance(cls, type) and hasattr(cls, "model_validate_json")):
+        raise TypeError(f"{entry['class']} is not a pydantic model")
+    return cls.model_validate_json(entry["json"])
+
+class ResponseCache:
+    """
+    Opt-in cache of provider responses with an in-memory LRU tier and an
+    optional SQLite tier that several processes can share.
+
+    Entries older than `ttl` seconds are treated as misses.  The memory tier
+    holds at most `max_entries` responses and the SQLite tier at most
+    `max_disk_entries` rows, evicting least recently used first.  The
+    SQLite tier stores JSON: pydantic models, such as SDK responses, and
+    values JSON round-trips unchanged.  Other values are only cached in
+    memory.  A row that can't be read back is a miss and is deleted.
+    """
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: Union[float, None] = None,
+        path: Union[str, None] = None,
+        max_disk_entries: Union[int, None] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, created REAL, accessed REAL, value BLOB)"
+            )
+            self._db.commit()
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl is not None and now - created > self.ttl
+
+    def get(self, key: str):
+        """Cached response for `key`, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, response = entry
+                if not self._expired(created, now):
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    return response
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT created, value FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and not self._expired(row[0], now):
+                    try:
+                        response = _load(row[1])
+                    except Exception:
+                        # Corrupt, or written by an older version
+                        self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                        self._db.commit()
+                    else:
+                        self._db.execute(
+                            "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+                        )
+                        self._db.commit()
+                        self._remember(key, row[0], response)
+                        self.disk_hits += 1
+                        return response
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, response):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, response)
+            data = None if self._db is None else _dump(response)
+            if data is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                    (key, now, now, data),
+                )
+                self._evict_disk(now)
+                self._db.commit()
+
+    def _remember(self, key: str, created: float, response):
+        self._entries[key] = (created, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _evict_disk(self, now: float):
+        if self.ttl is not None:
+            self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        if self.max_disk_entries is not None:
+            self._db.execute(
+                "DELETE FROM responses WHERE key NOT IN "
+                "(SELECT key FROM responses ORDER BY accessed DESC LIMIT ?)",
+                (self.max_disk_entries,),
+            )
+
+    def call(self, create: Callable, scope: str, kwargs: Dict[str, Any]):
+        """Return the cached response for `kwargs` or call `create(**kwargs)` and cache it."""
+        key = cache_key(scope, kwargs)
+        response = self.get(key)
+        if response is None:
+            response = create(**kwargs)
+            self.set(key, response)
+        return response
+
+    async def acall(self, create: Callable, scope: str, kwargs: Dict[str, Any]):
+        """`call` for an awaitable `create`."""
+        key = cache_key(scope, kwargs)
+        response = self.get(key)
+        if response is None:
+            response = await create(**kwargs)
+            self.set(key, response)
+        return response
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self):
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+        }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+# Attribute set by `memoize` on a tool function
+_MEMO_ATTR = "toolla_memo_cache"
+
+def memoize(
+    ttl: Union[float, None] = None,
+    max_entries: int = 1024,
+    path: Union[str, None] = None,
+) -> Callable[[Callable], Callable]:
+    """
+    Decorator marking a pure tool whose results can be reused.  Results are
+    cached by tool name and arguments, cast to the tool's parameter types,
+    in a `ResponseCache` with the given `ttl`, `max_entries` and optional
+    SQLite `path`, which lets later runs reuse them too.  Error strings from
+    an execution policy are not cached.
+
+        @memoize(ttl=600)
+        def lookup_user(user_id: int) -> str:
+            ...
+
+        tool_memo_cache(lookup_user).stats()
+    """
+    cache = ResponseCache(max_entries=max_entries, ttl=ttl, path=path)
+
+    def decorator(f: Callable) -> Callable:
+        setattr(f, _MEMO_ATTR, cache)
+        return f
+    return decorator
+
+def tool_memo_cache(f: Callable) -> Union[ResponseCache, None]:
+    return getattr(f, _MEMO_ATTR, None)
@@ -1,16 +1,78 @@
-from typing import List, Dict, Union, Callable
+import asyncio
+import copy
+import importlib
+import itertools
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Sequence,
+    Union,
+)
+from concurrent.futures import FIRST_COMPLETED, Executor, ThreadPoolExecutor, wait
 from toolla.models import (
     models,
 )
 from toolla.exceptions import (
     ModelNotSupportedException,
 )
-from toolla.anthropic_client import AnthropicClient
-from toolla.openai_client import OpenAIClient
-from toolla.openai_compatible_client import OpenAICompatibleClient
-from toolla.ollama_guided_client import OllamaGuidedClient
+from toolla.steps import StepHook
+from toolla.tracing import Tracer, use_tracer
+from toolla.cache import ResponseCache
+from toolla.results import ResultStore
+from toolla.history import MessageHistory, MessageLog
+from toolla.rate_limit import RateLimiter, rate_limiters
+
+class BatchResult:
+    """Outcome of one item of `Chat.batch`.  On failure `error` holds the
+    exception and `messages` the conversation up to the point it failed."""
+    def __init__(
+        self,
+        index: int,
+        prompt: str,
+        value: Any = None,
+        error: Union[BaseException, None] = None,
+        messages: Union[List[Dict], None] = None,
+    ):
+        self.index = index
+        self.prompt = prompt
+        self.value = value
+        self.error = error
+        self.messages = messages or []
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self) -> str:
+        outcome = f"error={self.error!r}" if self.error else f"value={self.value!r}"
+        return f"BatchResult(index={self.index}, {outcome})"
+
+def _batch_call_kwargs(item: Union[str, Dict], call_kwargs: Dict) -> Dict:
+    if isinstance(item, str):
+        return {**call_kwargs, "prompt": item}
+    return {**call_kwargs, **item}
+
+def _load_client_cls(client_cls):
+    """Import a client class given as "module:Class", or return it as is."""
+    if not isinstance(client_cls, str):
+        return client_cls
+    module_name, _, name = client_cls.partition(":")
+    return getattr(importlib.import_module(module_name), name)
 
 class Chat:
+    # Imported only for the backend a chat uses, so importing this module
+    # doesn't load every provider SDK
+    anthropic_client_cls = "toolla.anthropic_client:AnthropicClient"
+    openai_client_cls = "toolla.openai_client:OpenAIClient"
+    openai_compatible_client_cls = "toolla.openai_compatible_client:OpenAICompatibleClient"
+    ollama_guided_client_cls = "toolla.ollama_guided_client:OllamaGuidedClient"
+    hedged_client_cls = "toolla.hedging:HedgedClient"
+
     def __init__(
         self, 
         model: str = "claude-3-5-sonnet-20240620",
@@ -19,48 +81,138 @@ class Chat:
         max_steps = 10,
         print_output=False,
         api_key: Union[str, None] = None,
-        base_url: Union[str, None] = None,
-        #ollama_guided: bool = False,
+        base_url: Union[str, Sequence[str], None] = None,
+        tool_executor: Union[Executor, None] = None,
+        hooks: Sequence[StepHook] = (),
+        response_cache: Union[ResponseCache, None] = None,
+        rate_limiter: Union[RateLimiter, None] = None,
+        stream: bool = False,
+        message_log: Union[MessageLog, None] = None,
+        message_window_chars: Union[int, None] = None,
+        message_window_messages: Union[int, None] = None,
+        prompt_caching: bool = True,
+        tracer: Union[Tracer, None] = None,
+        ollama_guided: bool = False,
+        ollama_tool_mode: str = "native",
+        max_result_chars: Union[int, None] = None,
+        hedge_model: Union[str, None] = None,
+        hedge_base_url: Union[str, None] = None,
+        hedge_api_key: Union[str, None] = None,
+        hedge_delay: float = 1.0,
+        load_balancing: str = "least_outstanding",
+    ):
+        # Results over budget are kept out of the conversation, and the model
+        # gets a tool to read them
+        result_store = ResultStore.for_tools(tools, max_result_chars)
+        if result_store is not None:
+            tools = list(tools) + [result_store.fetch_tool()]
+        # Traced so that building the tool schemas is recorded
+        with use_tracer(tracer):
+            if ollama_guided:
+                if hedge_model or hedge_base_url:
+                    raise ValueError("Hedged requests aren't supported with ollama_guided")
+                if not isinstance(base_url, str):
+                    raise ValueError("ollama_guided takes a single base_url")
+                self.client = _load_client_cls(self.ollama_guided_client_cls)(
+                    model=model,
+                    base_url=base_url,
+                    system=system,
+                    tools=tools,
+                    max_steps=max_steps,
+                    print_output=print_output,
+                    tool_executor=tool_executor,
+                    hooks=hooks,
+                    tracer=tracer,
+                    result_store=result_store,
+                    tool_mode=ollama_tool_mode,
+                )
+            else:
+                client_kwargs = dict(
+                    system=system,
+                    tools=tools,
+                    max_steps=max_steps,
+                    print_output=print_output,
+                    tool_executor=tool_executor,
+                    hooks=hooks,
+                    tracer=tracer,
+                    result_store=result_store,
+                    response_cache=response_cache,
+                    stream=stream,
+                    prompt_caching=prompt_caching,
+                )
+                client_kwargs["load_balancing"] = load_balancing
+                self.client = self._create_client(model, base_url, api_key, rate_limiter, **client_kwargs)
+                if hedge_model or hedge_base_url:
+                    secondary = self._create_client(
+                        hedge_model or model,
+                        hedge_base_url,
+                        hedge_api_key or api_key,
+                        None,
+                        **client_kwargs,
+                    )
+                    self.client = _load_client_cls(self.hedged_client_cls)(
+                        self.client,
+                        secondary,
+                        delay=hedge_delay,
+                    )
+        if message_log is not None or message_window_chars or message_window_messages:
+            self.client.messages = MessageHistory(
+                self.client.messages.max_chars,
+                self.client.messages,
+                log=message_log,
+                window_chars=message_window_chars,
+                window_messages=message_window_messages,
+            )
+
+    def _create_client(
+        self,
+        model: str,
+        base_url: Union[str, None],
+        api_key: Union[str, None],
+        rate_limiter: Union[RateLimiter, None],
+        stream: bool,
+        prompt_caching: bool,
+        load_balancing: str,
+        **kwargs,
     ):
-        # if ollama_guided:
-        #     self.client = OllamaGuidedClient(
-        #         model=model,
-        #         base_url=base_url,
-        #         system=system,
-        #         tools=tools,
-        #         max_steps=max_steps,
-        #         print_output=print_output,
-        #     )
+        """The provider client for `model`, or for OpenAI compatible
+        endpoints at `base_url`, one URL or a list of them to balance over."""
+        if base_url and not isinstance(base_url, str):
+            # Each node gets its own limiter
+            return _load_client_cls(self.openai_compatible_client_cls)(
+                model=model,
+                base_url=list(base_url),
+                api_key=api_key,
+                rate_limiter=rate_limiter,
+                load_balancing=load_balancing,
+                **kwargs,
+            )
         if base_url:
-            self.client = OpenAICompatibleClient(
+            return _load_client_cls(self.openai_compatible_client_cls)(
                 model=model,
-                tools=tools,
-                max_steps=max_steps,
-                print_output=print_output,
                 base_url=base_url,
-                system=system,
                 api_key=api_key,
+                rate_limiter=rate_limiter or rate_limiters.get(base_url, model),
+                **kwargs,
             )
         elif model in models["openai_models"]:
-            self.client = OpenAIClient(
+            return _load_client_cls(self.openai_client_cls)(
                 model=model,
-                system=system,
-                tools=tools,
-                max_steps=max_steps,
-                print_output=print_output,
                 api_key=api_key,
+                rate_limiter=rate_limiter or rate_limiters.get("openai", model),
+                stream=stream,
+                **kwargs,
             )
         elif model in models["claude_models"]:
-            self.client = AnthropicClient(
+            return _load_client_cls(self.anthropic_client_cls)(
                 model=model,
-                system=system,
-                tools=tools,
-                max_steps=max_steps,
-                print_output=print_output,
                 api_key=api_key,
+                rate_limiter=rate_limiter or rate_limiters.get("anthropic", model),
+                stream=stream,
+                prompt_caching=prompt_caching,
+                **kwargs,
             )
-        else:
-            raise ModelNotSupportedException
+        raise ModelNotSupportedException
 
     def __call__(
         self,
@@ -81,9 +233,139 @@ class Chat:
         return models
 
     def get_messages(self):
-        return self.client.messages
+        """The conversation so far.  With a `message_log` this is the whole
+        log, read lazily, otherwise the messages in the context window."""
+        return self.client.messages.full_history(self.client.serialize_message)
     
+    def get_usage(self) -> Dict[str, int]:
+        """Token counts summed over this chat's requests, including prompt
+        cache reads and writes.  Empty for backends that don't report them."""
+        return dict(getattr(self.client, "usage", {}))
+
     def clear_messages(self):
-        self.client.messages = [
-            message for message in self.client.messages if message["role"]  == "system"
-        ]
+        self.client.messages.clear(keep_roles=("system",))
+
+    def close(self):
+        """Close the message log, if there is one."""
+        self.client.messages.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def clone(self):
+        """A new conversation with the same model, system prompt and tools.
+        The provider client, tools and caches are shared, the history is not."""
+        clone = copy.copy(self)
+        clone.client = copy.copy(self.client)
+        clone.client.hooks = list(self.client.hooks)
+        if hasattr(self.client, "usage"):
+            clone.client.usage = dict.fromkeys(self.client.usage, 0)
+        clone.client.messages = MessageHistory(
+            self.client.messages.max_chars,
+            [m for m in self.client.messages if m.role == "system"],
+            window_chars=self.client.messages.window_chars,
+            window_messages=self.client.messages.window_messages,
+        )
+        return clone
+
+    def _run_batch_item(self, index: int, kwargs: Dict) -> BatchResult:
+        chat = self.clone()
+        try:
+            value = chat(**kwargs)
+        except Exception as e:
+            return BatchResult(index, kwargs["prompt"], error=e, messages=chat.get_messages())
+        return BatchResult(index, kwargs["prompt"], value=value, messages=chat.get_messages())
+
+    def batch(
+        self,
+        items: Iterable[Union[str, Dict]],
+        max_concurrency: int = 8,
+        **call_kwargs,
+    ) -> Iterator[BatchResult]:
+        """
+        Run each item in its own clone of this chat, at most `max_concurrency`
+        at a time, yielding a `BatchResult` per item in completion order.
+        Items are prompts or dicts of `__call__` arguments, taken from
+        `items` only as workers free up.  A failing item is reported in its
+        result rather than stopping the batch.  Items not yet started when
+        iteration stops are never run.
+        """
+        items = enumerate(items)
+        executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+        def submit(i, item):
+            return executor.submit(self._run_batch_item, i, _batch_call_kwargs(item, call_kwargs))
+
+        pending = set()
+        try:
+            pending = {submit(i, item) for i, item in itertools.islice(items, max_concurrency)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for i, item in itertools.islice(items, 1):
+                        pending.add(submit(i, item))
+                    yield future.result()
+        finally:
+            # Items already running finish in the background.  Cancelled by
+            # hand, as shutdown's cancel_futures needs Python 3.9
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+
+class AsyncChat(Chat):
+    """`Chat` with an awaitable `__call__`, backed by the async provider clients."""
+    anthropic_client_cls = "toolla.anthropic_client:AsyncAnthropicClient"
+    openai_client_cls = "toolla.openai_client:AsyncOpenAIClient"
+    openai_compatible_client_cls = "toolla.openai_compatible_client:AsyncOpenAICompatibleClient"
+    ollama_guided_client_cls = "toolla.ollama_guided_client:AsyncOllamaGuidedClient"
+    hedged_client_cls = "toolla.hedging:AsyncHedgedClient"
+
+    async def __call__(
+        self,
+        prompt: str,
+        image: Union[str, None] = None, # base64 string
+        current_fn_response = None,
+        disable_auto_execution = False,
+    ):
+        return await self.client(
+            prompt=prompt,
+            image=image,
+            current_fn_response=current_fn_response,
+            disable_auto_execution=disable_auto_execution,
+        )
+
+    async def _run_batch_item(self, index: int, kwargs: Dict) -> BatchResult:
+        chat = self.clone()
+        try:
+            value = await chat(**kwargs)
+        except Exception as e:
+            return BatchResult(index, kwargs["prompt"], error=e, messages=chat.get_messages())
+        return BatchResult(index, kwargs["prompt"], value=value, messages=chat.get_messages())
+
+    async def batch(
+        self,
+        items: Iterable[Union[str, Dict]],
+        max_concurrency: int = 8,
+        **call_kwargs,
+    ) -> AsyncIterator[BatchResult]:
+        """Async version of `Chat.batch`, iterate it with `async for`."""
+        items = enumerate(items)
+
+        def submit(i, item):
+            return asyncio.ensure_future(self._run_batch_item(i, _batch_call_kwargs(item, call_kwargs)))
+
+        pending = {submit(i, item) for i, item in itertools.islice(items, max_concurrency)}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    for i, item in itertools.islice(items, 1):
+                        pending.add(submit(i, item))
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
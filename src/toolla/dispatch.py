@@ -0,0 +1,58 @@
+from typing import Any, Dict, Union
+from toolla.cache import ResponseCache
+from toolla.rate_limit import RateLimiter
+
+def _create_fn(resource, rate_limiter: Union[RateLimiter, None]):
+    # Raw responses carry the rate limit headers the limiter learns from
+    if rate_limiter is not None and hasattr(resource, "with_raw_response"):
+        return resource.with_raw_response.create
+    return resource.create
+
+def send(
+    resource,
+    scope: str,
+    kwargs: Dict[str, Any],
+    *,
+    rate_limiter: Union[RateLimiter, None] = None,
+    response_cache: Union[ResponseCache, None] = None,
+    estimated_tokens: int = 0,
+    retry_transient: bool = True,
+):
+    """
+    Send a request through `resource.create` (e.g. `client.messages` or
+    `client.chat.completions`), consulting the response cache first and
+    then going through the rate limiter.  `retry_transient=False` leaves
+    transient failures to the caller.
+    """
+    create = _create_fn(resource, rate_limiter)
+
+    def request(**kwargs):
+        if rate_limiter is None:
+            return create(**kwargs)
+        return rate_limiter.call(create, kwargs, estimated_tokens, retry_transient)
+
+    if response_cache is not None:
+        return response_cache.call(request, scope, kwargs)
+    return request(**kwargs)
+
+async def send_async(
+    resource,
+    scope: str,
+    kwargs: Dict[str, Any],
+    *,
+    rate_limiter: Union[RateLimiter, None] = None,
+    response_cache: Union[ResponseCache, None] = None,
+    estimated_tokens: int = 0,
+    retry_transient: bool = True,
+):
+    """`send` for async SDK clients."""
+    create = _create_fn(resource, rate_limiter)
+
+    async def request(**kwargs):
+        if rate_limiter is None:
+            return await create(**kwargs)
+        return await rate_limiter.acall(create, kwargs, estimated_tokens, retry_transient)
+
+    if response_cache is not None:
+        return await response_cache.acall(request, scope, kwargs)
+    return await request(**kwargs)
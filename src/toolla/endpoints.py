@@ -0,0 +1,268 @@
+import threading
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Dict, List, Sequence, Union
+from toolla.rate_limit import RateLimiter, rate_limiters
+from toolla.tracing import event
+from toolla.transports import _key_id
+
+STRATEGIES = ("least_outstanding", "latency")
+
+class Endpoint:
+    """One node of an `EndpointPool`: a base URL with its rate limiter and
+    the counts the pool balances on."""
+    def __init__(self, base_url: str, rate_limiter: Union[RateLimiter, None] = None):
+        self.base_url = base_url
+        self.rate_limiter = rate_limiter
+        self.outstanding = 0
+        # Moving average of successful request latency, in seconds
+        self.latency = None
+        self.consecutive_failures = 0
+        self.healthy = True
+        self.requests = 0
+        self.failures = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "base_url": self.base_url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "latency": self.latency,
+            "requests": self.requests,
+            "failures": self.failures,
+        }
+
+    def __repr__(self) -> str:
+        return f"Endpoint({self.base_url!r}, healthy={self.healthy})"
+
+class EndpointPool:
+    """
+    Balances requests over several endpoints serving the same model.
+
+    "least_outstanding" sends each request to the healthy endpoint with the
+    fewest requests in flight.  "latency" weighs that by the endpoint's
+    moving average latency, so slower nodes get proportionally less.  Ties
+    go round robin.
+
+    A request that fails with an error `retryable` accepts (a connection
+    error, 429 or 5xx) is retried on another endpoint.  After `eject_after`
+    such failures in a row an endpoint is ejected.  While any endpoint is
+    ejected, a background thread calls `probe(endpoint)` on it every
+    `probe_interval` seconds and brings it back once that returns True.
+    If every endpoint is ejected, requests go to the ejected ones rather
+    than failing outright.  The thread stops once no endpoint is ejected,
+    or the pool is closed or garbage collected.
+    """
+    def __init__(
+        self,
+        endpoints: Sequence[Endpoint],
+        strategy: str = "least_outstanding",
+        eject_after: int = 3,
+        probe: Union[Callable[[Endpoint], bool], None] = None,
+        probe_interval: float = 5.0,
+        latency_weight: float = 0.3,
+    ):
+        self._closed = threading.Event()
+        if strategy not in STRATEGIES:
+            raise ValueError(f"strategy must be one of {STRATEGIES}")
+        if not endpoints:
+            raise ValueError("An endpoint pool needs at least one endpoint")
+        self.endpoints = list(endpoints)
+        self.strategy = strategy
+        self.eject_after = eject_after
+        self.probe = probe
+        self.probe_interval = probe_interval
+        self.latency_weight = latency_weight
+        self._next = 0
+        self._lock = threading.Lock()
+        self._probing = False
+
+    def _score(self, endpoint: Endpoint) -> float:
+        if self.strategy == "latency":
+            # Unmeasured endpoints score 0, so each gets tried early
+            return (endpoint.latency or 0.0) * (endpoint.outstanding + 1)
+        return endpoint.outstanding
+
+    def acquire(self, exclude: Sequence[Endpoint] = ()) -> Union[Endpoint, None]:
+        """Pick an endpoint for a request and count it as outstanding, or
+        return None if every endpoint is in `exclude`."""
+        with self._lock:
+            candidates = [e for e in self.endpoints if e not in exclude]
+            candidates = [e for e in candidates if e.healthy] or candidates
+            if not candidates:
+                return None
+            # Rotate the start so that ties go round robin
+            start = self._next % len(candidates)
+            self._next += 1
+            rotated = candidates[start:] + candidates[:start]
+            endpoint = min(rotated, key=self._score)
+            endpoint.outstanding += 1
+            return endpoint
+
+    def release(self, endpoint: Endpoint, latency: Union[float, None] = None, failed: bool = False):
+        """Record the outcome of a request from `acquire`."""
+        with self._lock:
+            endpoint.outstanding -= 1
+            endpoint.requests += 1
+            if not failed:
+                endpoint.consecutive_failures = 0
+                if latency is not None:
+                    endpoint.latency = latency if endpoint.latency is None else (
+                        self.latency_weight * latency + (1 - self.latency_weight) * endpoint.latency
+                    )
+                return
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            if not endpoint.healthy or endpoint.consecutive_failures < self.eject_after:
+                return
+            endpoint.healthy = False
+            start_probing = self.probe is not None and not self._probing
+            if start_probing:
+                self._probing = True
+        event("endpoint_ejected", "endpoint", base_url=endpoint.base_url)
+        if start_probing:
+            # The thread holds the pool weakly, so dropping the pool stops it
+            threading.Thread(
+                target=_probe_ejected,
+                args=(weakref.ref(self), self._closed),
+                name="toolla-probe",
+                daemon=True,
+            ).start()
+
+    def _probe_once(self) -> bool:
+        """Probe every ejected endpoint, returning False if there are none."""
+        with self._lock:
+            ejected = [e for e in self.endpoints if not e.healthy]
+            if not ejected:
+                self._probing = False
+                return False
+        for endpoint in ejected:
+            try:
+                healthy = self.probe(endpoint)
+            except Exception:
+                healthy = False
+            if healthy:
+                with self._lock:
+                    endpoint.healthy = True
+                    endpoint.consecutive_failures = 0
+        return True
+
+    def _failed_over(self, endpoint: Endpoint, error: Exception):
+        event("failover", "endpoint", base_url=endpoint.base_url, error=repr(error))
+
+    def call(self, send: Callable[[Endpoint], Any], retryable: Callable[[Exception], bool]):
+        """`send(endpoint)` on a chosen endpoint, failing over to the others
+        on retryable errors."""
+        tried = []
+        while True:
+            endpoint = self.acquire(exclude=tried)
+            start = time.perf_counter()
+            try:
+                result = send(endpoint)
+            except Exception as e:
+                failed = retryable(e)
+                self.release(endpoint, failed=failed)
+                tried.append(endpoint)
+                if not failed or len(tried) == len(self.endpoints):
+                    raise
+                self._failed_over(endpoint, e)
+                continue
+            except BaseException:
+                # Cancelled, which says nothing about the endpoint
+                self.release(endpoint)
+                raise
+            self.release(endpoint, latency=time.perf_counter() - start)
+            return result
+
+    async def acall(self, send: Callable[[Endpoint], Awaitable], retryable: Callable[[Exception], bool]):
+        """`call` for an awaitable `send`."""
+        tried = []
+        while True:
+            endpoint = self.acquire(exclude=tried)
+            start = time.perf_counter()
+            try:
+                result = await send(endpoint)
+            except Exception as e:
+                failed = retryable(e)
+                self.release(endpoint, failed=failed)
+                tried.append(endpoint)
+                if not failed or len(tried) == len(self.endpoints):
+                    raise
+                self._failed_over(endpoint, e)
+                continue
+            except BaseException:
+                # Cancelled, which says nothing about the endpoint
+                self.release(endpoint)
+                raise
+            self.release(endpoint, latency=time.perf_counter() - start)
+            return result
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [e.stats() for e in self.endpoints]
+
+    def close(self):
+        """Stop probing ejected endpoints."""
+        self._closed.set()
+
+    def __del__(self):
+        self._closed.set()
+
+def _probe_ejected(pool_ref: "weakref.ref[EndpointPool]", closed: threading.Event):
+    while True:
+        pool = pool_ref()
+        if pool is None:
+            return
+        interval = pool.probe_interval
+        del pool
+        if closed.wait(interval):
+            return
+        pool = pool_ref()
+        if pool is None or not pool._probe_once():
+            return
+        del pool
+
+class EndpointPoolRegistry:
+    """
+    Process-wide `EndpointPool`s, one per list of base URLs, model, API key
+    and strategy, so that every chat balancing over the same nodes shares
+    their health, load and latency.  Each node gets the rate limiter of
+    `rate_limiters` for its URL and the model.
+    """
+    def __init__(self):
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        base_urls: Sequence[str],
+        model: str,
+        api_key: Union[str, None] = None,
+        strategy: str = "least_outstanding",
+        probe: Union[Callable[[Endpoint], bool], None] = None,
+        **kwargs,
+    ) -> EndpointPool:
+        """The pool for these endpoints, built with `probe` and `kwargs`
+        (see `EndpointPool`) if there isn't one yet."""
+        key = (tuple(base_urls), model, _key_id(api_key), strategy)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = EndpointPool(
+                    [Endpoint(url, rate_limiters.get(url, model)) for url in base_urls],
+                    strategy=strategy,
+                    probe=probe,
+                    **kwargs,
+                )
+                self._pools[key] = pool
+            return pool
+
+    def clear(self):
+        """Close and forget every pool."""
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.close()
+
+endpoint_pools = EndpointPoolRegistry()
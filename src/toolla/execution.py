@@ -0,0 +1,254 @@
+import asyncio
+import functools
+import inspect
+import os
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from concurrent.futures import BrokenExecutor, TimeoutError as FuturesTimeoutError
+from typing import TYPE_CHECKING, Any, Callable, Dict, Union
+from toolla.tracing import event
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+EXECUTION_MODES = ("inline", "thread", "process")
+
+# Attribute set by `execution_policy` on a tool function
+_POLICY_ATTR = "toolla_execution_policy"
+
+class ToolError(str):
+    """Error message returned to the model in place of a tool's result."""
+
+_pool_lock = threading.Lock()
+_thread_pool = None
+_process_pool = None
+_process_slots = None
+
+def get_policy_thread_pool() -> ThreadPoolExecutor:
+    """Pool for "thread" tools.  It is separate from the tool executor, whose
+    threads wait on these calls."""
+    global _thread_pool
+    with _pool_lock:
+        if _thread_pool is None:
+            _thread_pool = ThreadPoolExecutor(thread_name_prefix="toolla-policy")
+        return _thread_pool
+
+def get_process_pool() -> "ProcessPoolExecutor":
+    """Pool for "process" tools, one worker per core.  Workers are spawned
+    rather than forked, as the parent has threads running."""
+    # multiprocessing is only imported once a process tool runs
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    global _process_pool
+    with _pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=os.cpu_count(),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _process_pool
+
+def _discard_process_pool(pool: "ProcessPoolExecutor"):
+    """Kill the workers of a pool broken by a crashed call.  Calls still
+    running on it have failed already and the next call starts a new pool."""
+    global _process_pool
+    with _pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    processes = list((getattr(pool, "_processes", None) or {}).values())
+    # No cancel_futures (Python 3.9+): a broken pool has failed its queued calls
+    pool.shutdown(wait=False)
+    for process in processes:
+        process.terminate()
+
+def _get_process_slots() -> threading.BoundedSemaphore:
+    global _process_slots
+    with _pool_lock:
+        if _process_slots is None:
+            _process_slots = threading.BoundedSemaphore(os.cpu_count() or 1)
+        return _process_slots
+
+class _ProcessCrashed(BrokenExecutor):
+    """The process running a call exited without a result."""
+
+class _ProcessTimedOut(FuturesTimeoutError):
+    """The process running a call was killed at its timeout."""
+
+def _run_child(conn, f: Callable, inputs: Dict[str, Any]):
+    # The timeout runs from here, not from the process start
+    conn.send(("started", None))
+    try:
+        outcome = ("result", f(**inputs))
+    except BaseException as e:
+        outcome = ("error", e)
+    try:
+        conn.send(outcome)
+    except Exception as e:
+        # An unpicklable result or exception
+        conn.send(("error", RuntimeError(repr(e))))
+    conn.close()
+
+def run_in_process(f: Callable, inputs: Dict[str, Any], timeout: Union[float, None]) -> Any:
+    """
+    `f(**inputs)` in a process started for this call, at most one per core
+    at a time.  If it runs longer than `timeout` seconds the process is
+    killed and a `TimeoutError` raised, which leaves every other call alone.
+    """
+    import multiprocessing
+    context = multiprocessing.get_context("spawn")
+    with _get_process_slots():
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=_run_child, args=(sender, f, inputs), daemon=True)
+        process.start()
+        sender.close()
+        try:
+            receiver.recv()
+            if not receiver.poll(timeout):
+                process.kill()
+                raise _ProcessTimedOut
+            kind, value = receiver.recv()
+        except EOFError:
+            raise _ProcessCrashed(f"exit code {process.exitcode}") from None
+        finally:
+            process.join()
+            receiver.close()
+    if kind == "error":
+        raise value
+    return value
+
+class ExecutionPolicy:
+    """
+    How a tool is run.  "inline" calls it on the thread running the tool
+    calls, "thread" on a thread pool and "process" on a process pool, so
+    CPU-bound tools use every core.  Process tools and their arguments
+    and results must be picklable, so the tool must be a module level
+    function.
+
+    A call running longer than `timeout` seconds is abandoned.  Process
+    tools with a timeout get a process of their own per call (see
+    `run_in_process`), so a hung call is killed without failing calls of
+    other conversations; this costs a process start per call.  A thread
+    can't be killed, so a hung thread tool keeps its thread until it
+    returns.  Timeouts of sync tools need "thread" or "process".  A worker
+    crashing breaks the shared process pool, failing the calls running on
+    it, and a new pool is started.  Under a policy, a tool that times out,
+    raises or crashes its process returns an error string to the model
+    instead of failing the chat.  `executor` replaces the shared pool for
+    the tool; its workers are never killed.
+    """
+    def __init__(
+        self,
+        mode: str = "inline",
+        timeout: Union[float, None] = None,
+        executor: Union[Executor, None] = None,
+    ):
+        if mode not in EXECUTION_MODES:
+            raise ValueError(f"mode must be one of {EXECUTION_MODES}")
+        self.mode = mode
+        self.timeout = timeout
+        self.executor = executor
+
+    def _pool(self) -> Executor:
+        if self.executor is not None:
+            return self.executor
+        if self.mode == "process":
+            return get_process_pool()
+        return get_policy_thread_pool()
+
+    def _own_process(self) -> bool:
+        """Whether calls run in a process of their own."""
+        return self.mode == "process" and self.timeout is not None and self.executor is None
+
+    def _timed_out(self, name: str) -> str:
+        event("tool_timeout", "tool", tool=name, timeout=self.timeout, mode=self.mode)
+        return ToolError(f"Error: tool {name} timed out after {self.timeout} seconds.")
+
+    def _failed(self, name: str, error: BaseException, pool: Union[Executor, None]) -> str:
+        event("tool_error", "tool", tool=name, error=repr(error), mode=self.mode)
+        # BrokenProcessPool, without importing multiprocessing to check for it
+        if isinstance(error, BrokenExecutor) and self.mode == "process":
+            if pool is not None and pool is not self.executor:
+                _discard_process_pool(pool)
+            return ToolError(f"Error: tool {name} crashed its process.")
+        return ToolError(f"Error: tool {name} raised {type(error).__name__}: {error}")
+
+    def call(self, name: str, f: Callable, inputs: Dict[str, Any]) -> Any:
+        pool = None
+        try:
+            if self.mode == "inline":
+                return f(**inputs)
+            if self._own_process():
+                try:
+                    return run_in_process(f, inputs, self.timeout)
+                except _ProcessTimedOut:
+                    return self._timed_out(name)
+            pool = self._pool()
+            future = pool.submit(f, **inputs)
+            try:
+                return future.result(timeout=self.timeout)
+            except FuturesTimeoutError:
+                future.cancel()
+                return self._timed_out(name)
+        except Exception as e:
+            return self._failed(name, e, pool)
+
+    async def call_async(self, name: str, f: Callable, inputs: Dict[str, Any]) -> Any:
+        pool = None
+        try:
+            if self.mode == "inline":
+                if inspect.iscoroutinefunction(f):
+                    return await asyncio.wait_for(f(**inputs), self.timeout)
+                # Off the loop's thread, so a blocking tool doesn't stall it
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(get_policy_thread_pool(), functools.partial(f, **inputs))
+            if self._own_process():
+                # Waited on from a thread, which kills the process on timeout
+                future = get_policy_thread_pool().submit(run_in_process, f, inputs, self.timeout)
+                return await asyncio.wrap_future(future)
+            pool = self._pool()
+            # Cancelling the awaiting task cancels the call if it hasn't started
+            future = asyncio.wrap_future(pool.submit(f, **inputs))
+            return await asyncio.wait_for(future, self.timeout)
+        except (asyncio.TimeoutError, _ProcessTimedOut):
+            return self._timed_out(name)
+        except Exception as e:
+            return self._failed(name, e, pool)
+
+    def bind(self, name: str, f: Callable) -> Callable:
+        """`f` as a function of its inputs that runs under this policy."""
+        @functools.wraps(f)
+        def run(**inputs):
+            return self.call(name, f, inputs)
+        return run
+
+    def bind_async(self, name: str, f: Callable) -> Callable:
+        @functools.wraps(f)
+        async def run(**inputs):
+            return await self.call_async(name, f, inputs)
+        return run
+
+def execution_policy(
+    mode: str = "inline",
+    timeout: Union[float, None] = None,
+    executor: Union[Executor, None] = None,
+) -> Callable[[Callable], Callable]:
+    """
+    Decorator setting the `ExecutionPolicy` a tool runs under.
+
+        @execution_policy("process", timeout=30)
+        def factorize(n: int) -> str:
+            ...
+    """
+    policy = ExecutionPolicy(mode, timeout, executor)
+
+    def decorator(f: Callable) -> Callable:
+        if inspect.iscoroutinefunction(f) and mode != "inline":
+            raise ValueError("Coroutine tools can only run inline")
+        if timeout is not None and mode == "inline" and not inspect.iscoroutinefunction(f):
+            raise ValueError('Timeouts of sync tools need mode "thread" or "process"')
+        setattr(f, _POLICY_ATTR, policy)
+        return f
+    return decorator
+
+def tool_execution_policy(f: Callable) -> Union[ExecutionPolicy, None]:
+    return getattr(f, _POLICY_ATTR, None)
@@ -0,0 +1,227 @@
+import asyncio
+import copy
+import threading
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Union
+from toolla.history import MessageHistory
+from toolla.messages import SYSTEM
+from toolla.steps import run_steps, run_steps_async
+from toolla.tracing import current_tracer, event
+
+# Each hedged request holds up to two threads while it waits on the
+# network, so the pool is sized for concurrent requests, not cores.  Threads
+# are only started when none is idle.
+HEDGE_MAX_THREADS = 256
+
+_executor_lock = threading.Lock()
+_hedge_executor = None
+
+def get_hedge_executor() -> ThreadPoolExecutor:
+    """Threads the requests of sync hedged clients are sent from."""
+    global _hedge_executor
+    with _executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(
+                max_workers=HEDGE_MAX_THREADS,
+                thread_name_prefix="toolla-hedge",
+            )
+        return _hedge_executor
+
+def _discard(response):
+    # An unread stream holds its connection open until closed
+    close = getattr(response, "close", None)
+    if callable(close):
+        close()
+
+class HedgedClient:
+    """
+    Sends each step's request to `primary` and, if it hasn't answered
+    within `delay` seconds or has failed, to `secondary` too.  The first
+    successful response is used and the other request is abandoned.
+
+    Both clients work on one conversation: the history lives here and is
+    handed to whichever client is sending or reading a response.  Each
+    keeps its own system prompt, so the secondary can be another provider
+    or an OpenAI compatible endpoint with its prompted tool format.  Both
+    must have been built with the same tools.
+    """
+    def __init__(
+        self,
+        primary,
+        secondary,
+        delay: float = 1.0,
+    ):
+        for client in (primary, secondary):
+            if not hasattr(client, "_send_args"):
+                raise ValueError(f"{type(client).__name__} doesn't support hedged requests")
+        self.primary = primary
+        self.secondary = secondary
+        self.delay = delay
+        self.model = primary.model
+        self.max_steps = primary.max_steps
+        self.hooks = list(primary.hooks)
+        self.tracer = primary.tracer
+        self.result_store = primary.result_store
+        self.tool_fns = primary.tool_fns
+        self.serialize_message = primary.serialize_message
+        self.messages = primary.messages
+        self.hedges = 0
+        self.hedge_wins = 0
+        # The secondary's system prompt replaces the primary's in its requests
+        self._secondary_system = [m for m in secondary.messages if m.role == SYSTEM]
+        usage_fields = [
+            field
+            for client in (primary, secondary)
+            for field in getattr(client, "usage", {})
+        ]
+        if usage_fields:
+            self.usage = dict.fromkeys(usage_fields, 0)
+
+    def __copy__(self):
+        clone = object.__new__(type(self))
+        clone.__dict__.update(self.__dict__)
+        # The clients are handed this conversation's state, so a copy needs its own
+        clone.primary = copy.copy(self.primary)
+        clone.secondary = copy.copy(self.secondary)
+        return clone
+
+    def _bind(self, client, messages: Union[MessageHistory, None] = None):
+        client.messages = self.messages if messages is None else messages
+        if hasattr(client, "usage") and hasattr(self, "usage"):
+            client.usage = self.usage
+
+    def _secondary_messages(self) -> MessageHistory:
+        return MessageHistory(
+            self.messages.max_chars,
+            self._secondary_system + [m for m in self.messages if m.role != SYSTEM],
+        )
+
+    def _prepare(self, client):
+        """Request arguments for `client`, built on the calling thread so
+        the history isn't read while it changes."""
+        if client is self.primary:
+            self._bind(client)
+        else:
+            self._bind(client, self._secondary_messages())
+            self.hedges += 1
+            event("hedge", "request", model=client.model, delay=self.delay)
+        return client._send_args()
+
+    def _won(self, client, response):
+        if client is self.secondary:
+            self.hedge_wins += 1
+        event("hedge_winner", "request", model=client.model, secondary=client is self.secondary)
+        return client, response
+
+    def _add_user_message(self, prompt: str, image: Union[str, None]):
+        self._bind(self.primary)
+        self.primary._add_user_message(prompt, image)
+
+    def _request(self):
+        executor = get_hedge_executor()
+        tracer = current_tracer()
+
+        started = threading.Event()
+
+        def send(client, args):
+            started.set()
+            # Recorded with this chat's tracer on the executor thread
+            with tracer.span("hedged_request", "request", model=client.model) if tracer else nullcontext():
+                return client._send(*args)
+
+        pending = {executor.submit(send, self.primary, self._prepare(self.primary)): self.primary}
+        # Time spent queued for a thread doesn't count towards the delay
+        started.wait()
+        hedged = False
+        errors = []
+        while pending:
+            done, _ = wait(pending, timeout=None if hedged else self.delay, return_when=FIRST_COMPLETED)
+            for future in done:
+                client = pending.pop(future)
+                if future.exception() is None:
+                    for loser in pending:
+                        if not loser.cancel():
+                            loser.add_done_callback(
+                                lambda f: f.exception() is None and _discard(f.result())
+                            )
+                    return self._won(client, future.result())
+                errors.append(future.exception())
+            if not hedged:
+                hedged = True
+                future = executor.submit(send, self.secondary, self._prepare(self.secondary))
+                pending[future] = self.secondary
+        raise errors[0]
+
+    def _collect_tool_calls(self, response, disable_auto_execution):
+        client, response = response
+        # The winner records its reply in this conversation
+        self._bind(client)
+        return client._collect_tool_calls(response, disable_auto_execution)
+
+    def _run_tool_calls(self, calls):
+        return self.primary._run_tool_calls(calls)
+
+    def __call__(
+        self,
+        prompt: str,
+        image: Union[str, None] = None,
+        current_fn_response = None,
+        disable_auto_execution = False,
+    ):
+        return run_steps(
+            self,
+            prompt,
+            image=image,
+            current_fn_response=current_fn_response,
+            disable_auto_execution=disable_auto_execution,
+            hooks=self.hooks,
+        )
+
+class AsyncHedgedClient(HedgedClient):
+    """`HedgedClient` for async clients.  The losing request is cancelled."""
+    async def _request(self):
+        pending = {
+            asyncio.ensure_future(self.primary._send(*self._prepare(self.primary))): self.primary
+        }
+        hedged = False
+        errors = []
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=None if hedged else self.delay,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    client = pending.pop(task)
+                    if task.exception() is None:
+                        return self._won(client, task.result())
+                    errors.append(task.exception())
+                if not hedged:
+                    hedged = True
+                    task = asyncio.ensure_future(self.secondary._send(*self._prepare(self.secondary)))
+                    pending[task] = self.secondary
+            raise errors[0]
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _run_tool_calls(self, calls):
+        return await self.primary._run_tool_calls(calls)
+
+    async def __call__(
+        self,
+        prompt: str,
+        image: Union[str, None] = None,
+        current_fn_response = None,
+        disable_auto_execution = False,
+    ):
+        return await run_steps_async(
+            self,
+            prompt,
+            image=image,
+            current_fn_response=current_fn_response,
+            disable_auto_execution=disable_auto_execution,
+            hooks=self.hooks,
+        )
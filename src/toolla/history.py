@@ -0,0 +1,283 @@
+import itertools
+import json
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple, Union
+from toolla.exceptions import MessageTooLongException
+from toolla.messages import Message, SYSTEM, ASSISTANT
+from toolla.tracing import span
+
+# Rough conversion used to estimate token counts from history size
+CHARS_PER_TOKEN = 4
+
+def as_message(message: Union[Message, Dict]) -> Message:
+    """`message` as a `Message`, converting provider style dicts."""
+    if isinstance(message, Message):
+        return message
+    return Message.from_dict(message)
+
+def message_size(message: Union[Message, Dict]) -> int:
+    """Number of characters `message` contributes to the context budget."""
+    return as_message(message).size
+
+class SerializedView:
+    """Read-only sequence over `messages` that converts each one with
+    `serialize` only when it is read."""
+    def __init__(self, messages, serialize: Callable[[Message], Dict[str, Any]]):
+        self.messages = messages
+        self.serialize = serialize
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return (self.serialize(m) for m in self.messages)
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        return self.serialize(self.messages[index])
+
+class MessageLog:
+    """
+    Append-only log of every message in a conversation, stored as JSONL
+    segment files in `directory`.  A new segment is started once the current
+    one reaches `segment_max_bytes`.  Reading iterates the segments lazily,
+    so the full history never has to be held in memory.  The number of
+    messages in each segment is kept, so indexing reads a single segment.
+    Opening a directory that already holds segments continues that log.
+    """
+    def __init__(self, directory: Union[str, Path], segment_max_bytes: int = 4 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_max_bytes = segment_max_bytes
+        self._file = None
+        self._path = None
+        # [path, message count] per segment, counted on first use
+        self._index = None
+
+    def _segments(self) -> List[Path]:
+        return sorted(self.directory.glob("segment-*.jsonl"))
+
+    def _writable_segment(self, size: int):
+        if self._file is not None and self._file.tell() + size <= self.segment_max_bytes:
+            return self._file
+        segments = self._segments()
+        if self._file is None and segments and segments[-1].stat().st_size + size <= self.segment_max_bytes:
+            path = segments[-1]
+        else:
+            self.close()
+            index = int(segments[-1].stem.split("-")[1]) + 1 if segments else 0
+            path = self.directory / f"segment-{index:06d}.jsonl"
+        self._file = open(path, "ab")
+        self._path = path
+        return self._file
+
+    def append(self, message: Union[Message, Dict]):
+        line = json.dumps(as_message(message).to_dict(), separators=(",", ":")).encode("utf-8") + b"\n"
+        segment = self._writable_segment(len(line))
+        segment.write(line)
+        segment.flush()
+        if self._index is not None:
+            if not self._index or self._index[-1][0] != self._path:
+                self._index.append([self._path, 0])
+            self._index[-1][1] += 1
+
+    def _segment_counts(self) -> List[List]:
+        if self._index is None:
+            self._index = []
+            for path in self._segments():
+                with open(path, "rb") as segment:
+                    self._index.append([path, sum(1 for _ in segment)])
+        return self._index
+
+    def __iter__(self) -> Iterator[Message]:
+        for path in self._segments():
+            with open(path, "rb") as segment:
+                for line in segment:
+                    yield Message.from_dict(json.loads(line))
+
+    def __len__(self) -> int:
+        return sum(count for _, count in self._segment_counts())
+
+    def __getitem__(self, index: int) -> Message:
+        if index < 0:
+            index += len(self)
+        if index >= 0:
+            for path, count in self._segment_counts():
+                if index < count:
+                    with open(path, "rb") as segment:
+                        line = next(itertools.islice(segment, index, None))
+                    return Message.from_dict(json.loads(line))
+                index -= count
+        raise IndexError("message index out of range")
+
+    def clear(self):
+        """Delete every segment."""
+        self.close()
+        for path in self._segments():
+            path.unlink()
+        self._index = []
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __repr__(self) -> str:
+        return f"MessageLog({str(self.directory)!r})"
+
+class MessageHistory:
+    """
+    Chat history that keeps a running total of message sizes so the
+    context budget can be enforced without re-stringifying every message.
+
+    Messages are stored as `Message`s, dicts are converted on append.
+    Sizes are measured once when a message is appended, so messages
+    should be complete (e.g. with any image content) before they are added.
+
+    With a `MessageLog` every appended message is also written to disk, and
+    the whole conversation stays readable through `log`.  What is held in
+    memory can then be bounded well below `max_chars` with `window_chars`
+    and `window_messages`: the oldest messages beyond either are evicted as
+    new ones arrive, keeping system messages and the newest message.
+    Messages passed to a log that already holds a conversation are taken as
+    its system prompt and aren't logged again; the window is filled from
+    the end of the log instead.
+    """
+    def __init__(
+        self,
+        max_chars: int,
+        messages: Union[Iterable[Message], None] = None,
+        log: Union[MessageLog, None] = None,
+        window_chars: Union[int, None] = None,
+        window_messages: Union[int, None] = None,
+    ):
+        self.max_chars = max_chars
+        self.log = log
+        self.window_chars = window_chars
+        self.window_messages = window_messages
+        self._messages = deque()
+        self._sizes = deque()
+        self.total_chars = 0
+        if log is not None and len(log):
+            for message in messages or []:
+                self._push(as_message(message))
+            for message in log:
+                if message.role != SYSTEM:
+                    self._push(message)
+                    self._trim(budget=True)
+        else:
+            for message in messages or []:
+                self.append(message)
+
+    @property
+    def remaining_chars(self) -> int:
+        """Characters left before the oldest messages start being evicted."""
+        return self.max_chars - self.total_chars
+
+    @property
+    def estimated_tokens(self) -> int:
+        return self.total_chars // CHARS_PER_TOKEN
+
+    def _push(self, message: Message):
+        size = message.size
+        self._messages.append(message)
+        self._sizes.append(size)
+        self.total_chars += size
+
+    def _over_window(self, budget: bool) -> bool:
+        if self.window_messages is not None and len(self._messages) > self.window_messages:
+            return True
+        if self.window_chars is not None and self.total_chars > self.window_chars:
+            return True
+        return budget and self.total_chars > self.max_chars
+
+    def _evict_oldest(self, role: Union[str, None] = None) -> bool:
+        """Evict the oldest non-system message if it isn't the newest (and,
+        with `role`, has that role)."""
+        index = next((i for i, m in enumerate(self._messages) if m.role != SYSTEM), None)
+        if index is None or index == len(self._messages) - 1:
+            return False
+        if role is not None and self._messages[index].role != role:
+            return False
+        self.total_chars -= self._sizes[index]
+        del self._sizes[index]
+        del self._messages[index]
+        return True
+
+    def _trim(self, budget: bool = False):
+        """Evict the oldest non-system messages while the window (and with
+        `budget`, `max_chars`) is exceeded, never the newest message."""
+        evicted = False
+        while self._over_window(budget) and self._evict_oldest():
+            evicted = True
+        # Providers expect the conversation to open with the user
+        while evicted and self._evict_oldest(role=ASSISTANT):
+            pass
+
+    def append(self, message: Union[Message, Dict]):
+        message = as_message(message)
+        self._push(message)
+        if self.log is not None:
+            self.log.append(message)
+        self._trim()
+
+    def popleft(self) -> Message:
+        self.total_chars -= self._sizes.popleft()
+        return self._messages.popleft()
+
+    def enforce_budget(self):
+        """Evict the oldest messages until the history fits in `max_chars`."""
+        with span("truncation", "history", total_chars=self.total_chars) as args:
+            evicted = 0
+            while self.total_chars > self.max_chars:
+                self.popleft()
+                evicted += 1
+                if not self._messages:
+                    raise MessageTooLongException
+            args["evicted"] = evicted
+
+    def clear(self, keep_roles: Tuple[str, ...] = ()):
+        """Remove every message whose role is not in `keep_roles`.  A log
+        is cleared too and restarted with the kept messages."""
+        kept = [m for m in self._messages if m.role in keep_roles]
+        if self.log is not None:
+            self.log.clear()
+        self._messages.clear()
+        self._sizes.clear()
+        self.total_chars = 0
+        for message in kept:
+            self.append(message)
+
+    def close(self):
+        """Close the log, if there is one."""
+        if self.log is not None:
+            self.log.close()
+
+    def to_list(self) -> List[Message]:
+        return list(self._messages)
+
+    def serialize(self, serialize: Callable[[Message], Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """The window as provider dicts, built with `serialize`."""
+        return [serialize(m) for m in self._messages]
+
+    def full_history(
+        self,
+        serialize: Callable[[Message], Dict[str, Any]],
+    ) -> Union[SerializedView, List[Dict[str, Any]]]:
+        """Every message of the conversation as provider dicts, including
+        ones evicted from the window.  Read lazily from the log if there is one."""
+        if self.log is not None:
+            return SerializedView(self.log, serialize)
+        return self.serialize(serialize)
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __iter__(self) -> Iterator[Message]:
+        return iter(self._messages)
+
+    def __getitem__(self, index: int) -> Message:
+        return self._messages[index]
+
+    def __repr__(self) -> str:
+        return f"MessageHistory({self.to_list()!r})"
@@ -0,0 +1,143 @@
+import sys
+from typing import Any, Dict, Tuple, Union
+
+SYSTEM = "system"
+USER = "user"
+ASSISTANT = "assistant"
+
+# Rough per-message and per-part size of the wire format around the content,
+# so budgets measured on messages stay close to what is actually sent
+MESSAGE_OVERHEAD_CHARS = 30
+PART_OVERHEAD_CHARS = 30
+
+class TextPart:
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, TextPart) and other.text == self.text
+
+    def __repr__(self) -> str:
+        return f"TextPart({self.text!r})"
+
+class ImagePart:
+    """A base64 encoded image."""
+    __slots__ = ("media_type", "data")
+
+    def __init__(self, media_type: str, data: str):
+        self.media_type = media_type
+        self.data = data
+
+    def __eq__(self, other) -> bool:
+        return (
+            isinstance(other, ImagePart)
+            and other.media_type == self.media_type
+            and other.data == self.data
+        )
+
+    def __repr__(self) -> str:
+        return f"ImagePart({self.media_type!r}, <{len(self.data)} chars>)"
+
+Part = Union[TextPart, ImagePart]
+
+class Message:
+    """
+    Provider-neutral chat message.  `content` is either a plain string or a
+    tuple of parts.  Roles are interned so every message shares one string
+    per role.  Provider dicts are built from messages only when a request
+    is sent, see `to_anthropic` and `to_openai`.
+    """
+    __slots__ = ("role", "content", "size")
+
+    def __init__(self, role: str, content: Union[str, Tuple[Part, ...], None]):
+        self.role = sys.intern(role)
+        if content is None:
+            content = ""
+        self.content = content if isinstance(content, str) else tuple(content)
+        self.size = _content_size(self.content)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Compact JSON-serializable form, as stored in a `MessageLog`."""
+        if isinstance(self.content, str):
+            return {"role": self.role, "content": self.content}
+        parts = []
+        for part in self.content:
+            if isinstance(part, TextPart):
+                parts.append({"type": "text", "text": part.text})
+            else:
+                parts.append({"type": "image", "media_type": part.media_type, "data": part.data})
+        return {"role": self.role, "content": parts}
+
+    @classmethod
+    def from_dict(cls, message: Dict[str, Any]) -> "Message":
+        """Build a message from `to_dict` output or an Anthropic or OpenAI
+        style message dict."""
+        content = message["content"]
+        if content is None or isinstance(content, str):
+            return cls(message["role"], content or "")
+        return cls(message["role"], tuple(_part_from_dict(p) for p in content))
+
+    def __eq__(self, other) -> bool:
+        return (
+            isinstance(other, Message)
+            and other.role == self.role
+            and other.content == self.content
+        )
+
+    def __repr__(self) -> str:
+        return f"Message({self.role!r}, {self.content!r})"
+
+def _content_size(content: Union[str, Tuple[Part, ...]]) -> int:
+    if isinstance(content, str):
+        return MESSAGE_OVERHEAD_CHARS + len(content)
+    size = MESSAGE_OVERHEAD_CHARS
+    for part in content:
+        size += PART_OVERHEAD_CHARS
+        size += len(part.text) if isinstance(part, TextPart) else len(part.data)
+    return size
+
+def _part_from_dict(part: Dict[str, Any]) -> Part:
+    if part["type"] == "text":
+        return TextPart(part["text"])
+    if part["type"] == "image_url":
+        # data:<media type>;base64,<data>
+        header, data = part["image_url"]["url"].split(",", 1)
+        return ImagePart(header[len("data:"):].split(";")[0], data)
+    source = part.get("source", part)
+    return ImagePart(source["media_type"], source["data"])
+
+def to_anthropic(message: Message) -> Dict[str, Any]:
+    """Messages API dict for `message`."""
+    if isinstance(message.content, str):
+        return {"role": message.role, "content": message.content}
+    content = []
+    for part in message.content:
+        if isinstance(part, TextPart):
+            content.append({"type": "text", "text": part.text})
+        else:
+            content.append({
+                "type": "image",
+                "source": {
+                    "type": "base64",
+                    "media_type": part.media_type,
+                    "data": part.data,
+                },
+            })
+    return {"role": message.role, "content": content}
+
+def to_openai(message: Message) -> Dict[str, Any]:
+    """Chat completions dict for `message`."""
+    if isinstance(message.content, str):
+        return {"role": message.role, "content": message.content}
+    content = []
+    for part in message.content:
+        if isinstance(part, TextPart):
+            content.append({"type": "text", "text": part.text})
+        else:
+            content.append({
+                "type": "image_url",
+                "image_url": {"url": f"data:{part.media_type};base64,{part.data}"},
+            })
+    return {"role": message.role, "content": content}
@@ -0,0 +1,384 @@
+import itertools
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Sequence, Tuple, Union
+from toolla.utils import extract_json_objects
+
+# Stand-in for the Anthropic Messages, OpenAI Chat Completions and Ollama
+# /api/chat and /api/generate endpoints, for offline end-to-end and load tests.
+
+class MockReply:
+    """What the mock model answers: text, tool calls, or both."""
+    def __init__(self, text: str = "", tool_calls: Sequence[Tuple[str, Dict[str, Any]]] = ()):
+        self.text = text
+        self.tool_calls = list(tool_calls)
+
+def text_reply(text: str) -> MockReply:
+    return MockReply(text=text)
+
+def tool_reply(*calls: Tuple[str, Dict[str, Any]], text: str = "") -> MockReply:
+    return MockReply(text=text, tool_calls=calls)
+
+class MockRequest:
+    """A decoded request, as passed to a script callable."""
+    def __init__(self, protocol: str, path: str, body: Dict[str, Any]):
+        self.protocol = protocol
+        self.path = path
+        self.body = body
+        messages = body.get("messages") or []
+        # Tool results go back to the model as user messages, so this counts
+        # the steps so far and a stateless script can answer each differently
+        self.turn = max(0, sum(1 for m in messages if m.get("role") == "user") - 1)
+
+Script = Union[Sequence[MockReply], Callable[[MockRequest], MockReply]]
+
+def fixed_latency(seconds: float) -> Callable[[], float]:
+    return lambda: seconds
+
+def uniform_latency(low: float, high: float, seed: Union[int, None] = None) -> Callable[[], float]:
+    rng = random.Random(seed)
+    return lambda: rng.uniform(low, high)
+
+def lognormal_latency(median: float, sigma: float = 0.5, seed: Union[int, None] = None) -> Callable[[], float]:
+    """Long-tailed latencies around `median` seconds, like real model APIs."""
+    rng = random.Random(seed)
+    mu = math.log(median)
+    return lambda: rng.lognormvariate(mu, sigma)
+
+def _approx_tokens(value) -> int:
+    return max(1, len(json.dumps(value)) // 4)
+
+def _tool_call_json(name: str, inputs: Dict[str, Any]) -> str:
+    return json.dumps({"tool": name, "inputs": inputs})
+
+class MockServer:
+    """
+    Local HTTP server speaking the Anthropic, OpenAI and Ollama protocols.
+
+    Replies come from `script`: either a list of `MockReply`s indexed by the
+    conversation's turn (the last one repeats), or a callable taking a
+    `MockRequest`.  Ollama /api/generate answers with the first JSON object
+    in its prompt, as the model parsing a reply would.  `latency` is seconds
+    or a callable returning seconds, see `fixed_latency`, `uniform_latency`
+    and `lognormal_latency`.  A fraction `error_rate` of requests fails with
+    `error_status`, with a `retry_after` header when it is set.
+
+        with MockServer(script=[tool_reply(("add", {"x": 1, "y": 2})), text_reply("3")]) as server:
+            anthropic.Anthropic(base_url=server.url, api_key="mock")
+            openai.OpenAI(base_url=server.url + "/v1", api_key="mock")
+            Chat(model="llama3.1", base_url=server.url, ollama_guided=True)
+    """
+    def __init__(
+        self,
+        script: Union[Script, None] = None,
+        latency: Union[float, Callable[[], float], None] = None,
+        error_rate: float = 0.0,
+        error_status: int = 429,
+        retry_after: Union[float, None] = None,
+        seed: Union[int, None] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.script = script if script is not None else [text_reply("ok")]
+        self.latency = fixed_latency(latency) if isinstance(latency, (int, float)) else latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_cls())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockServer":
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever,
+            kwargs={"poll_interval": 0.05},
+            daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "MockServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"requests": self.requests, "errors": self.errors}
+
+    def _reply(self, request: MockRequest) -> MockReply:
+        if callable(self.script):
+            return self.script(request)
+        return self.script[min(request.turn, len(self.script) - 1)]
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            fail = self.error_rate > 0 and self._random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+            return fail
+
+    def _next_id(self) -> int:
+        with self._lock:
+            return next(self._ids)
+
+    def _handler_cls(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are separate writes, which Nagle's algorithm
+            # would otherwise hold back for a delayed ACK
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                # Model lists, which health checks of a node ask for
+                path = self.path.split("?")[0]
+                if path not in ("/v1/models", "/models", "/api/tags"):
+                    self._send_json(404, {"error": f"unknown path {path}"})
+                    return
+                if server._should_fail():
+                    self._send_error("ollama_chat" if path == "/api/tags" else "openai")
+                    return
+                if path == "/api/tags":
+                    self._send_json(200, {"models": [{"name": "mock", "model": "mock"}]})
+                else:
+                    self._send_json(200, {
+                        "object": "list",
+                        "data": [{"id": "mock", "object": "model", "created": 0, "owned_by": "mock"}],
+                    })
+
+            def do_POST(self):
+                length = int(self.headers.get("content-length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                path = self.path.split("?")[0]
+                protocols = {
+                    "/v1/messages": "anthropic",
+                    "/v1/chat/completions": "openai",
+                    "/chat/completions": "openai",
+                    "/api/chat": "ollama_chat",
+                    "/api/generate": "ollama_generate",
+                }
+                protocol = protocols.get(path)
+                if protocol is None:
+                    self._send_json(404, {"error": f"unknown path {path}"})
+                    return
+                if server.latency is not None:
+                    time.sleep(max(0.0, server.latency()))
+                if server._should_fail():
+                    self._send_error(protocol)
+                    return
+                if protocol == "ollama_generate":
+                    self._send_ollama_generate(body)
+                    return
+                reply = server._reply(MockRequest(protocol, path, body))
+                if protocol == "anthropic":
+                    self._send_anthropic(body, reply)
+                elif protocol == "openai":
+                    self._send_openai(body, reply)
+                else:
+                    self._send_ollama_chat(body, reply)
+
+            def _send_json(self, status: int, payload, headers: Union[Dict[str, str], None] = None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_events(self, events: List[Tuple[Union[str, None], Any]]):
+                self.send_response(200)
+                self.send_header("content-type", "text/event-stream")
+                self.send_header("cache-control", "no-cache")
+                self.send_header("connection", "close")
+                self.end_headers()
+                for name, data in events:
+                    payload = data if isinstance(data, str) else json.dumps(data)
+                    chunk = (f"event: {name}\n" if name else "") + f"data: {payload}\n\n"
+                    self.wfile.write(chunk.encode("utf-8"))
+                    self.wfile.flush()
+                self.close_connection = True
+
+            def _send_error(self, protocol: str):
+                headers = {}
+                if server.retry_after is not None:
+                    headers["retry-after"] = str(server.retry_after)
+                message = "Injected error from mock server"
+                if protocol == "anthropic":
+                    payload = {"type": "error", "error": {"type": "rate_limit_error", "message": message}}
+                elif protocol == "openai":
+                    payload = {"error": {"message": message, "type": "rate_limit_exceeded", "code": None}}
+                else:
+                    payload = {"error": message}
+                self._send_json(server.error_status, payload, headers)
+
+            def _send_anthropic(self, body, reply: MockReply):
+                n = server._next_id()
+                content = []
+                if reply.text:
+                    content.append({"type": "text", "text": reply.text})
+                for i, (name, inputs) in enumerate(reply.tool_calls):
+                    content.append({"type": "tool_use", "id": f"toolu_mock_{n}_{i}", "name": name, "input": inputs})
+                usage = {
+                    "input_tokens": _approx_tokens(body.get("messages")),
+                    "output_tokens": _approx_tokens(content),
+                }
+                message = {
+                    "id": f"msg_mock_{n}",
+                    "type": "message",
+                    "role": "assistant",
+                    "model": body.get("model"),
+                    "content": content,
+                    "stop_reason": "tool_use" if reply.tool_calls else "end_turn",
+                    "stop_sequence": None,
+                    "usage": usage,
+                }
+                if not body.get("stream"):
+                    self._send_json(200, message)
+                    return
+                events = [("message_start", {
+                    "type": "message_start",
+                    "message": {**message, "content": [], "stop_reason": None, "usage": {**usage, "output_tokens": 0}},
+                })]
+                for index, block in enumerate(content):
+                    if block["type"] == "text":
+                        start = {"type": "text", "text": ""}
+                        delta = {"type": "text_delta", "text": block["text"]}
+                    else:
+                        start = {**block, "input": {}}
+                        delta = {"type": "input_json_delta", "partial_json": json.dumps(block["input"])}
+                    events += [
+                        ("content_block_start", {"type": "content_block_start", "index": index, "content_block": start}),
+                        ("content_block_delta", {"type": "content_block_delta", "index": index, "delta": delta}),
+                        ("content_block_stop", {"type": "content_block_stop", "index": index}),
+                    ]
+                events += [
+                    ("message_delta", {
+                        "type": "message_delta",
+                        "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+                        "usage": {"output_tokens": usage["output_tokens"]},
+                    }),
+                    ("message_stop", {"type": "message_stop"}),
+                ]
+                self._send_events(events)
+
+            def _send_openai(self, body, reply: MockReply):
+                n = server._next_id()
+                text = reply.text
+                tool_calls = []
+                if body.get("tools"):
+                    tool_calls = [
+                        {
+                            "id": f"call_mock_{n}_{i}",
+                            "type": "function",
+                            "function": {"name": name, "arguments": json.dumps(inputs)},
+                        }
+                        for i, (name, inputs) in enumerate(reply.tool_calls)
+                    ]
+                elif reply.tool_calls:
+                    # OpenAI compatible endpoints get prompted JSON tool calls in the text
+                    text = "\n".join(
+                        [text] + [f"```json\n{_tool_call_json(*c)}\n```" for c in reply.tool_calls]
+                    ).strip()
+                finish_reason = "tool_calls" if tool_calls else "stop"
+                completion = {
+                    "id": f"chatcmpl-mock-{n}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {
+                            "role": "assistant",
+                            "content": text or None,
+                            "tool_calls": tool_calls or None,
+                        },
+                        "finish_reason": finish_reason,
+                    }],
+                    "usage": {
+                        "prompt_tokens": _approx_tokens(body.get("messages")),
+                        "completion_tokens": _approx_tokens(text),
+                        "total_tokens": _approx_tokens(body.get("messages")) + _approx_tokens(text),
+                    },
+                }
+                if not body.get("stream"):
+                    self._send_json(200, completion)
+                    return
+
+                def chunk(delta, finish=None):
+                    return {
+                        "id": completion["id"],
+                        "object": "chat.completion.chunk",
+                        "created": completion["created"],
+                        "model": completion["model"],
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+                    }
+                events = [(None, chunk({"role": "assistant", "content": text or None}))]
+                for i, tool_call in enumerate(tool_calls):
+                    events.append((None, chunk({"tool_calls": [{"index": i, **tool_call}]})))
+                events += [(None, chunk({}, finish_reason)), (None, "[DONE]")]
+                self._send_events(events)
+
+            def _send_ollama_chat(self, body, reply: MockReply):
+                message = {"role": "assistant", "content": reply.text}
+                if body.get("tools"):
+                    message["tool_calls"] = [
+                        {"function": {"name": name, "arguments": inputs}}
+                        for name, inputs in reply.tool_calls
+                    ]
+                elif isinstance(body.get("format"), dict):
+                    # Constrained to the tool call schema
+                    name, inputs = reply.tool_calls[0] if reply.tool_calls else ("", {})
+                    message["content"] = _tool_call_json(name, inputs)
+                elif reply.tool_calls:
+                    message["content"] = "\n".join(
+                        [reply.text] + [f"```json\n{_tool_call_json(*c)}\n```" for c in reply.tool_calls]
+                    ).strip()
+                self._send_json(200, {
+                    "model": body.get("model"),
+                    "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                    "message": message,
+                    "done": True,
+                })
+
+            def _send_ollama_generate(self, body):
+                # Only used to pull a tool call out of a chat reply, so answer
+                # as a model following that prompt would
+                found = extract_json_objects(body.get("prompt") or "")
+                response = json.dumps(found[0]) if found else "{}"
+                self._send_json(200, {
+                    "model": body.get("model"),
+                    "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                    "response": response,
+                    "done": True,
+                })
+
+        return Handler
@@ -1,14 +1,24 @@
-from typing import Union, List, Callable, get_type_hints
-import requests
-import json
+import functools
+from typing import Any, Dict, Union, List, Callable, Sequence
+from concurrent.futures import Executor
 from toolla.exceptions import (
     ImageNotSupportedException,
-    AbortedToolException,
-    MessageTooLongException,
 )
+from toolla.history import MessageHistory
+from toolla.messages import Message, SYSTEM, USER, ASSISTANT, to_openai
+from toolla.registry import tool_registry
+from toolla.transports import LoopBoundClient, transport_pool
 from toolla.utils import (
-    build_openai_tool_schema,
+    extract_json_objects,
+    load_json,
+    parse_and_cast_input_types,
+    confirm_tool_call,
+    run_tool_calls,
+    run_tool_calls_async,
 )
+from toolla.steps import StepHook, run_steps, run_steps_async
+from toolla.results import ResultStore
+from toolla.tracing import Tracer
 
 default_guided_gen_tool_prompt = """
 You are a helpful assistant that can guide the user through a series of steps to solve a problem.  You have access to a list of Available Tools.  
@@ -27,8 +37,22 @@ Return Tool Schema:
 }}
 """
 
+# How the tool call is obtained from /api/chat:
+#   native   - Ollama's `tools` field, read from message.tool_calls
+#   format   - a JSON schema `format` constraining the reply to a tool call
+#   generate - a second request to /api/generate to extract JSON from the reply
+TOOL_MODES = ("native", "format", "generate")
+
 class OllamaGuidedClient:
+    """
+    Client for Ollama's native API.  The tool call is read from the
+    structured output of the /api/chat request.  If the reply has none,
+    JSON tool calls in its text are parsed locally, and only if the text
+    looks like a tool call that couldn't be parsed is the model asked
+    again through /api/generate.
+    """
     base_url: str
+    serialize_message = staticmethod(to_openai)
 
     def __init__(
         self,
@@ -39,71 +63,103 @@ class OllamaGuidedClient:
         max_steps = 10,
         print_output=False,
         system: Union[str, None] = None,
+        tool_executor: Union[Executor, None] = None,
+        hooks: Sequence[StepHook] = (),
+        tracer: Union[Tracer, None] = None,
+        result_store: Union[ResultStore, None] = None,
+        tool_mode: str = "native",
     ):
+        if tool_mode not in TOOL_MODES:
+            raise ValueError(f"tool_mode must be one of {TOOL_MODES}")
+        self.tool_mode = tool_mode
         self.base_url = base_url
+        self.session = transport_pool.session(base_url)
         self.model = model
         self.max_steps = max_steps
-        self.messages = []
+        self.tool_executor = tool_executor
+        self.hooks = list(hooks)
+        self.tracer = tracer
+        self.result_store = result_store
         self.print_output = print_output
         self.max_chars = 900_000 # Totally random, figure something else out
+        self.messages = MessageHistory(self.max_chars)
 
-        if tools:
-            self.tools = []
-            self.tool_fns = {}
-            for f in tools:
-                self.tool_fns[f.__name__] = f
-                tool_dict = build_openai_tool_schema(f)
-                self.tools.append(tool_dict)
-        else:
-            self.tools = []
+        tool_set = tool_registry.tool_set(tools, "openai")
+        self.tools = tool_set.schemas
+        self.tool_fns = tool_set.fns
 
         self.messages.append(
-            {
-                "role": "system",
-                "content": system or 
-                    default_guided_gen_tool_prompt.format(tool_list=str(self.tools)),
-            }
+            Message(
+                SYSTEM,
+                system or default_guided_gen_tool_prompt.format(tool_list=str(self.tools)),
+            )
         )
-        
-    def __call__(
-        self,
-        prompt: str,
-        image: Union[str, None] = None,
-        current_fn_response = None,
-        disable_auto_execution = False,
-    ):
-        message = {
-            "role": "user",
-            "content": prompt,
-        }
-        self.messages.append(message)
+
+    def _add_user_message(self, prompt: str, image: Union[str, None]):
+        self.messages.append(Message(USER, prompt))
         if image:
             raise ImageNotSupportedException
-    
-        while len(str(self.messages)) > self.max_chars:
-            self.messages.pop(0)
-            if not self.messages:
-                raise MessageTooLongException
+        self.messages.enforce_budget()
 
+    def _tool_call_schema(self):
+        names = [schema["function"]["name"] for schema in self.tools]
+        return {
+            "type": "object",
+            "properties": {
+                # An empty tool means no tool is needed
+                "tool": {"type": "string", "enum": names + [""]},
+                "inputs": {"type": "object"},
+            },
+            "required": ["tool", "inputs"],
+        }
+
+    def _chat_payload(self):
         payload = {
             "model": self.model,
-            "messages": self.messages,
+            "messages": self.messages.serialize(to_openai),
             "stream": False,
         }
-        response = requests.post(
-            self.base_url + '/api/chat',
-            json=payload,
-        )
+        if self.tools and self.tool_mode == "native":
+            payload["tools"] = self.tools
+        elif self.tools and self.tool_mode == "format":
+            payload["format"] = self._tool_call_schema()
+        return payload
+
+    def _add_response_text(self, response_body):
         # TODO catch error for bad response
-        response_body = response.json()
         response_text = response_body['message']['content']
-        self.messages.append({
-            "role": "assistant",
-            "content": response_text,
-        })
+        self.messages.append(Message(ASSISTANT, response_text))
         if self.print_output:
             print(f"{response_text}\n")
+        return response_text
+
+    def _suggested_tools(self, response_body) -> List[Dict[str, Any]]:
+        """Tool calls from the structured output of a chat response, falling
+        back to JSON found in its text."""
+        message = response_body['message']
+        suggested_tools = []
+        for tool_call in message.get('tool_calls') or []:
+            arguments = tool_call['function'].get('arguments') or {}
+            if isinstance(arguments, str):
+                arguments = load_json(arguments) or {}
+            suggested_tools.append({
+                'tool': tool_call['function']['name'],
+                'inputs': arguments,
+            })
+        if not suggested_tools:
+            suggested_tools = extract_json_objects(message['content'] or "")
+        return [t for t in suggested_tools if t.get('tool') in self.tool_fns]
 
+    def _needs_parser(self, response_text: str, suggested_tools) -> bool:
+        """Whether to pay for a /api/generate request to extract the tool
+        call: only when nothing was found but the reply seems to contain one."""
+        if suggested_tools or not self.tools:
+            return False
+        if self.tool_mode == "generate":
+            return True
+        return "{" in response_text and any(name in response_text for name in self.tool_fns)
+
+    def _json_parser_payload(self, response_text: str):
         # Parse suggested tool using structured generation with same model
         # using ollama completion
         prompt = f"""Go through the following text and extract any JSON from it.  ONLY return
@@ -112,43 +168,106 @@ class OllamaGuidedClient:
         Text:
         {response_text} 
         """
-        json_parser_payload = {
+        return {
             "model": self.model,
             "prompt": prompt,
             "format": "json",
             "stream": False,
         }
-        response = requests.post(
+
+    def _parsed_tools(self, parser_body) -> List[Dict[str, Any]]:
+        suggested_tool = load_json(parser_body['response']) or {}
+        return [suggested_tool] if suggested_tool.get('tool') in self.tool_fns else []
+
+    def _collect_tool_calls(self, suggested_tools, disable_auto_execution):
+        """Return the tools suggested by the model, if any."""
+        if self.print_output:
+            print("Suggested tools: ", suggested_tools)
+        calls = []
+        for suggested_tool in suggested_tools:
+            inputs = suggested_tool.get('inputs') or {}
+            if disable_auto_execution:
+                confirm_tool_call(suggested_tool['tool'], inputs)
+            # Cast all input values to specified type (in case returned as strings)
+            casted_inputs = parse_and_cast_input_types(
+                inputs=inputs,
+                f=self.tool_fns[suggested_tool['tool']],
+            )
+            calls.append((suggested_tool['tool'], casted_inputs))
+        return calls
+
+    def _request(self):
+        """Ask the model for an answer and return the tools it suggested."""
+        response = self.session.post(
+            self.base_url + '/api/chat',
+            json=self._chat_payload(),
+        )
+        response_body = response.json()
+        response_text = self._add_response_text(response_body)
+        suggested_tools = self._suggested_tools(response_body)
+        if not self._needs_parser(response_text, suggested_tools):
+            return suggested_tools
+
+        response = self.session.post(
             self.base_url + '/api/generate',
-            json=json_parser_payload,
+            json=self._json_parser_payload(response_text),
         )
-        suggested_tool = json.loads(response.json()['response'])
-        print("Suggested tool: ", suggested_tool)
+        return self._parsed_tools(response.json())
 
-        if 'tool' in suggested_tool and suggested_tool['tool']:
-            if disable_auto_execution:
-                print(f"Function {suggested_tool['tool']} is about to be called with inputs: {suggested_tool['inputs']}")
-                user_input = input("Do you want to run this function? (y/n): ")
-                if user_input.lower() not in ['y', 'Y']:
-                    print("Function call aborted by user.")
-                    raise AbortedToolException
-            hints = get_type_hints(self.tool_fns[suggested_tool['tool']])
-            for input in suggested_tool['inputs']:
-                if isinstance(hints[input], int):
-                    if isinstance(suggested_tool['inputs'][input], str):
-                        suggested_tool['inputs'][input] = int(suggested_tool['inputs'][input])
-                    if isinstance(hints[input], float):
-                        if isinstance(suggested_tool['inputs'][input], str):
-                            suggested_tool['inputs'][input] = float(suggested_tool['inputs'][input])
-            r = self.tool_fns[suggested_tool['tool']](**suggested_tool['inputs'])
-            if len(self.messages) < 2 * self.max_steps:
-                return self(
-                    prompt=f"\nFunction {suggested_tool['tool']} was called and returned a value of {r}",
-                    current_fn_response=r,
-                    disable_auto_execution=disable_auto_execution,
-                )
-            else:
-                print("Reached maxiumum number of steps, returning current tool response.")
-                return current_fn_response
-        else:
-            return current_fn_response
+    def _run_tool_calls(self, calls):
+        return run_tool_calls(self.tool_fns, calls, self.tool_executor)
+
+    def __call__(
+        self,
+        prompt: str,
+        image: Union[str, None] = None,
+        current_fn_response = None,
+        disable_auto_execution = False,
+    ):
+        return run_steps(
+            self,
+            prompt,
+            image=image,
+            current_fn_response=current_fn_response,
+            disable_auto_execution=disable_auto_execution,
+            hooks=self.hooks,
+        )
+
+class AsyncOllamaGuidedClient(OllamaGuidedClient):
+    def __init__(self, model: str, base_url: str, **kwargs):
+        super().__init__(model, base_url, **kwargs)
+        # Looked up on use, so it comes from the running loop's pool
+        self.client = LoopBoundClient(functools.partial(transport_pool.async_session, base_url))
+
+    async def _request(self):
+        response = await self.client.post('/api/chat', json=self._chat_payload())
+        response_body = response.json()
+        response_text = self._add_response_text(response_body)
+        suggested_tools = self._suggested_tools(response_body)
+        if not self._needs_parser(response_text, suggested_tools):
+            return suggested_tools
+
+        response = await self.client.post(
+            '/api/generate',
+            json=self._json_parser_payload(response_text),
+        )
+        return self._parsed_tools(response.json())
+
+    async def _run_tool_calls(self, calls):
+        return await run_tool_calls_async(self.tool_fns, calls, self.tool_executor)
+
+    async def __call__(
+        self,
+        prompt: str,
+        image: Union[str, None] = None,
+        current_fn_response = None,
+        disable_auto_execution = False,
+    ):
+        return await run_steps_async(
+            self,
+            prompt,
+            image=image,
+            current_fn_response=current_fn_response,
+            disable_auto_execution=disable_auto_execution,
+            hooks=self.hooks,
+        )
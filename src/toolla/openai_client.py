@@ -1,20 +1,34 @@
+import functools
 import os
 import json
-from typing import Union, List, Callable
+from typing import Union, List, Callable, Sequence
 from pathlib import Path
-from openai import OpenAI
+from concurrent.futures import Executor
 
 from toolla.utils import (
-    get_image_mime_type, 
-    load_file_base64, 
-    build_openai_tool_schema,
-)
-from toolla.exceptions import (
-    MessageTooLongException, 
-    AbortedToolException
+    get_image_mime_type,
+    confirm_tool_call,
+    dispatch_tool_call,
+    dispatch_tool_call_async,
+    run_tool_calls,
+    run_tool_calls_async,
 )
+from toolla.attachments import attachment_cache
+from toolla.cache import ResponseCache
+from toolla.dispatch import send, send_async
+from toolla.history import MessageHistory
+from toolla.messages import Message, TextPart, ImagePart, SYSTEM, USER, ASSISTANT, to_openai
+from toolla.rate_limit import RateLimiter
+from toolla.registry import tool_registry
+from toolla.streaming import OpenAIStreamAccumulator, DispatchedCalls
+from toolla.transports import LoopBoundClient, transport_pool
+from toolla.steps import StepHook, run_steps, run_steps_async
+from toolla.results import ResultStore
+from toolla.tracing import Tracer
 
 class OpenAIClient:
+    serialize_message = staticmethod(to_openai)
+
     def __init__(
         self,
         model: str = "gpt-4o",
@@ -23,107 +37,200 @@ class OpenAIClient:
         max_steps: int = 10,
         print_output: bool = False,
         api_key: Union[str, None] = None,
+        tool_executor: Union[Executor, None] = None,
+        hooks: Sequence[StepHook] = (),
+        tracer: Union[Tracer, None] = None,
+        result_store: Union[ResultStore, None] = None,
+        response_cache: Union[ResponseCache, None] = None,
+        rate_limiter: Union[RateLimiter, None] = None,
+        stream: bool = False,
     ):
-        self.client = OpenAI(api_key=api_key or os.environ.get("OPENAI_API_KEY"))
+        self.client = self._create_client(api_key)
         self.model = model
+        self.stream = stream
         self.max_steps = max_steps
-        self.messages = []
+        self.tool_executor = tool_executor
+        self.hooks = list(hooks)
+        self.tracer = tracer
+        self.result_store = result_store
+        self.response_cache = response_cache
+        self.rate_limiter = rate_limiter
+        if rate_limiter is not None:
+            # The limiter does the retrying, throttled or transient
+            self.client = self.client.with_options(max_retries=0)
         self.print_output = print_output
 
         # TODO change based on model choice
         self.max_tokens = 4096
         self.max_chars = 900_000
+        self.messages = MessageHistory(self.max_chars)
 
         if system:
-            self.messages.append(
-                {
-                    "role": "system",
-                    "content": system,
-                }
-            )
-
-        if tools:
-            # TODO check that docstrings
-            # match functions and are valid 
-            self.tools = []
-            self.tool_fns = {}
-            for f in tools:
-                self.tool_fns[f.__name__] = f
-                tool_dict = build_openai_tool_schema(f)
-                self.tools.append(tool_dict)
-        else:
-            self.tools = []
-    
-    def __call__(
-        self,
-        prompt: str,
-        image: Union[str, None] = None,
-        current_fn_response = None,
-        disable_auto_execution = False,
-    ):
-        message = {
-            "role": "user",
-            "content": [
-                { "type": "text", "text": prompt }
-            ]
-        }
-        self.messages.append(message)
+            self.messages.append(Message(SYSTEM, system))
+
+        tool_set = tool_registry.tool_set(tools, "openai")
+        self.tools = tool_set.schemas
+        self.tool_fns = tool_set.fns
+
+    def _create_client(self, api_key: Union[str, None]):
+        return transport_pool.openai_client(api_key or os.environ.get("OPENAI_API_KEY"))
+
+    def _add_user_message(self, prompt: str, image: Union[str, None]):
+        parts = [TextPart(prompt)]
         if image:
             fpath = Path(image)
-            mtype = get_image_mime_type(fpath)
-            image_string = load_file_base64(fpath) 
-            message["content"].append(
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:{mtype};base64,{image_string}"
-                    }
-                }
-            )
-    
-        while len(str(self.messages)) > self.max_chars:
-            self.messages.pop(0)
-            if not self.messages:
-                raise MessageTooLongException
+            parts.append(ImagePart(get_image_mime_type(fpath), attachment_cache.load(fpath)))
+        self.messages.append(Message(USER, parts))
+        self.messages.enforce_budget()
 
+    def _create_kwargs(self):
         # OpenAI doesn't allow for empty tool list
-        # TODO change to self.tools or None
-        response = self.client.chat.completions.create(
+        kwargs = dict(
             model=self.model,
             max_tokens=self.max_tokens,
-            messages=self.messages,
-            tools=self.tools,
-        ) if self.tools else self.client.chat.completions.create(
-            model=self.model,
-            max_tokens=self.max_tokens,
-            messages=self.messages,
+            messages=self.messages.serialize(to_openai),
         )
- 
+        if self.tools:
+            kwargs["tools"] = self.tools
+        return kwargs
+
+    def _add_text(self, text: str):
+        self.messages.append(Message(ASSISTANT, text))
+        if self.print_output:
+            print(f"{text}\n")
+
+    def _dispatch_streamed_call(self, calls, name, inputs, disable_auto_execution):
+        if disable_auto_execution:
+            confirm_tool_call(name, inputs)
+        calls.add(name, inputs, dispatch_tool_call(self.tool_fns, name, inputs, self.tool_executor))
+
+    def _read_stream(self, stream, disable_auto_execution):
+        """Read a streamed response, starting each tool as soon as its
+        arguments are complete.  Returns the started calls."""
+        accumulator = OpenAIStreamAccumulator()
+        calls = DispatchedCalls()
+        for chunk in stream:
+            for name, inputs in accumulator.feed(chunk):
+                self._dispatch_streamed_call(calls, name, inputs, disable_auto_execution)
+        if accumulator.finish_reason == 'stop':
+            self._add_text(accumulator.text)
+        return calls
+
+    def _collect_tool_calls(self, response, disable_auto_execution):
+        """Record the reply in `response` and return every tool call in it
+        as (name, inputs) pairs."""
+        if self.stream:
+            return self._read_stream(response, disable_auto_execution)
         for choice in response.choices:
             if choice.finish_reason == 'stop':
-                # TODO should be moved outside of for loop?
-                self.messages.append({
-                    "role": "assistant",
-                    "content": choice.message.content,
-                })
-                if self.print_output:
-                    print(f"{choice.message.content}\n")
-                return current_fn_response
+                self._add_text(choice.message.content)
+                return []
             elif choice.finish_reason == 'tool_calls':
-                function = choice.message.tool_calls[0].function
+                calls = [
+                    (tool_call.function.name, json.loads(tool_call.function.arguments))
+                    for tool_call in choice.message.tool_calls
+                ]
                 if disable_auto_execution:
-                    print(f"Function {function.name} is about to be called with inputs: {function.arguments}")
-                    user_input = input("Do you want to run this function? (y/n): ")
-                    if user_input.lower() not in ['y', 'Y']:
-                        print("Function call aborted by user.")
-                        raise AbortedToolException
-                r = self.tool_fns[function.name](**json.loads(function.arguments))
-                if len(self.messages) < 2 * self.max_steps:
-                    return self(
-                        prompt=f"\nFunction {function.name} was called and returned a value of {r}",
-                        current_fn_response=r,
-                        disable_auto_execution=disable_auto_execution,
-                    )
-                else:
-                    print("Reached maxiumum number of steps, returning current tool response.")
-                    return current_fn_response
\ No newline at end of file
+                    for tool_call in choice.message.tool_calls:
+                        confirm_tool_call(tool_call.function.name, tool_call.function.arguments)
+                return calls
+        return []
+
+    def _send_args(self):
+        kwargs = self._create_kwargs()
+        if self.stream:
+            # A stream can only be read once, so streamed responses aren't cached
+            kwargs["stream"] = True
+            return kwargs, None
+        return kwargs, self.response_cache
+
+    def _request(self):
+        return self._send(*self._send_args())
+
+    def _send(self, kwargs, response_cache):
+        return send(
+            self.client.chat.completions,
+            "openai",
+            kwargs,
+            rate_limiter=self.rate_limiter,
+            response_cache=response_cache,
+            estimated_tokens=self.messages.estimated_tokens,
+        )
+
+    def _run_tool_calls(self, calls):
+        return run_tool_calls(self.tool_fns, calls, self.tool_executor)
+
+    def __call__(
+        self,
+        prompt: str,
+        image: Union[str, None] = None,
+        current_fn_response = None,
+        disable_auto_execution = False,
+    ):
+        return run_steps(
+            self,
+            prompt,
+            image=image,
+            current_fn_response=current_fn_response,
+            disable_auto_execution=disable_auto_execution,
+            hooks=self.hooks,
+        )
+
+class AsyncOpenAIClient(OpenAIClient):
+    def _create_client(self, api_key: Union[str, None]):
+        # Looked up on use, so it comes from the running loop's pool
+        return LoopBoundClient(functools.partial(
+            transport_pool.async_openai_client,
+            api_key or os.environ.get("OPENAI_API_KEY"),
+        ))
+
+    async def _request(self):
+        return await self._send(*self._send_args())
+
+    async def _send(self, kwargs, response_cache):
+        return await send_async(
+            self.client.chat.completions,
+            "openai",
+            kwargs,
+            rate_limiter=self.rate_limiter,
+            response_cache=response_cache,
+            estimated_tokens=self.messages.estimated_tokens,
+        )
+
+    def _dispatch_streamed_call(self, calls, name, inputs, disable_auto_execution):
+        if disable_auto_execution:
+            confirm_tool_call(name, inputs)
+        calls.add(
+            name,
+            inputs,
+            dispatch_tool_call_async(self.tool_fns, name, inputs, self.tool_executor),
+        )
+
+    async def _read_stream(self, stream, disable_auto_execution):
+        accumulator = OpenAIStreamAccumulator()
+        calls = DispatchedCalls()
+        async for chunk in stream:
+            for name, inputs in accumulator.feed(chunk):
+                self._dispatch_streamed_call(calls, name, inputs, disable_auto_execution)
+        if accumulator.finish_reason == 'stop':
+            self._add_text(accumulator.text)
+        return calls
+
+    async def _run_tool_calls(self, calls):
+        return await run_tool_calls_async(self.tool_fns, calls, self.tool_executor)
+
+    async def __call__(
+        self,
+        prompt: str,
+        image: Union[str, None] = None,
+        current_fn_response = None,
+        disable_auto_execution = False,
+    ):
+        return await run_steps_async(
+            self,
+            prompt,
+            image=image,
+            current_fn_response=current_fn_response,
+            disable_auto_execution=disable_auto_execution,
+            hooks=self.hooks,
+        )
@@ -1,18 +1,42 @@
-from typing import Union, List, Callable, get_type_hints
-from openai import OpenAI
+import functools
+from typing import Union, List, Callable, Sequence
+from concurrent.futures import Executor
 from toolla.exceptions import (
     ImageNotSupportedException,
-    AbortedToolException,
-    MessageTooLongException,
 )
+from toolla.cache import ResponseCache
+from toolla.dispatch import send, send_async
+from toolla.history import MessageHistory
+from toolla.messages import Message, SYSTEM, USER, ASSISTANT, to_openai
+from toolla.endpoints import Endpoint, endpoint_pools
+from toolla.rate_limit import RateLimiter
+from toolla.registry import tool_registry
+from toolla.transports import LoopBoundClient, transport_pool
 from toolla.utils import (
-    build_openai_tool_schema,
-    extract_json_from_text,
+    extract_json_objects,
     parse_and_cast_input_types,
+    confirm_tool_call,
+    run_tool_calls,
+    run_tool_calls_async,
 )
 from toolla.models import default_tool_prompt
+from toolla.steps import StepHook, run_steps, run_steps_async
+from toolla.results import ResultStore
+from toolla.tracing import Tracer
+
+# Seconds an ejected node has to answer a health probe
+PROBE_TIMEOUT = 2.0
+
+def _probe_endpoint(api_key: Union[str, None], endpoint: Endpoint) -> bool:
+    """Whether an ejected node answers its model list again."""
+    # A sync client even for async chats, as probes run on their own thread
+    client = transport_pool.openai_client(api_key, endpoint.base_url)
+    client.with_options(timeout=PROBE_TIMEOUT, max_retries=0).models.list()
+    return True
 
 class OpenAICompatibleClient:
+    serialize_message = staticmethod(to_openai)
+
     def __init__(
         self,
         model: str,
@@ -20,41 +44,149 @@ class OpenAICompatibleClient:
         tools: List[Callable] = [],
         max_steps = 10,
         print_output=False,
-        base_url: Union[str, None] = None,
+        base_url: Union[str, Sequence[str], None] = None,
         system: Union[str, None] = None,
         api_key: Union[str, None] = None,
+        tool_executor: Union[Executor, None] = None,
+        hooks: Sequence[StepHook] = (),
+        tracer: Union[Tracer, None] = None,
+        result_store: Union[ResultStore, None] = None,
+        response_cache: Union[ResponseCache, None] = None,
+        rate_limiter: Union[RateLimiter, None] = None,
+        load_balancing: str = "least_outstanding",
     ):
-        self.client = OpenAI(
-            base_url=base_url,
-            api_key=api_key,
-        )
+        self.api_key = api_key
+        self.endpoints = None
+        if isinstance(base_url, str) or base_url is None:
+            self.client = self._create_client(base_url, api_key)
+            self.base_url = base_url
+        else:
+            # A fleet of nodes serving the model, shared with other chats
+            self.client = None
+            self.base_url = ",".join(base_url)
+            self.endpoints = endpoint_pools.get(
+                base_url,
+                model,
+                api_key,
+                strategy=load_balancing,
+                probe=functools.partial(_probe_endpoint, api_key),
+            )
+            self._endpoint_clients = {}
         self.model = model
         self.max_steps = max_steps
-        self.messages = []
+        self.tool_executor = tool_executor
+        self.hooks = list(hooks)
+        self.tracer = tracer
+        self.result_store = result_store
+        self.response_cache = response_cache
+        self.rate_limiter = rate_limiter
+        if rate_limiter is not None and self.client is not None:
+            # The limiter does the retrying, throttled or transient
+            self.client = self.client.with_options(max_retries=0)
         self.print_output = print_output
         self.max_chars = 900_000 # Totally random, figure something else out
+        self.messages = MessageHistory(self.max_chars)
 
-        if tools:
-            self.tools = []
-            self.tool_fns = {}
-            for f in tools:
-                self.tool_fns[f.__name__] = f
-                tool_dict = build_openai_tool_schema(f)
-                self.tools.append(tool_dict)
-        else:
-            self.tools = []
+        tool_set = tool_registry.tool_set(tools, "openai")
+        self.tools = tool_set.schemas
+        self.tool_fns = tool_set.fns
 
         if system:
             system_prompt = system + default_tool_prompt.format(tool_list=str(self.tools))
         else:
             system_prompt = default_tool_prompt.format(tool_list=str(self.tools))
-        self.messages.append(
-            {
-                "role": "system",
-                "content": system_prompt,
-            }
+        self.messages.append(Message(SYSTEM, system_prompt))
+
+    def _create_client(self, base_url: Union[str, None], api_key: Union[str, None]):
+        return transport_pool.openai_client(api_key, base_url)
+
+    def _endpoint_client(self, endpoint: Endpoint):
+        """This chat's SDK client for a node."""
+        client = self._endpoint_clients.get(endpoint.base_url)
+        if client is None:
+            # Failed requests go to another node rather than being retried on this one
+            client = self._create_client(endpoint.base_url, self.api_key).with_options(max_retries=0)
+            self._endpoint_clients[endpoint.base_url] = client
+        return client
+
+    @staticmethod
+    def _failover_error(error: Exception) -> bool:
+        """Whether a failed request might succeed on another node."""
+        import openai
+        if isinstance(error, openai.APIConnectionError):
+            return True
+        status_code = getattr(error, "status_code", None)
+        return status_code is not None and (status_code == 429 or status_code >= 500)
+
+    def _add_user_message(self, prompt: str, image: Union[str, None]):
+        self.messages.append(Message(USER, prompt))
+        if image:
+            raise ImageNotSupportedException
+        self.messages.enforce_budget()
+
+    def _create_kwargs(self):
+        return dict(
+            model=self.model,
+            messages=self.messages.serialize(to_openai),
         )
-        
+
+    def _send_args(self):
+        return self._create_kwargs(), self.response_cache
+
+    def _request(self):
+        return self._send(*self._send_args())
+
+    def _send(self, kwargs, response_cache):
+        if self.endpoints is not None:
+            return self.endpoints.call(
+                lambda endpoint: send(
+                    self._endpoint_client(endpoint).chat.completions,
+                    self.base_url,
+                    kwargs,
+                    rate_limiter=self.rate_limiter or endpoint.rate_limiter,
+                    response_cache=response_cache,
+                    estimated_tokens=self.messages.estimated_tokens,
+                    # Failing over beats retrying on a failing node
+                    retry_transient=False,
+                ),
+                self._failover_error,
+            )
+        return send(
+            self.client.chat.completions,
+            self.base_url,
+            kwargs,
+            rate_limiter=self.rate_limiter,
+            response_cache=response_cache,
+            estimated_tokens=self.messages.estimated_tokens,
+        )
+
+    def _collect_tool_calls(self, response, disable_auto_execution):
+        """Record the assistant message and return the tool calls in it."""
+        content = response.choices[0].message.content
+        self.messages.append(Message(ASSISTANT, content))
+        if self.print_output:
+            print(f"{content}\n")
+        if not self.tools:
+            return []
+        calls = []
+        for parsed_response in extract_json_objects(content or ""):
+            # Other JSON in the reply, e.g. an answer, isn't a tool call
+            if parsed_response.get('tool') not in self.tool_fns:
+                continue
+            inputs = parsed_response.get('inputs') or {}
+            if disable_auto_execution:
+                confirm_tool_call(parsed_response['tool'], inputs)
+            # Cast all input values to specified type (in case returned as strings)
+            casted_inputs = parse_and_cast_input_types(
+                inputs=inputs,
+                f=self.tool_fns[parsed_response['tool']],
+            )
+            calls.append((parsed_response['tool'], casted_inputs))
+        return calls
+
+    def _run_tool_calls(self, calls):
+        return run_tool_calls(self.tool_fns, calls, self.tool_executor)
+
     def __call__(
         self,
         prompt: str,
@@ -62,53 +194,62 @@ class OpenAICompatibleClient:
         current_fn_response = None,
         disable_auto_execution = False,
     ):
-        message = {
-            "role": "user",
-            "content": prompt,
-        }
-        self.messages.append(message)
-        if image:
-            raise ImageNotSupportedException
-    
-        while len(str(self.messages)) > self.max_chars:
-            self.messages.pop(0)
-            if not self.messages:
-                raise MessageTooLongException
+        return run_steps(
+            self,
+            prompt,
+            image=image,
+            current_fn_response=current_fn_response,
+            disable_auto_execution=disable_auto_execution,
+            hooks=self.hooks,
+        )
 
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=self.messages,
+class AsyncOpenAICompatibleClient(OpenAICompatibleClient):
+    def _create_client(self, base_url: Union[str, None], api_key: Union[str, None]):
+        # Looked up on use, so it comes from the running loop's pool
+        return LoopBoundClient(functools.partial(transport_pool.async_openai_client, api_key, base_url))
+
+    async def _request(self):
+        return await self._send(*self._send_args())
+
+    async def _send(self, kwargs, response_cache):
+        if self.endpoints is not None:
+            return await self.endpoints.acall(
+                lambda endpoint: send_async(
+                    self._endpoint_client(endpoint).chat.completions,
+                    self.base_url,
+                    kwargs,
+                    rate_limiter=self.rate_limiter or endpoint.rate_limiter,
+                    response_cache=response_cache,
+                    estimated_tokens=self.messages.estimated_tokens,
+                    # Failing over beats retrying on a failing node
+                    retry_transient=False,
+                ),
+                self._failover_error,
+            )
+        return await send_async(
+            self.client.chat.completions,
+            self.base_url,
+            kwargs,
+            rate_limiter=self.rate_limiter,
+            response_cache=response_cache,
+            estimated_tokens=self.messages.estimated_tokens,
+        )
+
+    async def _run_tool_calls(self, calls):
+        return await run_tool_calls_async(self.tool_fns, calls, self.tool_executor)
+
+    async def __call__(
+        self,
+        prompt: str,
+        image: Union[str, None] = None,
+        current_fn_response = None,
+        disable_auto_execution = False,
+    ):
+        return await run_steps_async(
+            self,
+            prompt,
+            image=image,
+            current_fn_response=current_fn_response,
+            disable_auto_execution=disable_auto_execution,
+            hooks=self.hooks,
         )
-        self.messages.append({
-            "role": "assistant",
-            "content": response.choices[0].message.content,
-        })
-        if self.print_output:
-            print(f"{response.choices[0].message.content}\n")
-        if self.tools:
-            parsed_response = extract_json_from_text(response.choices[0].message.content)
-            if parsed_response:
-                if disable_auto_execution:
-                    print(f"Function {parsed_response['tool']} is about to be called with inputs: {parsed_response['inputs']}")
-                    user_input = input("Do you want to run this function? (y/n): ")
-                    if user_input.lower() not in ['y', 'Y']:
-                        print("Function call aborted by user.")
-                        raise AbortedToolException
-                # Cast all input values to specified type (in case returned as strings)
-                casted_inputs = parse_and_cast_input_types(
-                    inputs=parsed_response['inputs'],
-                    f=self.tool_fns[parsed_response['tool']],
-                )
-                print("Annotations: ", self.tool_fns[parsed_response['tool']].__annotations__)
-                r = self.tool_fns[parsed_response['tool']](**casted_inputs)
-                if len(self.messages) < 2 * self.max_steps:
-                    return self(
-                        prompt=f"\nFunction {parsed_response['tool']} was called and returned a value of {r}",
-                        current_fn_response=r,
-                        disable_auto_execution=disable_auto_execution,
-                    )
-                else:
-                    print("Reached maxiumum number of steps, returning current tool response.")
-                    return current_fn_response
-            else:
-                return current_fn_response
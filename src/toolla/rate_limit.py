@@ -0,0 +1,440 @@
+import asyncio
+import math
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from collections import deque
+from typing import Any, Callable, Dict, Mapping, Tuple, Union
+from toolla.tracing import event, span
+
+# Responses that mean "slow down" rather than "this request is bad"
+THROTTLED_STATUS_CODES = (429, 529)
+
+# Besides 5xx, failures the SDKs retry as transient
+TRANSIENT_STATUS_CODES = (408, 409)
+
+_duration_units = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+_duration_re = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+
+def parse_reset(value: str) -> Union[float, None]:
+    """Seconds until a rate limit resets, from either an OpenAI style
+    duration ("6m0s", "20ms") or an Anthropic style RFC 3339 timestamp."""
+    parts = _duration_re.findall(value)
+    if parts and "".join(n + u for n, u in parts) == value:
+        return sum(float(n) * _duration_units[u] for n, u in parts)
+    try:
+        reset_at = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if reset_at.tzinfo is None:
+        reset_at = reset_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (reset_at - datetime.now(timezone.utc)).total_seconds())
+
+def parse_retry_after(headers: Mapping[str, str]) -> Union[float, None]:
+    if "retry-after-ms" in headers:
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    if "retry-after" in headers:
+        try:
+            return float(headers["retry-after"])
+        except ValueError:
+            pass
+    return None
+
+def parse_rate_limit_headers(headers: Mapping[str, str]) -> Dict[str, float]:
+    """Normalise Anthropic and OpenAI rate limit headers to
+    limit/remaining/reset values for requests and tokens."""
+    prefixes = {
+        "anthropic-ratelimit-requests-": "requests",
+        "anthropic-ratelimit-tokens-": "tokens",
+    }
+    limits = {}
+    for name, value in headers.items():
+        kind = field = None
+        for prefix, k in prefixes.items():
+            if name.startswith(prefix):
+                kind, field = k, name[len(prefix):]
+        match = re.match(r"x-ratelimit-(limit|remaining|reset)-(requests|tokens)$", name)
+        if match:
+            field, kind = match.groups()
+        if kind is None or field not in ("limit", "remaining", "reset"):
+            continue
+        if field == "reset":
+            seconds = parse_reset(value)
+            if seconds is not None:
+                limits[f"{kind}_reset"] = seconds
+        else:
+            try:
+                limits[f"{kind}_{field}"] = float(value)
+            except ValueError:
+                pass
+    return limits
+
+def _error_details(error: Exception) -> Tuple[Union[int, None], Dict[str, str]]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    return getattr(error, "status_code", None), {k.lower(): v for k, v in headers.items()}
+
+def _is_transient(error: Exception, status_code: Union[int, None], headers: Dict[str, str]) -> bool:
+    """Whether a failure that isn't throttling is worth retrying, judged
+    the way the SDKs judge it."""
+    should_retry = headers.get("x-should-retry")
+    if should_retry in ("true", "false"):
+        return should_retry == "true"
+    if status_code is not None:
+        return status_code in TRANSIENT_STATUS_CODES or status_code >= 500
+    # An SDK that hasn't been imported can't have raised the error
+    for name in ("anthropic", "openai"):
+        sdk = sys.modules.get(name)
+        if sdk is not None and isinstance(error, sdk.APIConnectionError):
+            return True
+    return False
+
+def _is_raw_response(response) -> bool:
+    """Whether `response` came from an SDK `with_raw_response` call."""
+    return hasattr(response, "http_response") and hasattr(response, "parse")
+
+def _used_tokens(response) -> Union[int, None]:
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return None
+    total = getattr(usage, "total_tokens", None)
+    if total is not None:
+        return total
+    input_tokens = getattr(usage, "input_tokens", None)
+    output_tokens = getattr(usage, "output_tokens", None)
+    if input_tokens is None or output_tokens is None:
+        return None
+    return input_tokens + output_tokens
+
+class RateLimiter:
+    """
+    Client-side limiter for one provider and model, shared by every chat
+    that talks to it.
+
+    Requests and tokens per minute are enforced with token buckets.  Limits
+    start at the given values (or unlimited) and are updated from the rate
+    limit headers of each response.  Concurrency is unbounded (or capped at
+    `max_concurrency`) until the provider throttles a request; it is then
+    halved on every throttle and grows back by one slot per
+    `concurrency_limit` successes.  Requests waiting for a slot queue in
+    arrival order and are woken as slots are released.  A throttled request pauses all
+    requests through the limiter for the provider's retry-after, or an
+    exponential backoff with jitter, and is retried up to `max_retries` times.
+    Transient failures (connection errors, 408, 409 and 5xx) are retried
+    the same number of times after their own backoff, without pausing
+    other requests.  SDK clients used with a limiter should have their
+    own retries turned off.
+    """
+    def __init__(
+        self,
+        requests_per_minute: Union[float, None] = None,
+        tokens_per_minute: Union[float, None] = None,
+        max_concurrency: Union[int, None] = None,
+        max_retries: int = 2,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # None until the provider throttles, unless capped up front
+        self.concurrency_limit = None if max_concurrency is None else float(max_concurrency)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.throttled = 0
+        self._consecutive_throttles = 0
+        self._request_allowance = float(requests_per_minute or 0)
+        self._token_allowance = float(tokens_per_minute or 0)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        # Wake-up callbacks of requests waiting for a slot, oldest first
+        self._waiters = deque()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._request_allowance = min(
+                self.requests_per_minute,
+                self._request_allowance + elapsed * self.requests_per_minute / 60,
+            )
+        if self.tokens_per_minute:
+            self._token_allowance = min(
+                self.tokens_per_minute,
+                self._token_allowance + elapsed * self.tokens_per_minute / 60,
+            )
+
+    def _slots(self) -> float:
+        if self.concurrency_limit is None:
+            return math.inf
+        return max(1, int(self.concurrency_limit))
+
+    def _try_acquire(self, tokens: int, wake: Union[Callable[[], None], None] = None, woken: bool = False) -> float:
+        # Called with the lock held.  With no free slot, `wake` is queued to
+        # be called once one is released.
+        now = time.monotonic()
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.in_flight >= self._slots() or (self._waiters and not woken):
+            if wake is not None:
+                # A woken request that lost its slot again keeps its place
+                if woken:
+                    self._waiters.appendleft(wake)
+                else:
+                    self._waiters.append(wake)
+            return math.inf
+        if self.requests_per_minute and self._request_allowance < 1:
+            return (1 - self._request_allowance) * 60 / self.requests_per_minute
+        if self.tokens_per_minute:
+            needed = min(tokens, self.tokens_per_minute)
+            if self._token_allowance < needed:
+                return (needed - self._token_allowance) * 60 / self.tokens_per_minute
+        self._request_allowance -= 1
+        self._token_allowance -= tokens
+        self.in_flight += 1
+        return 0.0
+
+    def _wake_waiters(self):
+        # Called with the lock held
+        free = self._slots() - self.in_flight
+        while free > 0 and self._waiters:
+            self._waiters.popleft()()
+            free -= 1
+
+    def _abandon(self, wake: Callable[[], None]):
+        """Take an interrupted request out of the queue, passing its
+        wake-up on if it had one."""
+        with self._lock:
+            try:
+                self._waiters.remove(wake)
+            except ValueError:
+                self._wake_waiters()
+
+    def try_acquire(self, tokens: int = 0) -> float:
+        """Take a slot for a request of about `tokens` tokens.  Returns 0 on
+        success, otherwise how many seconds to wait before trying again,
+        `inf` if it has to wait for a slot to be released."""
+        with self._lock:
+            return self._try_acquire(tokens)
+
+    def acquire(self, tokens: int = 0):
+        event = threading.Event()
+        with self._lock:
+            wait = self._try_acquire(tokens, event.set)
+        if not wait:
+            return
+        with span("rate_limit_wait", "rate_limit", tokens=tokens):
+            woken = False
+            try:
+                while wait:
+                    if wait == math.inf:
+                        event.wait()
+                        event.clear()
+                        woken = True
+                    else:
+                        time.sleep(wait)
+                    with self._lock:
+                        wait = self._try_acquire(tokens, event.set, woken)
+            except BaseException:
+                self._abandon(event.set)
+                raise
+
+    async def acquire_async(self, tokens: int = 0):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            def resolve():
+                if not future.done():
+                    future.set_result(None)
+            try:
+                loop.call_soon_threadsafe(resolve)
+            except RuntimeError:
+                # The loop has closed
+                pass
+
+        with self._lock:
+            wait = self._try_acquire(tokens, wake)
+        if not wait:
+            return
+        with span("rate_limit_wait", "rate_limit", tokens=tokens):
+            woken = False
+            try:
+                while wait:
+                    if wait == math.inf:
+                        await future
+                        future = loop.create_future()
+                        woken = True
+                    else:
+                        await asyncio.sleep(wait)
+                    with self._lock:
+                        wait = self._try_acquire(tokens, wake, woken)
+            except BaseException:
+                self._abandon(wake)
+                raise
+
+    def release(
+        self,
+        tokens: int = 0,
+        used_tokens: Union[int, None] = None,
+        headers: Union[Mapping[str, str], None] = None,
+        throttled: bool = False,
+    ):
+        """Give back the slot taken by `try_acquire` and learn from the outcome."""
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        with self._lock:
+            now = time.monotonic()
+            self.in_flight -= 1
+            if used_tokens is not None:
+                self._token_allowance -= used_tokens - tokens
+            self._apply_headers(headers, now)
+            if throttled:
+                self.throttled += 1
+                self._consecutive_throttles += 1
+                # An unbounded limit starts from the concurrency that was throttled
+                limit = self.in_flight + 1 if self.concurrency_limit is None else self.concurrency_limit
+                self.concurrency_limit = max(1.0, limit / 2)
+                wait = parse_retry_after(headers)
+                if wait is None:
+                    wait = self._backoff(self._consecutive_throttles - 1)
+                self.blocked_until = max(self.blocked_until, now + wait)
+            else:
+                self._consecutive_throttles = 0
+                if self.concurrency_limit is not None:
+                    self.concurrency_limit += 1 / self.concurrency_limit
+                    if self.max_concurrency is not None:
+                        self.concurrency_limit = min(float(self.max_concurrency), self.concurrency_limit)
+            self._wake_waiters()
+
+    def _apply_headers(self, headers: Dict[str, str], now: float):
+        limits = parse_rate_limit_headers(headers)
+        if "requests_limit" in limits:
+            if not self.requests_per_minute:
+                self._request_allowance = limits["requests_limit"]
+            self.requests_per_minute = limits["requests_limit"]
+        if "tokens_limit" in limits:
+            if not self.tokens_per_minute:
+                self._token_allowance = limits["tokens_limit"]
+            self.tokens_per_minute = limits["tokens_limit"]
+        if "requests_remaining" in limits:
+            self._request_allowance = limits["requests_remaining"]
+            if limits["requests_remaining"] < 1 and "requests_reset" in limits:
+                self.blocked_until = max(self.blocked_until, now + limits["requests_reset"])
+        if "tokens_remaining" in limits:
+            self._token_allowance = limits["tokens_remaining"]
+
+    def _backoff(self, attempt: int) -> float:
+        wait = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return wait * random.uniform(0.5, 1.0)
+
+    def _retry(self, error: Exception, tokens: int, attempt: int, retry_transient: bool) -> Union[float, None]:
+        """Release the slot of a failed request and decide whether to retry
+        it.  Returns how long to wait before retrying, or None to give up."""
+        status_code, headers = _error_details(error)
+        throttled = status_code in THROTTLED_STATUS_CODES
+        self.release(tokens, headers=headers, throttled=throttled)
+        if attempt >= self.max_retries:
+            return None
+        if throttled:
+            # acquire waits out the pause this set
+            wait = 0.0
+        elif retry_transient and _is_transient(error, status_code, headers):
+            wait = parse_retry_after(headers)
+            if wait is None:
+                wait = self._backoff(attempt)
+        else:
+            return None
+        event("retry", "rate_limit", attempt=attempt + 1, status_code=status_code)
+        return wait
+
+    def call(self, create: Callable, kwargs: Dict[str, Any], tokens: int = 0, retry_transient: bool = True):
+        """Call `create(**kwargs)` within the limits, retrying throttled
+        requests and, if `retry_transient`, transient failures.  If `create`
+        returns a raw SDK response its headers are read and the parsed
+        response is returned."""
+        attempt = 0
+        while True:
+            self.acquire(tokens)
+            try:
+                response = create(**kwargs)
+                headers = None
+                if _is_raw_response(response):
+                    headers = response.headers
+                    response = response.parse()
+            except Exception as e:
+                wait = self._retry(e, tokens, attempt, retry_transient)
+                if wait is None:
+                    raise
+                time.sleep(wait)
+                attempt += 1
+                continue
+            except BaseException:
+                # Interrupted, which says nothing about the provider
+                self.release(tokens)
+                raise
+            self.release(tokens, used_tokens=_used_tokens(response), headers=headers)
+            return response
+
+    async def acall(self, create: Callable, kwargs: Dict[str, Any], tokens: int = 0, retry_transient: bool = True):
+        """`call` for an awaitable `create`."""
+        attempt = 0
+        while True:
+            await self.acquire_async(tokens)
+            try:
+                response = await create(**kwargs)
+                headers = None
+                if _is_raw_response(response):
+                    headers = response.headers
+                    response = response.parse()
+                    if asyncio.iscoroutine(response):
+                        response = await response
+            except Exception as e:
+                wait = self._retry(e, tokens, attempt, retry_transient)
+                if wait is None:
+                    raise
+                await asyncio.sleep(wait)
+                attempt += 1
+                continue
+            except BaseException:
+                # Cancelled, which says nothing about the provider
+                self.release(tokens)
+                raise
+            self.release(tokens, used_tokens=_used_tokens(response), headers=headers)
+            return response
+
+class RateLimiterRegistry:
+    """Process-wide `RateLimiter`s, one per provider and model."""
+    def __init__(self):
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider: str, model: str) -> RateLimiter:
+        with self._lock:
+            limiter = self._limiters.get((provider, model))
+            if limiter is None:
+                limiter = RateLimiter()
+                self._limiters[(provider, model)] = limiter
+            return limiter
+
+    def configure(self, provider: str, model: str, **kwargs) -> RateLimiter:
+        """Replace the limiter for `provider` and `model` with one built from `kwargs`."""
+        with self._lock:
+            limiter = RateLimiter(**kwargs)
+            self._limiters[(provider, model)] = limiter
+            return limiter
+
+    def clear(self):
+        with self._lock:
+            self._limiters.clear()
+
+rate_limiters = RateLimiterRegistry()
@@ -0,0 +1,76 @@
+import threading
+from typing import Callable, Dict, List, Tuple
+from toolla.utils import (
+    build_claude_tool_schema,
+    build_openai_tool_schema,
+)
+from toolla.tracing import span
+
+schema_builders = {
+    "claude": build_claude_tool_schema,
+    "openai": build_openai_tool_schema,
+}
+
+class ToolSet:
+    """Tool schemas for one provider format together with the functions they describe."""
+    def __init__(self, schemas: List[Dict], fns: Dict[str, Callable]):
+        self.schemas = schemas
+        self.fns = fns
+
+class _Entry:
+    def __init__(self, f: Callable):
+        self.f = f
+        self.code = getattr(f, "__code__", None)
+        self.doc = f.__doc__
+        self.schemas = {}
+
+    def is_current(self, f: Callable) -> bool:
+        return (
+            self.f is f
+            and self.code is getattr(f, "__code__", None)
+            and self.doc == f.__doc__
+        )
+
+class ToolSchemaRegistry:
+    """
+    Process-wide cache of tool schemas.  Each function's docstring and type
+    hints are compiled once per provider format.  Entries are keyed by the
+    function's module and qualified name and are rebuilt if a different
+    function object (or a changed docstring or code object) is seen under
+    that name.
+    """
+    def __init__(self):
+        self._entries: Dict[Tuple[str, str], _Entry] = {}
+        self._lock = threading.Lock()
+
+    def schema(self, f: Callable, provider: str) -> Dict:
+        """Schema for `f` in `provider` format ("claude" or "openai").
+        The returned dict is shared and must not be mutated."""
+        key = (f.__module__, f.__qualname__)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry.is_current(f):
+                entry = _Entry(f)
+                self._entries[key] = entry
+            schema = entry.schemas.get(provider)
+        if schema is None:
+            schema = schema_builders[provider](f)
+            with self._lock:
+                entry.schemas[provider] = schema
+        return schema
+
+    def tool_set(self, tools: List[Callable], provider: str) -> ToolSet:
+        with span("schema_build", "tools", provider=provider, tools=len(tools)):
+            return ToolSet(
+                schemas=[self.schema(f, provider) for f in tools],
+                fns={f.__name__: f for f in tools},
+            )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+tool_registry = ToolSchemaRegistry()
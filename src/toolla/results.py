@@ -0,0 +1,131 @@
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Union
+from toolla.tracing import event
+
+FETCH_TOOL_NAME = "fetch_tool_result"
+
+# Attribute set by `result_budget` on a tool function
+_BUDGET_ATTR = "toolla_max_result_chars"
+
+def result_budget(max_chars: int) -> Callable[[Callable], Callable]:
+    """
+    Decorator giving a tool its own result budget: results longer than
+    `max_chars` characters are stored behind a handle and the model sees
+    only their first `max_chars` characters.
+
+        @result_budget(2000)
+        def run_query(sql: str) -> str:
+            ...
+    """
+    def decorator(f: Callable) -> Callable:
+        setattr(f, _BUDGET_ATTR, max_chars)
+        return f
+    return decorator
+
+def tool_result_budget(f: Callable) -> Union[int, None]:
+    return getattr(f, _BUDGET_ATTR, None)
+
+class ResultStore:
+    """
+    Holds tool results too long to put in the conversation.  `render` turns
+    a result into the text the model sees: the result itself if it is within
+    its tool's budget, otherwise a preview and a handle that the tool from
+    `fetch_tool` reads slices of.
+
+    `budgets` maps tool names to budgets in characters, and tools without
+    one get `max_chars` (None for no limit).  Slices returned by the fetch
+    tool are at most `max_slice_chars` long.  At most `max_stored_chars` are
+    kept, dropping the oldest results first.
+    """
+    def __init__(
+        self,
+        max_chars: Union[int, None] = None,
+        budgets: Union[Dict[str, int], None] = None,
+        max_slice_chars: int = 4000,
+        max_stored_chars: int = 50_000_000,
+    ):
+        self.max_chars = max_chars
+        self.budgets = dict(budgets or {})
+        self.max_slice_chars = max_slice_chars
+        self.max_stored_chars = max_stored_chars
+        self.stored_chars = 0
+        self._results: "OrderedDict[str, str]" = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_tools(cls, tools, max_chars: Union[int, None] = None) -> Union["ResultStore", None]:
+        """A store for `tools` and their `result_budget`s, or None if no
+        result has a budget."""
+        budgets = {
+            f.__name__: tool_result_budget(f)
+            for f in tools
+            if tool_result_budget(f) is not None
+        }
+        if max_chars is None and not budgets:
+            return None
+        return cls(max_chars=max_chars, budgets=budgets)
+
+    def budget(self, name: str) -> Union[int, None]:
+        if name == FETCH_TOOL_NAME:
+            # Slices are already bounded
+            return None
+        return self.budgets.get(name, self.max_chars)
+
+    def render(self, name: str, result: Any) -> str:
+        text = str(result)
+        budget = self.budget(name)
+        if budget is None or len(text) <= budget:
+            return text
+        handle = self.put(text)
+        event("result_stored", "tool", tool=name, chars=len(text), handle=handle)
+        return (
+            f"{text[:budget]}\n"
+            f"[Result truncated to {budget} of {len(text)} characters.  The full "
+            f"result is stored as handle {handle!r}; call {FETCH_TOOL_NAME} with "
+            f"that handle, an offset and a length to read more of it.]"
+        )
+
+    def put(self, text: str) -> str:
+        with self._lock:
+            handle = f"result-{next(self._ids)}"
+            self._results[handle] = text
+            self.stored_chars += len(text)
+            while self.stored_chars > self.max_stored_chars and len(self._results) > 1:
+                _, dropped = self._results.popitem(last=False)
+                self.stored_chars -= len(dropped)
+            return handle
+
+    def fetch(self, handle: str, offset: int = 0, length: int = 4000) -> str:
+        with self._lock:
+            text = self._results.get(handle)
+        if text is None:
+            return f"Error: no stored result with handle {handle!r}."
+        offset = max(0, offset)
+        end = min(len(text), offset + max(0, min(length, self.max_slice_chars)))
+        return f"[Characters {offset} to {end} of {len(text)}]\n{text[offset:end]}"
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self.stored_chars = 0
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def fetch_tool(self) -> Callable:
+        """The tool the model calls to read stored results."""
+        store = self
+
+        def fetch_tool_result(handle: str, offset: int, length: int) -> str:
+            """
+            Read part of a tool result that was too long to show in full.
+
+            handle: The handle the result was stored under.
+            offset: Index of the first character to read.
+            length: Number of characters to read.
+            """
+            return store.fetch(handle, offset, length)
+        return fetch_tool_result
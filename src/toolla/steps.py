@@ -0,0 +1,96 @@
+import inspect
+from typing import Any, Dict, List, Sequence, Tuple, Union
+from toolla.utils import tool_results_prompt
+from toolla.tracing import span, use_tracer
+
+ToolCall = Tuple[str, Dict[str, Any]]
+
+class StepHook:
+    """
+    Observer for the steps of a single chat call.  A step is one request to
+    the model plus the tool calls it returned.  Override any of the methods.
+    """
+    def on_step_start(self, client, step: int):
+        pass
+
+    def on_step_end(self, client, step: int, calls: List[ToolCall], results: List[Any]):
+        pass
+
+def run_steps(
+    client,
+    prompt: str,
+    image: Union[str, None] = None,
+    current_fn_response = None,
+    disable_auto_execution = False,
+    hooks: Sequence[StepHook] = (),
+):
+    """
+    Drive `client` through the tool loop iteratively, up to `client.max_steps`
+    model requests, and return the value of the last tool called.
+
+    The client provides `_add_user_message`, `_request`, `_collect_tool_calls`
+    and `_run_tool_calls`, plus `model` and `tracer` attributes.  With a
+    tracer each call, step, request and batch of tool calls is recorded.
+    """
+    with use_tracer(client.tracer), span("chat", "chat", model=client.model):
+        client._add_user_message(prompt, image)
+        for step in range(client.max_steps):
+            with span("step", "step", step=step) as step_args:
+                for hook in hooks:
+                    hook.on_step_start(client, step)
+                with span("request", "request", step=step):
+                    response = client._request()
+                with span("collect_tool_calls", "parse", step=step):
+                    calls = client._collect_tool_calls(response, disable_auto_execution)
+                results = []
+                if calls:
+                    with span("tool_calls", "tool", step=step, calls=len(calls)):
+                        results = client._run_tool_calls(calls)
+                step_args["calls"] = len(calls)
+                for hook in hooks:
+                    hook.on_step_end(client, step, calls, results)
+            if not calls:
+                return current_fn_response
+            current_fn_response = results[-1]
+            if step + 1 < client.max_steps:
+                client._add_user_message(tool_results_prompt(calls, results, client.result_store), None)
+        print("Reached maxiumum number of steps, returning current tool response.")
+        return current_fn_response
+
+async def run_steps_async(
+    client,
+    prompt: str,
+    image: Union[str, None] = None,
+    current_fn_response = None,
+    disable_auto_execution = False,
+    hooks: Sequence[StepHook] = (),
+):
+    """`run_steps` for clients whose `_request` and `_run_tool_calls` are
+    awaitable.  `_collect_tool_calls` may be awaitable too, as it is when
+    a streamed response is read."""
+    with use_tracer(client.tracer), span("chat", "chat", model=client.model):
+        client._add_user_message(prompt, image)
+        for step in range(client.max_steps):
+            with span("step", "step", step=step) as step_args:
+                for hook in hooks:
+                    hook.on_step_start(client, step)
+                with span("request", "request", step=step):
+                    response = await client._request()
+                with span("collect_tool_calls", "parse", step=step):
+                    calls = client._collect_tool_calls(response, disable_auto_execution)
+                    if inspect.isawaitable(calls):
+                        calls = await calls
+                results = []
+                if calls:
+                    with span("tool_calls", "tool", step=step, calls=len(calls)):
+                        results = await client._run_tool_calls(calls)
+                step_args["calls"] = len(calls)
+                for hook in hooks:
+                    hook.on_step_end(client, step, calls, results)
+            if not calls:
+                return current_fn_response
+            current_fn_response = results[-1]
+            if step + 1 < client.max_steps:
+                client._add_user_message(tool_results_prompt(calls, results, client.result_store), None)
+        print("Reached maxiumum number of steps, returning current tool response.")
+        return current_fn_response
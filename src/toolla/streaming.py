@@ -0,0 +1,174 @@
+import json
+import re
+from typing import Any, Dict, List, Tuple, Union
+
+class DispatchedCalls(list):
+    """
+    (name, inputs) tool calls that were started while the response was still
+    streaming.  `futures` lines up with the calls and holds their results.
+    """
+    def __init__(self):
+        super().__init__()
+        self.futures = []
+
+    def add(self, name: str, inputs: Dict[str, Any], future):
+        self.append((name, inputs))
+        self.futures.append(future)
+
+def _load_arguments(parts: List[str]) -> Dict[str, Any]:
+    arguments = "".join(parts)
+    return json.loads(arguments) if arguments else {}
+
+class AnthropicStreamAccumulator:
+    """Rebuilds a Messages API response from its stream events and reports
+    each tool_use block as soon as its input JSON is complete."""
+    def __init__(self):
+        self.texts = []
+        self.stop_reason = None
+        self.usage = None
+        self._blocks = {}
+
+    def feed(self, event) -> List[Tuple[str, Dict[str, Any]]]:
+        """Consume one event, returning the tool calls it completed."""
+        if event.type == "content_block_start":
+            block = event.content_block
+            if block.type == "text":
+                self._blocks[event.index] = ("text", None, [block.text])
+            elif block.type == "tool_use":
+                self._blocks[event.index] = ("tool_use", block.name, [])
+        elif event.type == "content_block_delta":
+            _, _, parts = self._blocks[event.index]
+            if event.delta.type == "text_delta":
+                parts.append(event.delta.text)
+            elif event.delta.type == "input_json_delta":
+                parts.append(event.delta.partial_json)
+        elif event.type == "content_block_stop":
+            kind, name, parts = self._blocks.pop(event.index, (None, None, None))
+            if kind == "text":
+                self.texts.append("".join(parts))
+            elif kind == "tool_use":
+                return [(name, _load_arguments(parts))]
+        elif event.type == "message_start":
+            # Input and cache token counts; output tokens follow in message_delta
+            self.usage = getattr(event.message, "usage", None)
+        elif event.type == "message_delta":
+            self.stop_reason = event.delta.stop_reason
+            if self.usage is not None and getattr(event, "usage", None) is not None:
+                self.usage.output_tokens = event.usage.output_tokens
+        return []
+
+class OpenAIStreamAccumulator:
+    """Rebuilds a chat completion from its chunks.  A tool call is reported
+    once the next one starts or the choice finishes, since its arguments
+    can't grow after that."""
+    def __init__(self):
+        self.texts = []
+        self.finish_reason = None
+        self._calls = {}
+
+    def _complete(self, below: Union[int, None] = None):
+        done = sorted(i for i in self._calls if below is None or i < below)
+        completed = []
+        for i in done:
+            name, parts = self._calls.pop(i)
+            completed.append((name, _load_arguments(parts)))
+        return completed
+
+    def feed(self, chunk) -> List[Tuple[str, Dict[str, Any]]]:
+        """Consume one chunk, returning the tool calls it completed."""
+        completed = []
+        if not chunk.choices:
+            return completed
+        choice = chunk.choices[0]
+        delta = choice.delta
+        if delta.content:
+            self.texts.append(delta.content)
+        for tool_call in delta.tool_calls or []:
+            if tool_call.index not in self._calls:
+                completed += self._complete(below=tool_call.index)
+                self._calls[tool_call.index] = [None, []]
+            function = tool_call.function
+            if function is None:
+                continue
+            if function.name:
+                self._calls[tool_call.index][0] = function.name
+            if function.arguments:
+                self._calls[tool_call.index][1].append(function.arguments)
+        if choice.finish_reason:
+            self.finish_reason = choice.finish_reason
+            completed += self._complete()
+        return completed
+
+    @property
+    def text(self) -> str:
+        return "".join(self.texts)
+
+# Characters that matter inside an object, and inside a string within it
+_object_delimiters = re.compile(r'[{}"]')
+_string_delimiters = re.compile(r'["\\]')
+
+class JsonObjectScanner:
+    """
+    Finds top-level JSON objects in free text, such as a model reply that
+    embeds tool calls in prose or code fences.  Text can be fed in chunks as
+    it streams in.  Braces inside JSON strings and escaped quotes are
+    handled, and only the text of candidate objects is kept.
+    """
+    def __init__(self):
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._parts = []
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """Scan the next chunk, returning the objects it completed."""
+        objects = []
+        start = 0 if self._depth else None
+        pos = 0
+        while pos < len(chunk):
+            if self._escaped:
+                self._escaped = False
+                pos += 1
+                continue
+            if not self._depth:
+                # Quotes in the surrounding prose don't start strings
+                pos = chunk.find("{", pos)
+                if pos == -1:
+                    break
+                start = pos
+                self._depth = 1
+                pos += 1
+                continue
+            delimiters = _string_delimiters if self._in_string else _object_delimiters
+            match = delimiters.search(chunk, pos)
+            if match is None:
+                break
+            c = match.group()
+            pos = match.end()
+            if c == "\\":
+                self._escaped = True
+            elif c == '"':
+                self._in_string = not self._in_string
+            elif c == "{":
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if not self._depth:
+                    self._parts.append(chunk[start:pos])
+                    obj = self._load("".join(self._parts))
+                    if obj is not None:
+                        objects.append(obj)
+                    self._parts = []
+                    start = None
+        if start is not None:
+            self._parts.append(chunk[start:])
+        return objects
+
+    @staticmethod
+    def _load(text: str) -> Union[Dict[str, Any], None]:
+        try:
+            # Models often put raw newlines inside string values
+            obj = json.loads(text, strict=False)
+        except json.JSONDecodeError:
+            return None
+        return obj if isinstance(obj, dict) else None
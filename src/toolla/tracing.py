@@ -0,0 +1,153 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Union
+
+# Tracer of the chat call running in this context.  Code deep in the call
+# (history, rate limiter, registry) records spans through it without the
+# tracer having to be passed down.
+_current_tracer = contextvars.ContextVar("toolla_tracer", default=None)
+
+def _now_us() -> int:
+    return time.perf_counter_ns() // 1000
+
+class JsonlExporter:
+    """Writes each record as a line of JSON to `path` as it happens."""
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def export(self, record: Dict[str, Any]):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+class ChromeTraceExporter:
+    """Collects records and writes them to `path` in the Chrome trace event
+    format on `close`, for chrome://tracing or Perfetto."""
+    def __init__(self, path: str):
+        self.path = path
+        self.records = []
+        self._lock = threading.Lock()
+
+    def export(self, record: Dict[str, Any]):
+        with self._lock:
+            self.records.append(record)
+
+    def close(self):
+        with self._lock:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump({"traceEvents": self.records, "displayTimeUnit": "ms"}, f, default=str)
+
+class Tracer:
+    """
+    Records spans (timed operations) and instant events of chat calls and
+    hands each one to every exporter.  An exporter is any object with
+    `export(record)` and `close()` methods.
+
+    Records use the Chrome trace event fields: `name`, `cat`, `ph` ("X" for
+    a span, "i" for an event), `ts` and `dur` in microseconds of a
+    monotonic clock, `pid`, `tid` and `args`.
+    """
+    def __init__(self, exporters: Iterable = ()):
+        self.exporters = list(exporters)
+
+    def emit(self, record: Dict[str, Any]):
+        for exporter in self.exporters:
+            exporter.export(record)
+
+    def _record(self, name: str, category: str, phase: str, ts: int, args: Dict[str, Any]):
+        return {
+            "name": name,
+            "cat": category,
+            "ph": phase,
+            "ts": ts,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": args,
+        }
+
+    @contextmanager
+    def span(self, name: str, category: str, **attrs):
+        """Time the body of the `with` block.  It receives the span's args
+        dict, so attributes known only at the end can be added."""
+        start = _now_us()
+        args = dict(attrs)
+        try:
+            yield args
+        except BaseException as e:
+            args["error"] = repr(e)
+            raise
+        finally:
+            record = self._record(name, category, "X", start, args)
+            record["dur"] = _now_us() - start
+            self.emit(record)
+
+    def event(self, name: str, category: str, **attrs):
+        record = self._record(name, category, "i", _now_us(), attrs)
+        record["s"] = "t"
+        self.emit(record)
+
+    def close(self):
+        for exporter in self.exporters:
+            exporter.close()
+
+@contextmanager
+def use_tracer(tracer: Union[Tracer, None]):
+    """Make `tracer` the current tracer for the body of the `with` block."""
+    if tracer is None:
+        yield
+        return
+    token = _current_tracer.set(tracer)
+    try:
+        yield
+    finally:
+        _current_tracer.reset(token)
+
+def current_tracer() -> Union[Tracer, None]:
+    return _current_tracer.get()
+
+@contextmanager
+def span(name: str, category: str, **attrs):
+    """`Tracer.span` on the current tracer, or nothing if there is none."""
+    tracer = _current_tracer.get()
+    if tracer is None:
+        yield {}
+        return
+    with tracer.span(name, category, **attrs) as args:
+        yield args
+
+def event(name: str, category: str, **attrs):
+    tracer = _current_tracer.get()
+    if tracer is not None:
+        tracer.event(name, category, **attrs)
+
+def traced_tool(name: str, f: Callable) -> Callable:
+    """`f` wrapped to record a span per call.  The current tracer is captured
+    now, so calls made later on executor threads are recorded too."""
+    tracer = _current_tracer.get()
+    if tracer is None:
+        return f
+    if inspect.iscoroutinefunction(f):
+        @functools.wraps(f)
+        async def async_wrapper(**inputs):
+            with tracer.span("tool", "tool", tool=name):
+                return await f(**inputs)
+        return async_wrapper
+
+    @functools.wraps(f)
+    def wrapper(**inputs):
+        with tracer.span("tool", "tool", tool=name):
+            return f(**inputs)
+    return wrapper
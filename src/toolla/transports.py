@@ -0,0 +1,276 @@
+import asyncio
+import hashlib
+import os
+import sys
+import threading
+import weakref
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Tuple, Union
+
+# Provider SDKs and HTTP libraries are imported on first use, so a process
+# only pays for the backend it actually talks to
+if TYPE_CHECKING:
+    import anthropic
+    import httpx
+    import openai
+    import requests
+
+def _limits_cls(default_client_cls):
+    # SDK releases differ in which httpx distribution their clients are
+    # built on, so take Limits from the one behind the SDK's default client
+    for base in default_client_cls.__mro__:
+        module = sys.modules.get(base.__module__.split(".")[0])
+        if module is not None and hasattr(module, "Limits"):
+            return module.Limits
+    import httpx
+    return httpx.Limits
+
+def _key_id(api_key: Union[str, None]) -> str:
+    """Pool key for an API key, hashed so keys don't appear in stats."""
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+
+async def _aclose(client):
+    close = getattr(client, "aclose", None) or client.close
+    await close()
+
+async def _close_with_loop(clients: List[object]):
+    """Parked on a loop until the loop finalizes its async generators, which
+    `asyncio.run` does before closing it, then closes every client built for
+    the loop while their connections can still be shut down."""
+    try:
+        yield
+    finally:
+        for client in clients:
+            try:
+                await _aclose(client)
+            except Exception:
+                pass
+        clients.clear()
+
+class LoopBoundClient:
+    """
+    Stand-in for an async client that is looked up with `get` whenever it
+    is used, so a chat built outside an event loop, or used from several,
+    talks through the pooled client of the loop it is running on.
+    `with_options` is applied to each client looked up.
+    """
+    def __init__(self, get: Callable[[], Any], options: Union[Dict[str, Any], None] = None):
+        self._get = get
+        self._options = options or {}
+        self._cached = (None, None)
+
+    def current(self):
+        client = self._get()
+        pooled, configured = self._cached
+        if pooled is not client:
+            configured = client.with_options(**self._options) if self._options else client
+            self._cached = (client, configured)
+        return configured
+
+    def with_options(self, **options) -> "LoopBoundClient":
+        return LoopBoundClient(self._get, {**self._options, **options})
+
+    def __getattr__(self, name: str):
+        return getattr(self.current(), name)
+
+class TransportPool:
+    """
+    Process-wide pool of provider clients, so chats for the same provider,
+    base_url and API key share one set of keep-alive HTTP connections
+    instead of paying new TCP/TLS handshakes for every `Chat`.
+
+    Async clients are pooled per event loop because their connections are
+    bound to the loop they were opened on.  They are closed when the loop
+    shuts down its async generators, as `asyncio.run` does, and forgotten
+    once the loop is closed.  Outside a running loop a fresh async client
+    is returned.
+    """
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 5.0,
+    ):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.hits = 0
+        self.misses = 0
+        self._clients: Dict[Tuple, object] = {}
+        self._async_clients = weakref.WeakKeyDictionary()
+        # Per loop, the clients built for it and the generator closing them
+        self._loop_entries = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def configure(
+        self,
+        max_connections: Union[int, None] = None,
+        max_keepalive_connections: Union[int, None] = None,
+        keepalive_expiry: Union[float, None] = None,
+    ):
+        """Change pool limits for clients built from now on.  Pooled clients
+        are dropped from the pool but not closed, as existing chats still
+        use them with the old limits."""
+        if max_connections is not None:
+            self.max_connections = max_connections
+        if max_keepalive_connections is not None:
+            self.max_keepalive_connections = max_keepalive_connections
+        if keepalive_expiry is not None:
+            self.keepalive_expiry = keepalive_expiry
+        with self._lock:
+            self._clients.clear()
+            self._async_clients.clear()
+
+    def _limits(self, limits_cls):
+        return limits_cls(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def _get(self, key: Tuple, build: Callable, per_loop: bool = False):
+        loop = None
+        if per_loop:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                with self._lock:
+                    self.misses += 1
+                return build()
+        with self._lock:
+            clients = self._clients if loop is None else self._loop_clients(loop)
+            client = clients.get(key)
+            if client is not None:
+                self.hits += 1
+                return client
+            self.misses += 1
+            client = build()
+            clients[key] = client
+            if loop is not None:
+                self._loop_entries[loop][0].append(client)
+            return client
+
+    def _loop_clients(self, loop: asyncio.AbstractEventLoop) -> Dict[Tuple, object]:
+        # Called with the lock held, on the loop's thread
+        if loop not in self._loop_entries:
+            # A closed loop's clients (and sockets) keep it alive, so drop them.
+            # Loops that weren't shut down by asyncio.run can't close them any more.
+            for closed in [l for l in self._loop_entries if l.is_closed()]:
+                del self._loop_entries[closed]
+                self._async_clients.pop(closed, None)
+            built = []
+            closer = _close_with_loop(built)
+            # Started on the loop so that the loop finalizes it at shutdown
+            loop.create_task(closer.__anext__())
+            self._loop_entries[loop] = (built, closer)
+        return self._async_clients.setdefault(loop, {})
+
+    def anthropic_client(self, api_key: Union[str, None]) -> "anthropic.Anthropic":
+        import anthropic
+        api_key = api_key or os.environ.get("ANTHROPIC_API_KEY")
+        return self._get(
+            ("anthropic", None, _key_id(api_key)),
+            lambda: anthropic.Anthropic(
+                api_key=api_key,
+                http_client=anthropic.DefaultHttpxClient(
+                    limits=self._limits(_limits_cls(anthropic.DefaultHttpxClient))
+                ),
+            ),
+        )
+
+    def async_anthropic_client(self, api_key: Union[str, None]) -> "anthropic.AsyncAnthropic":
+        import anthropic
+        api_key = api_key or os.environ.get("ANTHROPIC_API_KEY")
+        return self._get(
+            ("anthropic", None, _key_id(api_key)),
+            lambda: anthropic.AsyncAnthropic(
+                api_key=api_key,
+                http_client=anthropic.DefaultAsyncHttpxClient(
+                    limits=self._limits(_limits_cls(anthropic.DefaultAsyncHttpxClient))
+                ),
+            ),
+            per_loop=True,
+        )
+
+    def openai_client(
+        self,
+        api_key: Union[str, None],
+        base_url: Union[str, None] = None,
+    ) -> "openai.OpenAI":
+        import openai
+        return self._get(
+            ("openai", base_url, _key_id(api_key)),
+            lambda: openai.OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=openai.DefaultHttpxClient(
+                    limits=self._limits(_limits_cls(openai.DefaultHttpxClient))
+                ),
+            ),
+        )
+
+    def async_openai_client(
+        self,
+        api_key: Union[str, None],
+        base_url: Union[str, None] = None,
+    ) -> "openai.AsyncOpenAI":
+        import openai
+        return self._get(
+            ("openai", base_url, _key_id(api_key)),
+            lambda: openai.AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=openai.DefaultAsyncHttpxClient(
+                    limits=self._limits(_limits_cls(openai.DefaultAsyncHttpxClient))
+                ),
+            ),
+            per_loop=True,
+        )
+
+    def session(self, base_url: str) -> "requests.Session":
+        """Keep-alive `requests` session for a plain HTTP endpoint such as Ollama."""
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        def build():
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=self.max_keepalive_connections,
+                pool_maxsize=self.max_connections,
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            return session
+        return self._get(("session", base_url, None), build)
+
+    def async_session(self, base_url: str) -> "httpx.AsyncClient":
+        import httpx
+        return self._get(
+            ("session", base_url, None),
+            lambda: httpx.AsyncClient(
+                base_url=base_url,
+                timeout=None,
+                limits=self._limits(httpx.Limits),
+            ),
+            per_loop=True,
+        )
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "clients": len(self._clients),
+                "async_clients": sum(len(c) for c in self._async_clients.values()),
+            }
+
+    def close(self):
+        """Close and forget every pooled sync client, including those
+        chats still hold.  For shutting down."""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._async_clients.clear()
+        for client in clients:
+            client.close()
+
+transport_pool = TransportPool()
@@ -1,5 +1,11 @@
+import asyncio
 import base64
+import functools
+import inspect
 import json
+import os
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
 from typing import (
     get_type_hints,
     Callable,
@@ -8,10 +14,19 @@ from typing import (
     Optional,
     Union,
     List,
+    Tuple,
 )
 from enum import Enum
 from pathlib import Path
-from toolla.exceptions import InvalidDescriptionException
+from toolla.exceptions import (
+    InvalidDescriptionException,
+    AbortedToolException,
+)
+from toolla.cache import ResponseCache, cache_key, tool_memo_cache
+from toolla.execution import ToolError, tool_execution_policy
+from toolla.results import ResultStore
+from toolla.streaming import DispatchedCalls, JsonObjectScanner
+from toolla.tracing import current_tracer, span, traced_tool
 
 def parse_and_cast_input_types(
     inputs: Dict[str, Union[int, float, str]],
@@ -34,21 +49,17 @@ def load_json(text: str):
     except (FileNotFoundError, json.JSONDecodeError):
         return None
 
-def extract_json_from_text(text):
-    text_without_newlines = text.replace('\n', '')
-    start_index = None
-    curly_brace_count = 0
-    for i, c in enumerate(text_without_newlines):
-        if c == '{':
-            curly_brace_count += 1
-            if not start_index:
-                start_index = i
-        if c == '}':
-            curly_brace_count -= 1
-            if curly_brace_count == 0:
-                print("Found text: ", text_without_newlines[start_index:i+1])
-                return json.loads(text_without_newlines[start_index:i+1])
-    return None
+def extract_json_objects(text: str) -> List[Dict[str, Any]]:
+    """Every top-level JSON object embedded in `text`, in order."""
+    with span("extract_json", "parse", chars=len(text)) as args:
+        objects = JsonObjectScanner().feed(text)
+        args["objects"] = len(objects)
+    return objects
+
+def extract_json_from_text(text: str) -> Union[Dict[str, Any], None]:
+    """The first JSON object embedded in `text`, or None."""
+    objects = extract_json_objects(text)
+    return objects[0] if objects else None
 
 # Generated by Claude Sonnet 3.5
 def parse_descriptions(input_string):
@@ -142,10 +153,36 @@ def build_claude_tool_schema(f: Callable):
         schema["input_schema"]["required"].append(param)
     return schema
 
+# Multiple of 3 so each chunk encodes to base64 without padding
+BASE64_CHUNK_SIZE = 3 * 256 * 1024
+
 def load_file_base64(file_path: Path) -> str:
+    """Base64 encode a file chunk by chunk into one preallocated buffer, so
+    the file is never held whole next to its encoding."""
+    buffer = bytearray(BASE64_CHUNK_SIZE)
+    view = memoryview(buffer)
     with open(file_path, "rb") as file:
-        file_content = file.read()
-        return base64.b64encode(file_content).decode('utf-8')
+        size = os.fstat(file.fileno()).st_size
+        encoded = bytearray(4 * -(-size // 3))
+        position = 0
+        while True:
+            # Fill the whole chunk, so only the last one needs padding
+            n = 0
+            while n < BASE64_CHUNK_SIZE:
+                read = file.readinto(view[n:])
+                if not read:
+                    break
+                n += read
+            if not n:
+                break
+            chunk = base64.b64encode(view[:n])
+            encoded[position:position + len(chunk)] = chunk
+            position += len(chunk)
+            if n < BASE64_CHUNK_SIZE:
+                break
+    # A file that shrank while being read leaves the buffer too long
+    del encoded[position:]
+    return encoded.decode('ascii')
 
 def get_image_mime_type(fpath: Path) -> str:
     suffix = fpath.suffix
@@ -157,3 +194,168 @@ def get_image_mime_type(fpath: Path) -> str:
         '.webp': 'image/webp',
     }
     return mime_types.get(suffix)
+
+def confirm_tool_call(name: str, inputs: Any):
+    """Ask the user on stdin whether tool `name` may run, raise if not."""
+    print(f"Function {name} is about to be called with inputs: {inputs}")
+    user_input = input("Do you want to run this function? (y/n): ")
+    if user_input.lower() not in ['y', 'Y']:
+        print("Function call aborted by user.")
+        raise AbortedToolException
+
+_default_tool_executor = None
+_default_tool_executor_lock = threading.Lock()
+
+def get_default_tool_executor() -> Executor:
+    """Process-wide thread pool used for tool calls when none is configured."""
+    global _default_tool_executor
+    with _default_tool_executor_lock:
+        if _default_tool_executor is None:
+            _default_tool_executor = ThreadPoolExecutor(thread_name_prefix="toolla-tool")
+        return _default_tool_executor
+
+def tool_cache_key(name: str, f: Callable, inputs: Dict[str, Any]) -> str:
+    """Memo key of a call: the tool name and its inputs cast to the tool's
+    parameter types, so 3 and "3" for an int parameter share an entry."""
+    try:
+        inputs = parse_and_cast_input_types(inputs, f)
+    except (KeyError, TypeError, ValueError):
+        pass
+    return cache_key(f"tool:{name}", inputs)
+
+def _memoized(name: str, f: Callable, run: Callable, cache: ResponseCache) -> Callable:
+    # Captured now, as tools may run on executor threads
+    tracer = current_tracer()
+
+    def lookup(inputs: Dict[str, Any]):
+        key = tool_cache_key(name, f, inputs)
+        # Results are cached wrapped in a tuple, so None can be cached too
+        hit = cache.get(key)
+        if tracer is not None:
+            tracer.event("tool_cache", "cache", tool=name, hit=hit is not None)
+        return key, hit
+
+    def remember(key: str, result):
+        if not isinstance(result, ToolError):
+            cache.set(key, (result,))
+
+    if inspect.iscoroutinefunction(run):
+        @functools.wraps(f)
+        async def async_memoized(**inputs):
+            key, hit = lookup(inputs)
+            if hit is not None:
+                return hit[0]
+            result = await run(**inputs)
+            remember(key, result)
+            return result
+        return async_memoized
+
+    @functools.wraps(f)
+    def memoized(**inputs):
+        key, hit = lookup(inputs)
+        if hit is not None:
+            return hit[0]
+        result = run(**inputs)
+        remember(key, result)
+        return result
+    return memoized
+
+def runnable_tool(name: str, f: Callable) -> Callable:
+    """`f` under its execution policy, if it has one, traced and memoized
+    if it is marked with `memoize`."""
+    run = f
+    policy = tool_execution_policy(f)
+    if policy is not None:
+        run = policy.bind(name, f)
+    run = traced_tool(name, run)
+    cache = tool_memo_cache(f)
+    return run if cache is None else _memoized(name, f, run, cache)
+
+def runnable_tool_async(name: str, f: Callable) -> Callable:
+    run = f
+    policy = tool_execution_policy(f)
+    if policy is not None:
+        if policy.mode == "inline" and not inspect.iscoroutinefunction(f):
+            # Left sync, so `call_tool_async` runs it on the tool executor
+            run = policy.bind(name, f)
+        else:
+            run = policy.bind_async(name, f)
+    run = traced_tool(name, run)
+    cache = tool_memo_cache(f)
+    return run if cache is None else _memoized(name, f, run, cache)
+
+def run_tool_calls(
+    tool_fns: Dict[str, Callable],
+    calls: List[Tuple[str, Dict[str, Any]]],
+    executor: Union[Executor, None] = None,
+) -> List[Any]:
+    """Run every (name, inputs) call from one model turn and return the
+    results in order.  More than one call is dispatched together on `executor`."""
+    if isinstance(calls, DispatchedCalls):
+        return [future.result() for future in calls.futures]
+    if len(calls) == 1:
+        name, inputs = calls[0]
+        return [runnable_tool(name, tool_fns[name])(**inputs)]
+    executor = executor or get_default_tool_executor()
+    futures = [
+        executor.submit(runnable_tool(name, tool_fns[name]), **inputs)
+        for name, inputs in calls
+    ]
+    return [future.result() for future in futures]
+
+async def call_tool_async(
+    f: Callable,
+    inputs: Dict[str, Any],
+    executor: Union[Executor, None] = None,
+):
+    """Await `f` if it is a coroutine function, otherwise run it in
+    `executor` so blocking tools don't stall the event loop."""
+    if inspect.iscoroutinefunction(f):
+        return await f(**inputs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(f, **inputs))
+
+async def run_tool_calls_async(
+    tool_fns: Dict[str, Callable],
+    calls: List[Tuple[str, Dict[str, Any]]],
+    executor: Union[Executor, None] = None,
+) -> List[Any]:
+    if isinstance(calls, DispatchedCalls):
+        return list(await asyncio.gather(*calls.futures))
+    return list(await asyncio.gather(
+        *(call_tool_async(runnable_tool_async(name, tool_fns[name]), inputs, executor) for name, inputs in calls)
+    ))
+
+def dispatch_tool_call(
+    tool_fns: Dict[str, Callable],
+    name: str,
+    inputs: Dict[str, Any],
+    executor: Union[Executor, None] = None,
+):
+    """Start tool `name` on `executor` and return its future."""
+    executor = executor or get_default_tool_executor()
+    return executor.submit(runnable_tool(name, tool_fns[name]), **inputs)
+
+def dispatch_tool_call_async(
+    tool_fns: Dict[str, Callable],
+    name: str,
+    inputs: Dict[str, Any],
+    executor: Union[Executor, None] = None,
+) -> asyncio.Task:
+    """Start tool `name` as a task on the running loop."""
+    return asyncio.ensure_future(call_tool_async(runnable_tool_async(name, tool_fns[name]), inputs, executor))
+
+def tool_results_prompt(
+    calls: List[Tuple[str, Any]],
+    results: List[Any],
+    result_store: Union[ResultStore, None] = None,
+) -> str:
+    """Follow-up user prompt reporting the results of every tool call in a
+    turn.  With a `result_store`, results over their tool's budget are
+    replaced by a preview and a handle."""
+    if result_store is not None:
+        results = [result_store.render(name, r) for (name, _), r in zip(calls, results)]
+    return "".join(
+        f"\nFunction {name} was called and returned a value of {r}"
+        for (name, _), r in zip(calls, results)
+    )
@@ -0,0 +1,158 @@
+from types import SimpleNamespace
+from anthropic.types import TextBlock, ToolUseBlock
+
+def claude_text(text: str, stop_reason: str = "end_turn"):
+    return SimpleNamespace(
+        content=[TextBlock(type="text", text=text)],
+        stop_reason=stop_reason,
+    )
+
+def claude_tool_use(*calls, text: str = None):
+    content = [TextBlock(type="text", text=text)] if text else []
+    for i, (name, inputs) in enumerate(calls):
+        content.append(
+            ToolUseBlock(type="tool_use", id=f"toolu_{i}", name=name, input=inputs)
+        )
+    return SimpleNamespace(content=content, stop_reason="tool_use")
+
+def openai_text(text: str):
+    message = SimpleNamespace(content=text, tool_calls=None)
+    return SimpleNamespace(
+        choices=[SimpleNamespace(finish_reason="stop", message=message)]
+    )
+
+def openai_tool_calls(*calls):
+    tool_calls = [
+        SimpleNamespace(
+            id=f"call_{i}",
+            type="function",
+            function=SimpleNamespace(name=name, arguments=arguments),
+        )
+        for i, (name, arguments) in enumerate(calls)
+    ]
+    message = SimpleNamespace(content=None, tool_calls=tool_calls)
+    return SimpleNamespace(
+        choices=[SimpleNamespace(finish_reason="tool_calls", message=message)]
+    )
+
+class FakeCreate:
+    """Callable standing in for `messages.create` / `chat.completions.create`
+    that replays scripted responses and records the kwargs it was sent."""
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def __call__(self, **kwargs):
+        self.calls.append(kwargs)
+        return self.responses.pop(0)
+
+class AsyncFakeCreate(FakeCreate):
+    async def __call__(self, **kwargs):
+        return super().__call__(**kwargs)
+
+def fake_anthropic(create):
+    return SimpleNamespace(messages=SimpleNamespace(create=create))
+
+def fake_openai(create):
+    return SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+    )
+
+def claude_stream(*calls, text: str = None):
+    """Messages API stream events for a turn with optional text and tool_use blocks."""
+    events = []
+    blocks = []
+    if text:
+        blocks.append(("text", text))
+    blocks += [("tool_use", call) for call in calls]
+    for index, (kind, value) in enumerate(blocks):
+        if kind == "text":
+            events.append(SimpleNamespace(
+                type="content_block_start",
+                index=index,
+                content_block=SimpleNamespace(type="text", text=""),
+            ))
+            events.append(SimpleNamespace(
+                type="content_block_delta",
+                index=index,
+                delta=SimpleNamespace(type="text_delta", text=value),
+            ))
+        else:
+            name, arguments = value
+            events.append(SimpleNamespace(
+                type="content_block_start",
+                index=index,
+                content_block=SimpleNamespace(type="tool_use", id=f"toolu_{index}", name=name, input={}),
+            ))
+            # Split the input JSON the way the API does
+            middle = len(arguments) // 2
+            for part in (arguments[:middle], arguments[middle:]):
+                events.append(SimpleNamespace(
+                    type="content_block_delta",
+                    index=index,
+                    delta=SimpleNamespace(type="input_json_delta", partial_json=part),
+                ))
+        events.append(SimpleNamespace(type="content_block_stop", index=index))
+    stop_reason = "tool_use" if calls else "end_turn"
+    events.append(SimpleNamespace(type="message_delta", delta=SimpleNamespace(stop_reason=stop_reason)))
+    events.append(SimpleNamespace(type="message_stop"))
+    return events
+
+def _openai_chunk(content=None, tool_calls=None, finish_reason=None):
+    delta = SimpleNamespace(content=content, tool_calls=tool_calls)
+    return SimpleNamespace(
+        choices=[SimpleNamespace(delta=delta, finish_reason=finish_reason)]
+    )
+
+def openai_stream(*calls, text: str = None):
+    """Chat completion chunks for a turn with either text or tool calls."""
+    if text:
+        return [_openai_chunk(content=text), _openai_chunk(finish_reason="stop")]
+    chunks = []
+    for index, (name, arguments) in enumerate(calls):
+        chunks.append(_openai_chunk(tool_calls=[SimpleNamespace(
+            index=index,
+            id=f"call_{index}",
+            function=SimpleNamespace(name=name, arguments=""),
+        )]))
+        middle = len(arguments) // 2
+        for part in (arguments[:middle], arguments[middle:]):
+            chunks.append(_openai_chunk(tool_calls=[SimpleNamespace(
+                index=index,
+                id=None,
+                function=SimpleNamespace(name=None, arguments=part),
+            )]))
+    chunks.append(_openai_chunk(finish_reason="tool_calls"))
+    return chunks
+
+class AsyncStream:
+    def __init__(self, items):
+        self.items = list(items)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for item in self.items:
+            yield item
+
+class FakeSession:
+    """Stands in for the `requests.Session` of an Ollama client, replaying
+    scripted JSON bodies and recording (url, payload) for each post."""
+    def __init__(self, bodies):
+        self.bodies = list(bodies)
+        self.posts = []
+
+    def post(self, url, json=None):
+        self.posts.append((url, json))
+        body = self.bodies.pop(0)
+        return SimpleNamespace(json=lambda: body)
+
+def ollama_message(content: str = "", tool_calls=None):
+    message = {"role": "assistant", "content": content}
+    if tool_calls:
+        message["tool_calls"] = [
+            {"function": {"name": name, "arguments": arguments}}
+            for name, arguments in tool_calls
+        ]
+    return {"message": message}
@@ -0,0 +1,59 @@
+import asyncio
+import time
+from toolla.chat import AsyncChat
+from toolla.anthropic_client import AsyncAnthropicClient
+from toolla.openai_client import AsyncOpenAIClient
+from .tools import add, multiply
+from .fakes import (
+    AsyncFakeCreate,
+    claude_text,
+    claude_tool_use,
+    openai_text,
+    openai_tool_calls,
+    fake_anthropic,
+    fake_openai,
+)
+
+def test_async_chat_selects_async_clients():
+    assert isinstance(AsyncChat(api_key="test").client, AsyncAnthropicClient)
+    assert isinstance(AsyncChat(model="gpt-4o", api_key="test").client, AsyncOpenAIClient)
+
+def test_async_claude_tool_loop():
+    chat = AsyncChat(tools=[add, multiply], api_key="test")
+    create = AsyncFakeCreate([
+        claude_tool_use(("multiply", {"x": 4, "y": 4911})),
+        claude_tool_use(("add", {"x": 19644, "y": 18})),
+        claude_text("The answer is 19662"),
+    ])
+    chat.client.client = fake_anthropic(create)
+    r = asyncio.run(chat("What is (4*4911)+18?"))
+    assert r == 19662
+    assert len(create.calls) == 3
+    assert chat.get_messages()[-1]["content"] == "The answer is 19662"
+
+def test_async_openai_tool_loop():
+    chat = AsyncChat(model="gpt-4o", tools=[add], api_key="test")
+    create = AsyncFakeCreate([
+        openai_tool_calls(("add", '{"x": 2, "y": 3}')),
+        openai_text("5"),
+    ])
+    chat.client.client = fake_openai(create)
+    assert asyncio.run(chat("What is 2+3?")) == 5
+
+def test_async_chats_multiplex_on_one_loop():
+    async def slow_create(**kwargs):
+        await asyncio.sleep(0.05)
+        return claude_text("hi")
+
+    chats = [AsyncChat(api_key="test") for _ in range(50)]
+    for chat in chats:
+        chat.client.client = fake_anthropic(slow_create)
+
+    async def run_all():
+        await asyncio.gather(*(chat("hello") for chat in chats))
+
+    start = time.monotonic()
+    asyncio.run(run_all())
+    # 50 sequential requests would take at least 2.5s
+    assert time.monotonic() - start < 1.0
+    assert all(chat.get_messages()[-1]["content"] == "hi" for chat in chats)
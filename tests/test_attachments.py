@@ -0,0 +1,45 @@
+import os
+import base64
+from toolla.attachments import AttachmentCache
+
+def write(path, data):
+    path.write_bytes(data)
+    return path
+
+def test_cached_payload_matches_base64(tmp_path):
+    data = os.urandom(2 * 1024 * 1024 + 7)
+    fpath = write(tmp_path / "big.png", data)
+    cache = AttachmentCache()
+    assert cache.load(fpath) == base64.b64encode(data).decode()
+    assert cache.load(fpath) == base64.b64encode(data).decode()
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+def test_modified_file_is_reencoded(tmp_path):
+    fpath = write(tmp_path / "a.jpg", b"first")
+    cache = AttachmentCache()
+    cache.load(fpath)
+    write(fpath, b"second!")
+    assert cache.load(fpath) == base64.b64encode(b"second!").decode()
+    assert cache.misses == 2
+
+def test_content_key_shares_identical_files(tmp_path):
+    a = write(tmp_path / "a.jpg", b"same bytes")
+    b = write(tmp_path / "b.jpg", b"same bytes")
+    cache = AttachmentCache(by_content=True)
+    cache.load(a)
+    cache.load(b)
+    assert cache.hits == 1
+    assert cache.stats()["entries"] == 1
+
+def test_lru_evicts_to_byte_cap(tmp_path):
+    files = [write(tmp_path / f"{i}.png", bytes([i]) * 300) for i in range(3)]
+    cache = AttachmentCache(max_bytes=900)
+    for fpath in files:
+        cache.load(fpath)
+    assert cache.current_bytes <= 900
+    assert cache.stats()["entries"] == 2
+    cache.load(files[2])
+    assert cache.hits == 1
+    cache.load(files[0])
+    assert cache.misses == 4
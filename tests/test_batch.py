@@ -0,0 +1,110 @@
+import asyncio
+import threading
+import time
+from toolla.chat import Chat, AsyncChat
+from .tools import add
+from .fakes import claude_text, claude_tool_use, fake_anthropic
+
+def scripted_claude(delay=0.0):
+    """Fake messages.create that adds the two numbers in the prompt via the
+    add tool, failing for prompts containing 'boom'."""
+    state = {"active": 0, "peak": 0}
+    lock = threading.Lock()
+
+    def create(**kwargs):
+        with lock:
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+        try:
+            time.sleep(delay)
+            last = kwargs["messages"][-1]["content"][0]["text"]
+            if "boom" in last:
+                raise RuntimeError("provider error")
+            if last.startswith("\nFunction"):
+                return claude_text("done")
+            x, y = (int(n) for n in last.split("+"))
+            return claude_tool_use(("add", {"x": x, "y": y}))
+        finally:
+            with lock:
+                state["active"] -= 1
+    return create, state
+
+def test_batch_runs_isolated_conversations():
+    chat = Chat(tools=[add], api_key="test")
+    create, state = scripted_claude(delay=0.02)
+    chat.client.client = fake_anthropic(create)
+    results = list(chat.batch([f"{i}+1" for i in range(20)], max_concurrency=4))
+    assert sorted(r.value for r in results) == list(range(1, 21))
+    assert all(len(r.messages) == 3 for r in results)
+    assert state["peak"] <= 4
+    assert chat.get_messages() == []
+
+def test_batch_captures_failures_per_item():
+    chat = Chat(tools=[add], api_key="test")
+    create, _ = scripted_claude()
+    chat.client.client = fake_anthropic(create)
+    results = sorted(chat.batch(["1+1", "boom", "2+2"]), key=lambda r: r.index)
+    assert [r.ok for r in results] == [True, False, True]
+    assert isinstance(results[1].error, RuntimeError)
+    assert results[1].messages[0]["content"][0]["text"] == "boom"
+    assert results[2].value == 4
+
+def test_batch_yields_in_completion_order():
+    chat = Chat(api_key="test")
+
+    def create(**kwargs):
+        delay = float(kwargs["messages"][-1]["content"][0]["text"])
+        time.sleep(delay)
+        return claude_text("ok")
+
+    chat.client.client = fake_anthropic(create)
+    order = [r.index for r in chat.batch(["0.2", "0.0", "0.1"], max_concurrency=3)]
+    assert order == [1, 2, 0]
+
+def test_async_batch():
+    chat = AsyncChat(tools=[add], api_key="test")
+    sync_create, _ = scripted_claude()
+
+    async def create(**kwargs):
+        return sync_create(**kwargs)
+
+    chat.client.client = fake_anthropic(create)
+
+    async def collect():
+        return [r async for r in chat.batch(["1+2", "boom", "3+4"], max_concurrency=2)]
+
+    results = sorted(asyncio.run(collect()), key=lambda r: r.index)
+    assert [r.value for r in results] == [3, None, 7]
+    assert not results[1].ok
+
+def test_stopping_a_batch_early_skips_the_rest():
+    chat = Chat(api_key="test")
+    calls = []
+
+    def create(**kwargs):
+        calls.append(1)
+        time.sleep(0.2)
+        return claude_text("ok")
+
+    chat.client.client = fake_anthropic(create)
+    start = time.perf_counter()
+    for result in chat.batch([str(i) for i in range(40)], max_concurrency=2):
+        break
+    assert time.perf_counter() - start < 1.0
+    time.sleep(0.3)
+    assert len(calls) <= 3
+
+def test_batch_takes_items_as_workers_free_up():
+    chat = Chat(api_key="test")
+    chat.client.client = fake_anthropic(lambda **kwargs: claude_text("ok"))
+    taken = []
+
+    def prompts():
+        for i in range(100):
+            taken.append(i)
+            yield str(i)
+
+    results = chat.batch(prompts(), max_concurrency=4)
+    next(results)
+    assert len(taken) <= 5
+    assert len(list(results)) == 99
@@ -0,0 +1,172 @@
+import asyncio
+import time
+from toolla.chat import Chat
+from toolla.cache import ResponseCache, cache_key, memoize, tool_memo_cache
+from toolla.execution import execution_policy
+from toolla.tracing import Tracer
+from toolla.utils import run_tool_calls, run_tool_calls_async
+from .tools import add
+from .fakes import FakeCreate, claude_text, claude_tool_use, fake_anthropic
+
+def test_cache_key_is_stable_and_sensitive():
+    kwargs = {"model": "m", "messages": [{"role": "user", "content": "hi"}], "tools": []}
+    same = {"tools": [], "messages": [{"content": "hi", "role": "user"}], "model": "m"}
+    assert cache_key("anthropic", kwargs) == cache_key("anthropic", same)
+    assert cache_key("openai", kwargs) != cache_key("anthropic", kwargs)
+    assert cache_key("anthropic", {**kwargs, "system": "x"}) != cache_key("anthropic", kwargs)
+
+def test_memory_tier_lru_and_stats():
+    cache = ResponseCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.stats() == {"memory_hits": 1, "disk_hits": 0, "misses": 1, "entries": 2}
+
+def test_ttl_expires_entries():
+    cache = ResponseCache(ttl=0.05)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(0.1)
+    assert cache.get("a") is None
+
+def test_sqlite_tier_shared_between_instances(tmp_path):
+    path = str(tmp_path / "responses.db")
+    writer = ResponseCache(path=path)
+    writer.set("a", {"text": "hello"})
+    reader = ResponseCache(path=path)
+    assert reader.get("a") == {"text": "hello"}
+    assert reader.get("a") == {"text": "hello"}
+    assert reader.stats()["disk_hits"] == 1
+    assert reader.stats()["memory_hits"] == 1
+
+def test_sqlite_tier_size_eviction(tmp_path):
+    cache = ResponseCache(max_entries=1, path=str(tmp_path / "r.db"), max_disk_entries=2)
+    for key in "abc":
+        cache.set(key, key)
+        time.sleep(0.01)
+    assert ResponseCache(path=str(tmp_path / "r.db")).get("a") is None
+
+def test_sqlite_tier_rebuilds_sdk_responses(tmp_path):
+    from anthropic.types import Message, TextBlock
+    path = str(tmp_path / "responses.db")
+    message = Message(
+        id="msg_1",
+        type="message",
+        role="assistant",
+        model="claude-3-5-sonnet-20240620",
+        content=[TextBlock(type="text", text="hello")],
+        stop_reason="end_turn",
+        usage={"input_tokens": 1, "output_tokens": 1},
+    )
+    ResponseCache(path=path).set("a", message)
+    assert ResponseCache(path=path).get("a") == message
+    # Not JSON, so only kept in memory
+    writer = ResponseCache(path=path)
+    writer.set("b", (1, 2))
+    assert writer.get("b") == (1, 2)
+    assert ResponseCache(path=path).get("b") is None
+
+def test_unreadable_rows_are_misses(tmp_path):
+    import pickle
+    import sqlite3
+    path = str(tmp_path / "responses.db")
+    cache = ResponseCache(path=path)
+    rows = [
+        ("pickled", pickle.dumps({"text": "hello"})),
+        ("garbage", "{not json"),
+        ("not_a_model", '{"class": "os:system", "json": "{}"}'),
+    ]
+    db = sqlite3.connect(path)
+    db.executemany("INSERT INTO responses VALUES (?, 0, 0, ?)", rows)
+    db.commit()
+    for key, _ in rows:
+        assert cache.get(key) is None
+    assert db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] == 0
+    assert cache.stats()["misses"] == 3
+
+def test_chat_replays_from_cache():
+    cache = ResponseCache()
+    responses = [claude_tool_use(("add", {"x": 2, "y": 3})), claude_text("5")]
+    first = Chat(tools=[add], api_key="test", response_cache=cache)
+    first.client.client = fake_anthropic(FakeCreate(responses))
+    assert first("What is 2+3?") == 5
+
+    second = Chat(tools=[add], api_key="test", response_cache=cache)
+    create = FakeCreate([])
+    second.client.client = fake_anthropic(create)
+    assert second("What is 2+3?") == 5
+    assert create.calls == []
+    assert cache.stats()["memory_hits"] == 2
+
+lookups = []
+
+@memoize(ttl=60, max_entries=2)
+def lookup(key: int) -> str:
+    """
+    Look up a key.
+
+    key: The key to look up
+    """
+    lookups.append(key)
+    return f"value {key}"
+
+@memoize()
+@execution_policy("thread")
+def flaky(key: int) -> str:
+    """
+    Fail on every call.
+
+    key: The key to look up
+    """
+    raise RuntimeError("unavailable")
+
+class RecordingExporter:
+    def __init__(self):
+        self.records = []
+
+    def export(self, record):
+        self.records.append(record)
+
+    def close(self):
+        pass
+
+def test_memoized_tool_keys_on_cast_arguments():
+    lookups.clear()
+    tool_memo_cache(lookup).clear()
+    fns = {"lookup": lookup}
+    assert run_tool_calls(fns, [("lookup", {"key": 1})]) == ["value 1"]
+    assert run_tool_calls(fns, [("lookup", {"key": "1"})]) == ["value 1"]
+    assert run_tool_calls(fns, [("lookup", {"key": 2}), ("lookup", {"key": 3})]) == ["value 2", "value 3"]
+    # Only two entries fit, so the first lookup was evicted
+    assert run_tool_calls(fns, [("lookup", {"key": 1})]) == ["value 1"]
+    assert lookups == [1, 2, 3, 1]
+    assert tool_memo_cache(lookup).stats()["memory_hits"] == 1
+
+def test_memoized_tool_async():
+    lookups.clear()
+    tool_memo_cache(lookup).clear()
+    calls = [("lookup", {"key": 5})]
+    asyncio.run(run_tool_calls_async({"lookup": lookup}, calls))
+    assert asyncio.run(run_tool_calls_async({"lookup": lookup}, calls)) == ["value 5"]
+    assert lookups == [5]
+
+def test_policy_errors_are_not_memoized():
+    fns = {"flaky": flaky}
+    run_tool_calls(fns, [("flaky", {"key": 1})])
+    run_tool_calls(fns, [("flaky", {"key": 1})])
+    assert tool_memo_cache(flaky).stats()["memory_hits"] == 0
+
+def test_cache_hits_are_traced():
+    tool_memo_cache(lookup).clear()
+    exporter = RecordingExporter()
+    chat = Chat(model="claude-3-5-sonnet-20240620", tools=[lookup], api_key="test", tracer=Tracer([exporter]))
+    chat.client.client = fake_anthropic(FakeCreate([
+        claude_tool_use(("lookup", {"key": 7})),
+        claude_tool_use(("lookup", {"key": 7})),
+        claude_text("Done"),
+    ]))
+    chat("Look up 7 twice")
+    hits = [r["args"]["hit"] for r in exporter.records if r["name"] == "tool_cache"]
+    assert hits == [False, True]
@@ -0,0 +1,135 @@
+import asyncio
+import gc
+import threading
+import time
+import pytest
+from toolla.chat import Chat, AsyncChat
+from toolla.endpoints import Endpoint, EndpointPool, endpoint_pools
+from toolla.mock_server import MockServer, text_reply, tool_reply
+from .tools import add
+
+ADD_SCRIPT = [tool_reply(("add", {"x": 1, "y": 2})), text_reply("The answer is 3")]
+
+@pytest.fixture(autouse=True)
+def fresh_pools():
+    # Mock server ports can be reused from one test to the next
+    endpoint_pools.clear()
+    yield
+    endpoint_pools.clear()
+
+def pooled_chat(*servers, chat_cls=Chat, **kwargs):
+    return chat_cls(
+        model="llama3.1",
+        tools=[add],
+        api_key="mock",
+        base_url=[server.url + "/v1" for server in servers],
+        **kwargs,
+    )
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def test_requests_are_spread_over_endpoints():
+    with MockServer(script=ADD_SCRIPT) as a, MockServer(script=ADD_SCRIPT) as b:
+        chat = pooled_chat(a, b)
+        for _ in range(3):
+            assert chat("What is 1 + 2?") == 3
+            chat.clear_messages()
+        assert a.stats()["requests"] == b.stats()["requests"] == 3
+
+def test_latency_strategy_prefers_the_fast_endpoint():
+    with MockServer(script=ADD_SCRIPT, latency=0.2) as slow, MockServer(script=ADD_SCRIPT) as fast:
+        chat = pooled_chat(slow, fast, load_balancing="latency")
+        for _ in range(4):
+            assert chat("What is 1 + 2?") == 3
+            chat.clear_messages()
+        assert slow.stats()["requests"] == 1
+        assert fast.stats()["requests"] == 7
+
+def test_failing_endpoint_is_failed_over_ejected_and_restored():
+    with MockServer(error_rate=1.0, error_status=500) as broken, MockServer(script=ADD_SCRIPT) as healthy:
+        chat = pooled_chat(broken, healthy)
+        chat.client.endpoints.probe_interval = 0.02
+        for _ in range(4):
+            assert chat("What is 1 + 2?") == 3
+            chat.clear_messages()
+        ejected = chat.client.endpoints.endpoints[0]
+        assert not ejected.healthy
+        assert ejected.failures == 3
+        # Failing probes keep it out
+        assert wait_until(lambda: broken.stats()["requests"] > 5)
+        assert not ejected.healthy
+        broken.error_rate = 0
+        assert wait_until(lambda: ejected.healthy)
+        chat.client.endpoints.close()
+
+def test_chats_share_a_pool():
+    with MockServer(error_rate=1.0, error_status=500) as broken, MockServer(script=ADD_SCRIPT) as healthy:
+        # A chat per request, as in a web service
+        for _ in range(6):
+            assert pooled_chat(broken, healthy)("What is 1 + 2?") == 3
+        chat = pooled_chat(broken, healthy)
+        assert chat.client.endpoints is pooled_chat(broken, healthy).client.endpoints
+        assert not chat.client.endpoints.endpoints[0].healthy
+        assert pooled_chat(broken, healthy, load_balancing="latency").client.endpoints is not chat.client.endpoints
+
+def test_dropped_pool_stops_probing():
+    pool = EndpointPool([Endpoint("a"), Endpoint("b")], eject_after=1, probe=lambda e: False, probe_interval=0.01)
+    def fail(endpoint):
+        raise ConnectionError(endpoint.base_url)
+    with pytest.raises(ConnectionError):
+        pool.call(fail, lambda e: True)
+    probes = [t for t in threading.enumerate() if t.name == "toolla-probe"]
+    assert probes
+    del pool
+    gc.collect()
+    for thread in probes:
+        thread.join(timeout=1)
+    assert not any(t.is_alive() for t in probes)
+
+def test_client_errors_are_not_failed_over():
+    with MockServer(error_rate=1.0, error_status=400) as a, MockServer(error_rate=1.0, error_status=400) as b:
+        chat = pooled_chat(a, b)
+        with pytest.raises(Exception):
+            chat("What is 1 + 2?")
+        assert a.stats()["requests"] + b.stats()["requests"] == 1
+        assert all(e.healthy for e in chat.client.endpoints.endpoints)
+
+def test_async_failover():
+    async def main():
+        with MockServer(error_rate=1.0, error_status=503) as broken, MockServer(script=ADD_SCRIPT) as healthy:
+            chat = pooled_chat(broken, healthy, chat_cls=AsyncChat)
+            results = []
+            for _ in range(2):
+                results.append(await chat("What is 1 + 2?"))
+                chat.clear_messages()
+            return results, healthy.stats()["requests"]
+    results, requests = asyncio.run(main())
+    assert results == [3, 3]
+    assert requests == 4
+
+def test_pool_goes_to_ejected_endpoints_when_all_are_ejected():
+    pool = EndpointPool([Endpoint("a"), Endpoint("b")], eject_after=1)
+    def fail(endpoint):
+        raise ConnectionError(endpoint.base_url)
+    with pytest.raises(ConnectionError):
+        pool.call(fail, lambda e: True)
+    assert not any(e.healthy for e in pool.endpoints)
+    assert pool.call(lambda endpoint: endpoint.base_url, lambda e: True) in ("a", "b")
+    assert [e.outstanding for e in pool.endpoints] == [0, 0]
+
+def test_least_outstanding_skips_busy_endpoints():
+    pool = EndpointPool([Endpoint("a"), Endpoint("b"), Endpoint("c")])
+    busy = [pool.acquire(), pool.acquire()]
+    assert pool.acquire().base_url not in [e.base_url for e in busy]
+
+def test_load_balancing_validation():
+    with pytest.raises(ValueError):
+        EndpointPool([Endpoint("a")], strategy="random")
+    with pytest.raises(ValueError):
+        Chat(model="llama3.1", base_url=["http://a", "http://b"], ollama_guided=True)
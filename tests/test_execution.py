@@ -0,0 +1,149 @@
+import asyncio
+import os
+import time
+import pytest
+from toolla.chat import Chat
+from toolla.execution import execution_policy, tool_execution_policy
+from toolla.utils import run_tool_calls, run_tool_calls_async
+from .fakes import FakeCreate, claude_text, claude_tool_use, fake_anthropic
+
+@execution_policy("process")
+def worker_pid() -> int:
+    """
+    Process id of the worker running the tool.
+    """
+    return os.getpid()
+
+@execution_policy("process", timeout=1)
+def hang_in_process(seconds: float) -> str:
+    """
+    Sleep in a worker process.
+
+    seconds: How long to sleep
+    """
+    time.sleep(seconds)
+    return "woke up"
+
+@execution_policy("process")
+def crash_process() -> str:
+    """
+    Kill the worker process.
+    """
+    os._exit(1)
+
+@execution_policy("thread", timeout=0.1)
+def hang_in_thread(seconds: float) -> str:
+    """
+    Sleep in a thread.
+
+    seconds: How long to sleep
+    """
+    time.sleep(seconds)
+    return "woke up"
+
+@execution_policy("inline")
+def divide(x: int, y: int) -> float:
+    """
+    Divide two numbers.
+
+    x: The dividend
+    y: The divisor
+    """
+    return x / y
+
+@execution_policy("inline")
+def nap(seconds: float) -> str:
+    """
+    Block the calling thread.
+
+    seconds: How long to sleep
+    """
+    time.sleep(seconds)
+    return "rested"
+
+def test_process_tool_runs_in_another_process():
+    assert run_tool_calls({"worker_pid": worker_pid}, [("worker_pid", {})]) != [os.getpid()]
+
+def test_thread_tool_times_out():
+    start = time.perf_counter()
+    result = run_tool_calls({"hang_in_thread": hang_in_thread}, [("hang_in_thread", {"seconds": 1})])
+    assert time.perf_counter() - start < 0.5
+    assert result == ["Error: tool hang_in_thread timed out after 0.1 seconds."]
+
+@execution_policy("process")
+def slow_pid(seconds: float) -> int:
+    """
+    Process id of the worker, after a while.
+
+    seconds: How long to sleep
+    """
+    time.sleep(seconds)
+    return os.getpid()
+
+def test_hung_process_is_killed():
+    fns = {"hang_in_process": hang_in_process, "worker_pid": worker_pid}
+    start = time.perf_counter()
+    result = run_tool_calls(fns, [("hang_in_process", {"seconds": 60})])
+    assert time.perf_counter() - start < 30
+    assert result == ["Error: tool hang_in_process timed out after 1 seconds."]
+    assert isinstance(run_tool_calls(fns, [("worker_pid", {})])[0], int)
+
+def test_timeout_leaves_other_process_tools_alone():
+    fns = {"hang_in_process": hang_in_process, "slow_pid": slow_pid}
+    # Warm up the shared pool so the slow call is running when the other times out
+    run_tool_calls(fns, [("slow_pid", {"seconds": 0})])
+    results = run_tool_calls(fns, [("slow_pid", {"seconds": 2}), ("hang_in_process", {"seconds": 60})])
+    assert isinstance(results[0], int)
+    assert results[1] == "Error: tool hang_in_process timed out after 1 seconds."
+
+def test_process_tool_with_timeout_returns_and_raises():
+    fns = {"hang_in_process": hang_in_process}
+    assert run_tool_calls(fns, [("hang_in_process", {"seconds": 0})]) == ["woke up"]
+    result = run_tool_calls(fns, [("hang_in_process", {"seconds": "x"})])
+    assert result[0].startswith("Error: tool hang_in_process raised")
+
+def test_crashed_process_is_an_error_string():
+    fns = {"crash_process": crash_process, "worker_pid": worker_pid}
+    assert run_tool_calls(fns, [("crash_process", {})]) == ["Error: tool crash_process crashed its process."]
+    assert isinstance(run_tool_calls(fns, [("worker_pid", {})])[0], int)
+
+def test_async_timeout():
+    calls = [("hang_in_thread", {"seconds": 1}), ("divide", {"x": 1, "y": 4})]
+    results = asyncio.run(run_tool_calls_async({"hang_in_thread": hang_in_thread, "divide": divide}, calls))
+    assert results == ["Error: tool hang_in_thread timed out after 0.1 seconds.", 0.25]
+
+def test_async_inline_tools_leave_the_loop_free():
+    calls = [("nap", {"seconds": 0.3})] * 5
+    start = time.perf_counter()
+    assert asyncio.run(run_tool_calls_async({"nap": nap}, calls)) == ["rested"] * 5
+    assert time.perf_counter() - start < 1.0
+
+    async def direct():
+        policy = tool_execution_policy(nap)
+        return await asyncio.gather(*(policy.call_async("nap", nap, {"seconds": 0.3}) for _ in range(5)))
+    start = time.perf_counter()
+    assert asyncio.run(direct()) == ["rested"] * 5
+    assert time.perf_counter() - start < 1.0
+
+def test_failing_tool_is_reported_to_the_model():
+    chat = Chat(model="claude-3-5-sonnet-20240620", tools=[divide], api_key="test")
+    create = FakeCreate([
+        claude_tool_use(("divide", {"x": 1, "y": 0})),
+        claude_text("Can't divide by zero"),
+    ])
+    chat.client.client = fake_anthropic(create)
+    chat("What is 1 / 0?")
+    assert create.calls[1]["messages"][-1]["content"][0]["text"] == (
+        "\nFunction divide was called and returned a value of "
+        "Error: tool divide raised ZeroDivisionError: division by zero"
+    )
+
+def test_policy_validation():
+    with pytest.raises(ValueError):
+        execution_policy("gpu")
+    with pytest.raises(ValueError):
+        execution_policy("inline", timeout=1)(lambda: None)
+    async def coroutine_tool():
+        pass
+    with pytest.raises(ValueError):
+        execution_policy("process")(coroutine_tool)
@@ -0,0 +1,99 @@
+import asyncio
+import time
+import anthropic
+import pytest
+from toolla.chat import Chat, AsyncChat
+from toolla.mock_server import MockServer, text_reply, tool_reply
+from .tools import add
+
+ADD_SCRIPT = [tool_reply(("add", {"x": 1, "y": 2})), text_reply("The answer is 3")]
+
+@pytest.fixture
+def slow():
+    with MockServer(script=ADD_SCRIPT, latency=1.0) as server:
+        yield server
+
+@pytest.fixture
+def fast():
+    with MockServer(script=ADD_SCRIPT) as server:
+        yield server
+
+def hedged_chat(primary, secondary, chat_cls=Chat, sdk_cls=anthropic.Anthropic, **kwargs):
+    chat = chat_cls(
+        model="claude-3-5-sonnet-20240620",
+        system="Be brief.",
+        tools=[add],
+        api_key="mock",
+        hedge_model="llama3.1",
+        hedge_base_url=secondary.url + "/v1",
+        **kwargs,
+    )
+    chat.client.primary.client = sdk_cls(base_url=primary.url, api_key="mock", max_retries=0)
+    return chat
+
+def test_secondary_answers_when_primary_is_slow(slow):
+    requests = []
+    def script(request):
+        requests.append(request.body["messages"])
+        return ADD_SCRIPT[min(request.turn, 1)]
+    with MockServer(script=script) as fast:
+        chat = hedged_chat(slow, fast, hedge_delay=0.05)
+        start = time.perf_counter()
+        assert chat("What is 1 + 2?") == 3
+    assert time.perf_counter() - start < 1.0
+    assert (chat.client.hedges, chat.client.hedge_wins) == (2, 2)
+    # One conversation, with the replies of the secondary (which records its
+    # tool call text) and without its system prompt
+    assert [m["role"] for m in chat.get_messages()] == ["user", "assistant", "user", "assistant"]
+    assert chat.get_messages()[-1]["content"] == "The answer is 3"
+    # which the secondary gets in its requests, with the history so far
+    assert [m["role"] for m in requests[1]] == ["system", "user", "assistant", "user"]
+    assert requests[1][0]["content"].startswith("Be brief.")
+
+def test_no_hedge_when_primary_is_fast(fast, slow):
+    chat = hedged_chat(fast, slow, hedge_delay=0.5)
+    assert chat("What is 1 + 2?") == 3
+    assert chat.client.hedges == 0
+    assert chat.get_usage()["input_tokens"] > 0
+
+def test_failed_primary_fails_over_at_once(fast):
+    with MockServer(error_rate=1.0, error_status=400) as broken:
+        chat = hedged_chat(broken, fast, hedge_delay=10)
+        start = time.perf_counter()
+        assert chat("What is 1 + 2?") == 3
+        assert time.perf_counter() - start < 5
+    assert chat.client.hedge_wins == 2
+
+def test_error_when_both_fail():
+    with MockServer(error_rate=1.0, error_status=400) as broken:
+        chat = hedged_chat(broken, broken, hedge_delay=0.01)
+        with pytest.raises(Exception):
+            chat("What is 1 + 2?")
+
+def test_clones_hedge_independently(slow, fast):
+    chat = hedged_chat(slow, fast, hedge_delay=0.05)
+    results = list(chat.batch(["What is 1 + 2?"] * 4, max_concurrency=4))
+    assert [r.value for r in results] == [3] * 4
+    assert all(len(r.messages) == 4 for r in results)
+    assert chat.get_messages() == []
+
+def test_concurrent_hedged_requests_dont_queue(fast):
+    with MockServer(script=ADD_SCRIPT, latency=0.2) as primary:
+        chat = hedged_chat(primary, fast, hedge_delay=0.3)
+        results = list(chat.batch(["What is 1 + 2?"] * 16, max_concurrency=16))
+    assert [r.value for r in results] == [3] * 16
+    assert fast.stats()["requests"] == 0
+
+def test_async_loser_is_cancelled(slow, fast):
+    async def main():
+        chat = hedged_chat(slow, fast, AsyncChat, anthropic.AsyncAnthropic, hedge_delay=0.05)
+        start = time.perf_counter()
+        result = await chat("What is 1 + 2?")
+        return result, time.perf_counter() - start, chat.client.hedge_wins
+    result, elapsed, wins = asyncio.run(main())
+    assert (result, wins) == (3, 2)
+    assert elapsed < 1.0
+
+def test_hedging_not_supported_for_ollama_guided():
+    with pytest.raises(ValueError):
+        Chat(model="llama3.1", base_url="http://localhost:11434", ollama_guided=True, hedge_model="llama3.2")
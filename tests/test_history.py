@@ -0,0 +1,142 @@
+import pytest
+from toolla.chat import Chat
+from toolla.history import MessageHistory, MessageLog, message_size
+from toolla.messages import Message
+from toolla.exceptions import MessageTooLongException
+from .fakes import FakeCreate, claude_text, fake_anthropic
+
+def user(text):
+    return {"role": "user", "content": text}
+
+def test_running_total_tracks_appends_and_evictions():
+    history = MessageHistory(max_chars=1000)
+    messages = [user("a" * 10), user("b" * 20), user("c" * 30)]
+    for message in messages:
+        history.append(message)
+    assert history.total_chars == sum(message_size(m) for m in messages)
+    history.popleft()
+    assert history.total_chars == sum(message_size(m) for m in messages[1:])
+    assert history.remaining_chars == 1000 - history.total_chars
+
+def test_enforce_budget_evicts_oldest_first():
+    first, second, third = user("a" * 50), user("b" * 50), user("c" * 50)
+    history = MessageHistory(max_chars=2 * message_size(first), messages=[first, second])
+    history.append(third)
+    history.enforce_budget()
+    assert history.to_list() == [Message.from_dict(second), Message.from_dict(third)]
+
+def test_enforce_budget_raises_when_single_message_too_long():
+    history = MessageHistory(max_chars=10)
+    history.append(user("x" * 100))
+    with pytest.raises(MessageTooLongException):
+        history.enforce_budget()
+
+def test_clear_keeps_roles():
+    system = {"role": "system", "content": "be terse"}
+    history = MessageHistory(max_chars=1000, messages=[system, user("hi")])
+    history.clear(keep_roles=("system",))
+    assert history.to_list() == [Message.from_dict(system)]
+    assert history.total_chars == message_size(system)
+
+def test_chat_truncates_with_history_budget():
+    chat = Chat(api_key="test")
+    chat.client.messages.max_chars = 200
+    chat.client.client = fake_anthropic(FakeCreate([claude_text("ok")] * 3))
+    for _ in range(3):
+        chat("x" * 60)
+    assert chat.client.messages.total_chars <= 200
+    assert chat.get_messages()[-1] == {"role": "assistant", "content": "ok"}
+
+def test_message_log_rolls_segments_and_reads_back(tmp_path):
+    log = MessageLog(tmp_path, segment_max_bytes=100)
+    messages = [user(str(i) * 20) for i in range(10)]
+    for message in messages:
+        log.append(message)
+    assert len(list(tmp_path.glob("segment-*.jsonl"))) > 1
+    assert list(log) == [Message.from_dict(m) for m in messages]
+    assert len(log) == 10
+    assert log[-1] == Message.from_dict(messages[-1])
+    log.close()
+    # Reopening continues the same log
+    reopened = MessageLog(tmp_path, segment_max_bytes=100)
+    reopened.append(user("more"))
+    assert len(reopened) == 11
+    assert reopened[0] == Message.from_dict(messages[0])
+
+def test_message_log_indexing_reads_one_segment(tmp_path):
+    from toolla.history import SerializedView
+    from toolla.messages import to_openai
+    log = MessageLog(tmp_path, segment_max_bytes=100)
+    messages = [user(str(i % 10) * 20) for i in range(50)]
+    for message in messages[:40]:
+        log.append(message)
+    assert len(log) == 40
+    # Counted segments aren't read again, and new ones are counted on append
+    segments = sorted(tmp_path.glob("segment-*.jsonl"))
+    segments[0].write_bytes(b"not json\n")
+    for message in messages[40:]:
+        log.append(message)
+    assert len(log) == 50
+    assert log[-1] == log[49] == Message.from_dict(messages[-1])
+    assert log[20] == Message.from_dict(messages[20])
+    assert SerializedView(log, to_openai)[-1] == to_openai(Message.from_dict(messages[-1]))
+    with pytest.raises(IndexError):
+        log[50]
+    with pytest.raises(IndexError):
+        log[-51]
+    log.close()
+
+def test_chat_message_log_keeps_evicted_messages(tmp_path):
+    chat = Chat(system="be terse", api_key="test", message_log=MessageLog(tmp_path))
+    chat.client.messages.max_chars = 200
+    chat.client.client = fake_anthropic(FakeCreate([claude_text("ok")] * 3))
+    for i in range(3):
+        chat(str(i) * 60)
+    assert chat.client.messages.total_chars <= 200
+    full = chat.get_messages()
+    assert len(full) == 6
+    assert full[0]["content"][0]["text"] == "0" * 60
+    chat.clear_messages()
+    assert len(chat.get_messages()) == 0
+
+def test_window_bounds_memory_but_not_the_log(tmp_path):
+    system = {"role": "system", "content": "be terse"}
+    history = MessageHistory(max_chars=10_000, messages=[system], log=MessageLog(tmp_path), window_messages=3)
+    for i in range(10):
+        history.append(user(str(i)))
+    assert [m.content for m in history] == ["be terse", "8", "9"]
+    assert history.total_chars == sum(message_size(m) for m in history)
+    assert len(history.log) == 11
+
+def test_window_opens_with_a_user_message():
+    history = MessageHistory(max_chars=10_000, window_messages=2)
+    for role in ("user", "assistant", "user"):
+        history.append({"role": role, "content": role})
+    assert [m.role for m in history] == ["user"]
+
+def test_window_chars_keeps_the_newest_message():
+    history = MessageHistory(max_chars=10_000, window_chars=50)
+    history.append(user("a" * 30))
+    history.append(user("b" * 100))
+    assert [m.content for m in history] == ["b" * 100]
+
+def test_reopened_log_restores_the_window(tmp_path):
+    system = {"role": "system", "content": "be terse"}
+    history = MessageHistory(max_chars=10_000, messages=[system], log=MessageLog(tmp_path))
+    for i in range(5):
+        history.append(user(str(i)))
+    history.close()
+    reopened = MessageHistory(max_chars=10_000, messages=[system], log=MessageLog(tmp_path), window_messages=3)
+    assert [m.content for m in reopened] == ["be terse", "3", "4"]
+    assert [m.role for m in reopened.log].count("system") == 1
+
+def test_chat_message_window_and_close(tmp_path):
+    with Chat(api_key="test", message_log=MessageLog(tmp_path), message_window_messages=2) as chat:
+        chat.client.client = fake_anthropic(FakeCreate([claude_text("ok")] * 3))
+        for i in range(3):
+            chat(str(i))
+        assert [m.role for m in chat.client.messages] == ["user", "assistant"]
+        assert len(chat.get_messages()) == 6
+        log = chat.client.messages.log
+        assert log._file is not None
+    assert log._file is None
@@ -0,0 +1,21 @@
+import subprocess
+import sys
+
+def loaded_after_import(module: str):
+    probe = (
+        f"import sys, {module}; "
+        "print(','.join(m for m in ('anthropic', 'openai', 'requests', 'httpx') if m in sys.modules))"
+    )
+    out = subprocess.run([sys.executable, "-c", probe], check=True, capture_output=True, text=True)
+    return [m for m in out.stdout.strip().split(",") if m]
+
+def test_import_chat_loads_no_provider_sdk():
+    assert loaded_after_import("toolla.chat") == []
+
+def test_provider_sdk_loads_when_backend_is_used():
+    probe = (
+        "import sys; from toolla.chat import Chat; Chat(api_key='test'); "
+        "print('anthropic' in sys.modules, 'openai' in sys.modules)"
+    )
+    out = subprocess.run([sys.executable, "-c", probe], check=True, capture_output=True, text=True)
+    assert out.stdout.split() == ["True", "False"]
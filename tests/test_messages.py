@@ -0,0 +1,39 @@
+import json
+from toolla.messages import (
+    Message,
+    TextPart,
+    ImagePart,
+    to_anthropic,
+    to_openai,
+)
+
+def test_anthropic_dict_converts_to_openai():
+    anthropic_message = {
+        "role": "user",
+        "content": [
+            {"type": "text", "text": "What is this?"},
+            {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": "aGk="}},
+        ],
+    }
+    message = Message.from_dict(anthropic_message)
+    assert message.content == (TextPart("What is this?"), ImagePart("image/png", "aGk="))
+    assert to_anthropic(message) == anthropic_message
+    assert to_openai(message) == {
+        "role": "user",
+        "content": [
+            {"type": "text", "text": "What is this?"},
+            {"type": "image_url", "image_url": {"url": "data:image/png;base64,aGk="}},
+        ],
+    }
+    assert Message.from_dict(to_openai(message)) == message
+
+def test_roles_are_shared_and_messages_have_no_dict():
+    decoded = json.loads('{"role": "assistant", "content": "hi"}')
+    a = Message.from_dict(decoded)
+    b = Message("assistant", "there")
+    assert a.role is b.role
+    assert not hasattr(a, "__dict__")
+
+def test_to_dict_round_trips():
+    message = Message("user", [TextPart("look"), ImagePart("image/jpeg", "AAAA")])
+    assert Message.from_dict(json.loads(json.dumps(message.to_dict()))) == message
@@ -0,0 +1,106 @@
+import asyncio
+import anthropic
+import openai
+import pytest
+from toolla.chat import Chat, AsyncChat
+from toolla.rate_limit import RateLimiter
+from toolla.mock_server import (
+    MockServer,
+    text_reply,
+    tool_reply,
+    lognormal_latency,
+)
+from .tools import add
+
+ADD_SCRIPT = [tool_reply(("add", {"x": 1, "y": 2})), text_reply("The answer is 3")]
+
+@pytest.fixture
+def server():
+    with MockServer(script=ADD_SCRIPT) as server:
+        yield server
+
+def anthropic_chat(server, **kwargs):
+    chat = Chat(model="claude-3-5-sonnet-20240620", tools=[add], api_key="mock", **kwargs)
+    chat.client.client = anthropic.Anthropic(base_url=server.url, api_key="mock", max_retries=0)
+    return chat
+
+def test_anthropic_protocol_runs_tool_calls(server):
+    chat = anthropic_chat(server)
+    assert chat("What is 1 + 2?") == 3
+    assert chat.get_messages()[-1]["content"] == "The answer is 3"
+    assert server.stats() == {"requests": 2, "errors": 0}
+    assert chat.get_usage()["input_tokens"] > 0
+
+def test_anthropic_protocol_streams(server):
+    chat = anthropic_chat(server, stream=True)
+    assert chat("What is 1 + 2?") == 3
+
+def test_openai_protocol_runs_tool_calls(server):
+    chat = Chat(model="gpt-4o", tools=[add], api_key="mock")
+    chat.client.client = openai.OpenAI(base_url=server.url + "/v1", api_key="mock", max_retries=0)
+    assert chat("What is 1 + 2?") == 3
+
+def test_openai_protocol_streams(server):
+    chat = Chat(model="gpt-4o", tools=[add], api_key="mock", stream=True)
+    chat.client.client = openai.OpenAI(base_url=server.url + "/v1", api_key="mock", max_retries=0)
+    assert chat("What is 1 + 2?") == 3
+
+def test_openai_compatible_gets_tool_calls_as_text(server):
+    chat = Chat(model="llama3.1", tools=[add], api_key="mock", base_url=server.url + "/v1")
+    assert chat("What is 1 + 2?") == 3
+
+@pytest.mark.parametrize("tool_mode", ["native", "format", "generate"])
+def test_ollama_protocols(server, tool_mode):
+    chat = Chat(
+        model="llama3.1",
+        tools=[add],
+        base_url=server.url,
+        ollama_guided=True,
+        ollama_tool_mode=tool_mode,
+    )
+    assert chat("What is 1 + 2?") == 3
+
+def test_async_chat_against_server(server):
+    async def main():
+        chat = AsyncChat(model="claude-3-5-sonnet-20240620", tools=[add], api_key="mock")
+        chat.client.client = anthropic.AsyncAnthropic(base_url=server.url, api_key="mock", max_retries=0)
+        return await asyncio.gather(*(chat.clone()("What is 1 + 2?") for _ in range(4)))
+    assert asyncio.run(main()) == [3] * 4
+
+def test_injected_errors_are_retried():
+    with MockServer(script=ADD_SCRIPT, error_rate=0.5, retry_after=0, seed=3) as server:
+        chat = anthropic_chat(server, rate_limiter=RateLimiter(max_retries=20))
+        assert chat("What is 1 + 2?") == 3
+        stats = server.stats()
+    assert stats["errors"] > 0
+    assert stats["requests"] == stats["errors"] + 2
+
+def test_injected_errors_use_the_protocol_error_format():
+    with MockServer(error_rate=1.0, error_status=529) as server:
+        client = anthropic.Anthropic(base_url=server.url, api_key="mock", max_retries=0)
+        with pytest.raises(anthropic.APIStatusError) as excinfo:
+            client.messages.create(
+                model="claude-3-5-sonnet-20240620",
+                max_tokens=10,
+                messages=[{"role": "user", "content": "hi"}],
+            )
+    assert excinfo.value.status_code == 529
+    assert excinfo.value.body["error"]["type"] == "rate_limit_error"
+
+def test_script_callable_sees_request():
+    seen = []
+    def script(request):
+        seen.append((request.protocol, request.turn, request.body["model"]))
+        return text_reply("hello")
+    with MockServer(script=script) as server:
+        chat = Chat(model="gpt-4o", api_key="mock")
+        chat.client.client = openai.OpenAI(base_url=server.url + "/v1", api_key="mock")
+        assert chat("hi") is None
+        assert chat.get_messages()[-1]["content"] == "hello"
+    assert seen == [("openai", 0, "gpt-4o")]
+
+def test_lognormal_latency_is_seeded_and_positive():
+    a, b = lognormal_latency(0.05, seed=1), lognormal_latency(0.05, seed=1)
+    samples = [a() for _ in range(100)]
+    assert samples == [b() for _ in range(100)]
+    assert all(s > 0 for s in samples)
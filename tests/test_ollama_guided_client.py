@@ -0,0 +1,56 @@
+from toolla.chat import Chat
+from .tools import add, multiply
+from .fakes import FakeSession, ollama_message
+
+BASE_URL = "http://localhost:11434"
+
+def ollama_chat(session, **kwargs):
+    chat = Chat(model="llama3.1", base_url=BASE_URL, ollama_guided=True, **kwargs)
+    chat.client.session = session
+    return chat
+
+def test_native_tool_calls_need_one_request_per_step():
+    session = FakeSession([
+        ollama_message(tool_calls=[("multiply", {"x": 4911, "y": 4})]),
+        ollama_message(tool_calls=[("add", {"x": 19644, "y": 18})]),
+        ollama_message("The answer is 19662."),
+    ])
+    chat = ollama_chat(session, tools=[add, multiply])
+    assert chat("What is (4*4911)+18?") == 19662
+    assert [url for url, _ in session.posts] == [BASE_URL + "/api/chat"] * 3
+    assert session.posts[0][1]["tools"][0]["function"]["name"] == "add"
+
+def test_tool_call_in_text_is_parsed_locally():
+    session = FakeSession([
+        ollama_message('```json\n{"tool": "add", "inputs": {"x": "341", "y": 18}}\n```'),
+        ollama_message("The answer is 359."),
+    ])
+    chat = ollama_chat(session, tools=[add])
+    assert chat("What is 341+18?") == 359
+    assert all(url.endswith("/api/chat") for url, _ in session.posts)
+
+def test_generate_is_last_resort():
+    session = FakeSession([
+        ollama_message("Call add with {x: 341, y: 18}"),
+        {"response": '{"tool": "add", "inputs": {"x": 341, "y": 18}}'},
+        ollama_message("The answer is 359."),
+    ])
+    chat = ollama_chat(session, tools=[add])
+    assert chat("What is 341+18?") == 359
+    assert [url for url, _ in session.posts] == [
+        BASE_URL + "/api/chat",
+        BASE_URL + "/api/generate",
+        BASE_URL + "/api/chat",
+    ]
+
+def test_format_mode_sends_tool_call_schema():
+    session = FakeSession([
+        ollama_message('{"tool": "add", "inputs": {"x": 1, "y": 2}}'),
+        ollama_message('{"tool": "", "inputs": {}}'),
+    ])
+    chat = ollama_chat(session, tools=[add], ollama_tool_mode="format")
+    assert chat("What is 1+2?") == 3
+    payload = session.posts[0][1]
+    assert "tools" not in payload
+    assert payload["format"]["properties"]["tool"]["enum"] == ["add", ""]
+    assert len(session.posts) == 2
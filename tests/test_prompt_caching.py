@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+from toolla.chat import Chat
+from toolla.registry import tool_registry
+from .tools import add, multiply
+from .fakes import FakeCreate, claude_text, claude_tool_use, claude_stream, fake_anthropic
+
+def usage(input_tokens, output_tokens, created=0, read=0):
+    return SimpleNamespace(
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        cache_creation_input_tokens=created,
+        cache_read_input_tokens=read,
+    )
+
+def test_breakpoints_on_tools_system_and_history():
+    chat = Chat(system="be terse", tools=[add, multiply], api_key="test")
+    create = FakeCreate([claude_tool_use(("add", {"x": 1, "y": 2})), claude_text("3")])
+    chat.client.client = fake_anthropic(create)
+    chat("What is 1+2?")
+    for kwargs in create.calls:
+        assert "cache_control" not in kwargs["tools"][0]
+        assert kwargs["tools"][-1]["cache_control"] == {"type": "ephemeral"}
+        assert kwargs["system"] == [
+            {"type": "text", "text": "be terse", "cache_control": {"type": "ephemeral"}}
+        ]
+        assert kwargs["messages"][-1]["content"][-1]["cache_control"] == {"type": "ephemeral"}
+        assert all(
+            "cache_control" not in block
+            for message in kwargs["messages"][:-1]
+            for block in message["content"]
+            if isinstance(block, dict)
+        )
+    # Shared registry schemas and the stored history are left untouched
+    assert "cache_control" not in tool_registry.schema(multiply, "claude")
+    assert chat.get_messages()[0] == {"role": "user", "content": [{"type": "text", "text": "What is 1+2?"}]}
+
+def test_prompt_caching_can_be_disabled():
+    chat = Chat(system="be terse", tools=[add], api_key="test", prompt_caching=False)
+    create = FakeCreate([claude_text("hi")])
+    chat.client.client = fake_anthropic(create)
+    chat("Hello")
+    assert create.calls[0]["system"] == "be terse"
+    assert "cache_control" not in create.calls[0]["tools"][0]
+
+def test_usage_includes_cache_reads_and_writes():
+    chat = Chat(tools=[add], api_key="test")
+    first = claude_tool_use(("add", {"x": 1, "y": 2}))
+    first.usage = usage(10, 5, created=2000)
+    second = claude_text("3")
+    second.usage = usage(12, 3, read=2000)
+    chat.client.client = fake_anthropic(FakeCreate([first, second]))
+    chat("What is 1+2?")
+    assert chat.get_usage() == {
+        "input_tokens": 22,
+        "output_tokens": 8,
+        "cache_creation_input_tokens": 2000,
+        "cache_read_input_tokens": 2000,
+    }
+
+def test_streamed_usage_is_recorded():
+    chat = Chat(api_key="test", stream=True)
+    events = claude_stream(text="hi")
+    events.insert(0, SimpleNamespace(type="message_start", message=SimpleNamespace(usage=usage(10, 1, read=500))))
+    events[-2].usage = SimpleNamespace(output_tokens=7)
+    chat.client.client = fake_anthropic(FakeCreate([events]))
+    chat("Hello")
+    assert chat.get_usage()["cache_read_input_tokens"] == 500
+    assert chat.get_usage()["output_tokens"] == 7
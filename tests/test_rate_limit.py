@@ -0,0 +1,237 @@
+import asyncio
+import time
+import threading
+from types import SimpleNamespace
+import pytest
+from toolla.rate_limit import (
+    RateLimiter,
+    parse_rate_limit_headers,
+    parse_reset,
+    rate_limiters,
+)
+
+class FakeRateLimitError(Exception):
+    def __init__(self, headers=None, status_code=429):
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+class FakeRawResponse:
+    def __init__(self, parsed, headers):
+        self.parsed = parsed
+        self.headers = headers
+        self.http_response = None
+
+    def parse(self):
+        return self.parsed
+
+def test_parse_reset_formats():
+    assert parse_reset("6m0s") == 360
+    assert parse_reset("1s") == 1
+    assert parse_reset("20ms") == pytest.approx(0.02)
+    assert parse_reset("2000-01-01T00:00:00Z") == 0
+
+def test_parse_anthropic_and_openai_headers():
+    anthropic = parse_rate_limit_headers({
+        "anthropic-ratelimit-requests-limit": "50",
+        "anthropic-ratelimit-requests-remaining": "49",
+        "anthropic-ratelimit-tokens-limit": "40000",
+    })
+    assert anthropic == {"requests_limit": 50, "requests_remaining": 49, "tokens_limit": 40000}
+    openai = parse_rate_limit_headers({
+        "x-ratelimit-limit-requests": "500",
+        "x-ratelimit-remaining-tokens": "1000",
+        "x-ratelimit-reset-requests": "1s",
+    })
+    assert openai == {"requests_limit": 500, "tokens_remaining": 1000, "requests_reset": 1}
+
+def test_requests_per_minute_enforced():
+    limiter = RateLimiter(requests_per_minute=2)
+    assert limiter.try_acquire() == 0
+    assert limiter.try_acquire() == 0
+    assert limiter.try_acquire() > 0
+
+def test_tokens_per_minute_enforced():
+    limiter = RateLimiter(tokens_per_minute=1000)
+    assert limiter.try_acquire(tokens=800) == 0
+    assert limiter.try_acquire(tokens=800) > 0
+
+def test_learns_limits_from_headers():
+    limiter = RateLimiter()
+    raw = FakeRawResponse("ok", {"x-ratelimit-limit-requests": "60", "x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "5s"})
+    assert limiter.call(lambda **kwargs: raw, {}) == "ok"
+    assert limiter.requests_per_minute == 60
+    assert limiter.try_acquire() > 4
+
+def test_throttled_request_is_retried_after_retry_after():
+    limiter = RateLimiter(max_concurrency=8)
+    attempts = []
+
+    def create(**kwargs):
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise FakeRateLimitError({"retry-after-ms": "100"})
+        return "ok"
+
+    assert limiter.call(create, {}) == "ok"
+    assert attempts[1] - attempts[0] >= 0.09
+    assert limiter.throttled == 1
+    # Halved on the 429, then grown back a little by the success
+    assert 4 <= limiter.concurrency_limit < 5
+
+def test_gives_up_after_max_retries():
+    limiter = RateLimiter(max_retries=1, backoff_base=0.01)
+
+    def create(**kwargs):
+        raise FakeRateLimitError()
+
+    with pytest.raises(FakeRateLimitError):
+        limiter.call(create, {})
+    assert limiter.throttled == 2
+    assert limiter.in_flight == 0
+
+def test_other_errors_are_not_retried():
+    limiter = RateLimiter()
+    calls = []
+
+    def create(**kwargs):
+        calls.append(1)
+        raise FakeRateLimitError(status_code=400)
+
+    with pytest.raises(FakeRateLimitError):
+        limiter.call(create, {})
+    assert len(calls) == 1
+
+def test_transient_errors_are_retried_without_pausing_others():
+    limiter = RateLimiter(backoff_base=0.01)
+    calls = []
+
+    def create(**kwargs):
+        calls.append(1)
+        if len(calls) < 3:
+            raise FakeRateLimitError(status_code=503)
+        return "ok"
+
+    assert limiter.call(create, {}) == "ok"
+    assert len(calls) == 3
+    assert limiter.throttled == 0
+    assert limiter.blocked_until == 0
+    assert limiter.in_flight == 0
+
+def test_transient_retries_can_be_left_to_the_caller():
+    limiter = RateLimiter(backoff_base=0.01)
+    calls = []
+
+    def create(**kwargs):
+        calls.append(1)
+        raise FakeRateLimitError({"x-should-retry": "true"}, status_code=400)
+
+    with pytest.raises(FakeRateLimitError):
+        limiter.call(create, {}, retry_transient=False)
+    assert len(calls) == 1
+    with pytest.raises(FakeRateLimitError):
+        limiter.call(create, {})
+    assert len(calls) == 4
+
+def test_cancelled_request_gives_back_its_slot():
+    limiter = RateLimiter(max_concurrency=2)
+
+    async def hang(**kwargs):
+        await asyncio.sleep(60)
+
+    async def main():
+        for _ in range(3):
+            task = asyncio.ensure_future(limiter.acall(hang, {}))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+        assert limiter.in_flight == 0
+        await asyncio.wait_for(limiter.acquire_async(), timeout=1)
+
+    asyncio.run(main())
+
+def test_failed_parse_gives_back_its_slot():
+    limiter = RateLimiter()
+
+    class BrokenRawResponse(FakeRawResponse):
+        def parse(self):
+            raise ValueError("bad body")
+
+    with pytest.raises(ValueError):
+        limiter.call(lambda **kwargs: BrokenRawResponse(None, {}), {})
+    assert limiter.in_flight == 0
+
+def test_concurrency_limit_bounds_in_flight_requests():
+    limiter = RateLimiter(max_concurrency=2)
+    peak = []
+
+    def create(**kwargs):
+        peak.append(limiter.in_flight)
+        time.sleep(0.05)
+        return "ok"
+
+    threads = [threading.Thread(target=limiter.call, args=(create, {})) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert max(peak) <= 2
+
+def test_concurrency_is_unbounded_until_throttled():
+    limiter = RateLimiter()
+
+    async def create(**kwargs):
+        await asyncio.sleep(0.2)
+        return "ok"
+
+    async def main():
+        start = time.perf_counter()
+        await asyncio.gather(*(limiter.acall(create, {}) for _ in range(500)))
+        return time.perf_counter() - start
+
+    assert asyncio.run(main()) < 1.0
+    assert limiter.concurrency_limit is None
+    for _ in range(8):
+        limiter.try_acquire()
+    limiter.release(throttled=True, headers={"retry-after": "0"})
+    # Halved from the concurrency that was throttled
+    assert limiter.concurrency_limit == 4
+
+def test_waiters_get_slots_in_arrival_order():
+    limiter = RateLimiter(max_concurrency=1)
+    order = []
+
+    async def create(i):
+        order.append(i)
+        await asyncio.sleep(0.01)
+
+    async def main():
+        tasks = []
+        for i in range(10):
+            tasks.append(asyncio.ensure_future(limiter.acall(create, {"i": i})))
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == list(range(10))
+    assert limiter.in_flight == 0
+
+def test_cancelled_waiter_passes_its_turn_on():
+    limiter = RateLimiter(max_concurrency=1)
+
+    async def main():
+        assert limiter.try_acquire() == 0
+        first = asyncio.ensure_future(limiter.acquire_async())
+        second = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0.01)
+        limiter.release()
+        # Woken, then cancelled before it takes the slot
+        first.cancel()
+        await asyncio.wait_for(second, timeout=1)
+
+    asyncio.run(main())
+    assert limiter.in_flight == 1
+
+def test_registry_shares_limiter_per_provider_and_model():
+    assert rate_limiters.get("anthropic", "m") is rate_limiters.get("anthropic", "m")
+    assert rate_limiters.get("anthropic", "m") is not rate_limiters.get("openai", "m")
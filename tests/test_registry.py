@@ -0,0 +1,50 @@
+from unittest import mock
+from toolla import registry
+from toolla.registry import ToolSchemaRegistry
+from toolla.utils import build_claude_tool_schema, build_openai_tool_schema
+from .tools import add, multiply
+
+def make_tool(description):
+    def tool(x: int) -> int:
+        return x
+    tool.__doc__ = f"""
+    {description}
+
+    x: The input
+    """
+    return tool
+
+def test_schemas_match_builders():
+    tools = ToolSchemaRegistry()
+    assert tools.schema(add, "claude") == build_claude_tool_schema(add)
+    assert tools.schema(add, "openai") == build_openai_tool_schema(add)
+
+def test_schema_compiled_once_per_provider():
+    tools = ToolSchemaRegistry()
+    with mock.patch.dict(
+        registry.schema_builders,
+        {"claude": mock.Mock(wraps=build_claude_tool_schema)},
+    ) as builders:
+        for _ in range(5):
+            tools.tool_set([add, multiply], "claude")
+        assert builders["claude"].call_count == 2
+
+def test_new_function_object_invalidates_entry():
+    tools = ToolSchemaRegistry()
+    first = make_tool("First version")
+    second = make_tool("Second version")
+    assert tools.schema(first, "openai")["function"]["description"] == "First version"
+    assert tools.schema(second, "openai")["function"]["description"] == "Second version"
+    assert len(tools) == 1
+
+def test_changed_docstring_invalidates_entry():
+    tools = ToolSchemaRegistry()
+    f = make_tool("Before")
+    tools.schema(f, "claude")
+    f.__doc__ = f.__doc__.replace("Before", "After")
+    assert tools.schema(f, "claude")["description"] == "After"
+
+def test_tool_set_maps_names_to_fns():
+    tool_set = ToolSchemaRegistry().tool_set([add, multiply], "claude")
+    assert [s["name"] for s in tool_set.schemas] == ["add", "multiply"]
+    assert tool_set.fns == {"add": add, "multiply": multiply}
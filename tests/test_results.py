@@ -0,0 +1,68 @@
+from toolla.chat import Chat
+from toolla.results import FETCH_TOOL_NAME, ResultStore, result_budget
+from .tools import add
+from .fakes import FakeCreate, claude_text, claude_tool_use, fake_anthropic
+
+@result_budget(100)
+def dump_table(name: str) -> str:
+    """
+    Dump every row of a table.
+
+    name: The table to dump
+    """
+    return "".join(f"row {i:05d}\n" for i in range(1000))
+
+def test_results_within_budget_are_unchanged():
+    store = ResultStore(max_chars=10)
+    assert store.render("add", 12345) == "12345"
+    assert len(store) == 0
+
+def test_oversized_result_gets_preview_and_handle():
+    store = ResultStore(max_chars=10)
+    text = store.render("dump", "x" * 50)
+    assert text.startswith("x" * 10 + "\n")
+    assert "'result-1'" in text and FETCH_TOOL_NAME in text
+    assert store.fetch("result-1", 45, 100) == "[Characters 45 to 50 of 50]\nxxxxx"
+
+def test_fetch_slices_are_bounded():
+    store = ResultStore(max_chars=10, max_slice_chars=20)
+    store.render("dump", "y" * 1000)
+    fetch = store.fetch_tool()
+    assert fetch(handle="result-1", offset=0, length=10_000).endswith("\n" + "y" * 20)
+    assert fetch(handle="missing", offset=0, length=10).startswith("Error")
+    # Slices are never stored again
+    assert store.render(FETCH_TOOL_NAME, "z" * 100) == "z" * 100
+
+def test_oldest_results_are_dropped_over_capacity():
+    store = ResultStore(max_chars=1, max_stored_chars=250)
+    for _ in range(3):
+        store.render("dump", "a" * 100)
+    assert len(store) == 2
+    assert store.fetch("result-1").startswith("Error")
+
+def test_no_store_without_budgets():
+    assert ResultStore.for_tools([add]) is None
+    assert ResultStore.for_tools([add, dump_table]).budgets == {"dump_table": 100}
+
+def test_chat_keeps_large_results_out_of_the_conversation():
+    chat = Chat(model="claude-3-5-sonnet-20240620", tools=[add, dump_table], api_key="test")
+    create = FakeCreate([
+        claude_tool_use(("dump_table", {"name": "users"}), ("add", {"x": 1, "y": 2})),
+        claude_tool_use((FETCH_TOOL_NAME, {"handle": "result-1", "offset": 500, "length": 20})),
+        claude_text("Done"),
+    ])
+    chat.client.client = fake_anthropic(create)
+    chat("Dump the users table")
+
+    assert [t["name"] for t in create.calls[0]["tools"]] == ["add", "dump_table", FETCH_TOOL_NAME]
+    results = create.calls[1]["messages"][-1]["content"][0]["text"]
+    assert len(results) < 500
+    assert "row 00000\n" in results and "handle 'result-1'" in results
+    assert "returned a value of 3" in results
+    fetched = create.calls[2]["messages"][-1]["content"][0]["text"]
+    assert "[Characters 500 to 520 of 10000]\nrow 00050\nrow 00051\n" in fetched
+
+def test_chat_wide_budget():
+    chat = Chat(model="claude-3-5-sonnet-20240620", tools=[add], api_key="test", max_result_chars=5)
+    assert chat.client.result_store.budget("add") == 5
+    assert FETCH_TOOL_NAME in chat.client.tool_fns
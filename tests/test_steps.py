@@ -0,0 +1,59 @@
+import inspect
+from toolla.chat import Chat
+from toolla.steps import StepHook
+from .tools import add
+from .fakes import FakeCreate, claude_text, claude_tool_use, fake_anthropic
+
+class RecordingHook(StepHook):
+    def __init__(self):
+        self.events = []
+
+    def on_step_start(self, client, step):
+        self.events.append(("start", step))
+
+    def on_step_end(self, client, step, calls, results):
+        self.events.append(("end", step, [name for name, _ in calls], results))
+
+def test_hooks_see_every_step():
+    hook = RecordingHook()
+    chat = Chat(tools=[add], api_key="test", hooks=[hook])
+    chat.client.client = fake_anthropic(FakeCreate([
+        claude_tool_use(("add", {"x": 1, "y": 2})),
+        claude_text("3"),
+    ]))
+    assert chat("What is 1+2?") == 3
+    assert hook.events == [
+        ("start", 0),
+        ("end", 0, ["add"], [3]),
+        ("start", 1),
+        ("end", 1, [], []),
+    ]
+
+def test_max_steps_counts_requests_not_history():
+    chat = Chat(tools=[add], api_key="test", max_steps=3)
+    create = FakeCreate([claude_tool_use(("add", {"x": i, "y": 1})) for i in range(10)])
+    chat.client.client = fake_anthropic(create)
+    # Long history from earlier calls must not reduce the step budget
+    for _ in range(20):
+        chat.client.messages.append({"role": "user", "content": "earlier"})
+    assert chat("Keep adding") == 3
+    assert len(create.calls) == 3
+
+def test_stack_depth_is_flat_across_steps():
+    depths = []
+
+    def depth(x: int) -> int:
+        """
+        Record the current stack depth.
+
+        x: Anything
+        """
+        depths.append(len(inspect.stack(0)))
+        return x
+
+    chat = Chat(tools=[depth], api_key="test", max_steps=50)
+    chat.client.client = fake_anthropic(FakeCreate(
+        [claude_tool_use(("depth", {"x": i})) for i in range(49)] + [claude_text("done")]
+    ))
+    assert chat("Go deep") == 48
+    assert len(set(depths)) == 1
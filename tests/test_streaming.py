@@ -0,0 +1,103 @@
+import asyncio
+import threading
+from toolla.chat import Chat, AsyncChat
+from toolla.streaming import AnthropicStreamAccumulator, OpenAIStreamAccumulator
+from .tools import add, multiply
+from .fakes import (
+    FakeCreate,
+    AsyncFakeCreate,
+    AsyncStream,
+    claude_stream,
+    openai_stream,
+    fake_anthropic,
+    fake_openai,
+)
+
+def test_anthropic_accumulator_reports_tool_at_block_stop():
+    accumulator = AnthropicStreamAccumulator()
+    events = claude_stream(("add", '{"x": 1, "y": 2}'), text="Adding")
+    completed = []
+    for i, event in enumerate(events):
+        for call in accumulator.feed(event):
+            completed.append((i, call))
+    stop_index = next(
+        i for i, e in enumerate(events) if e.type == "content_block_stop" and e.index == 1
+    )
+    assert completed == [(stop_index, ("add", {"x": 1, "y": 2}))]
+    assert accumulator.texts == ["Adding"]
+    assert accumulator.stop_reason == "tool_use"
+
+def test_openai_accumulator_reports_tool_when_next_starts():
+    accumulator = OpenAIStreamAccumulator()
+    chunks = openai_stream(("add", '{"x": 1, "y": 2}'), ("multiply", '{"x": 3, "y": 4}'))
+    completed = [accumulator.feed(chunk) for chunk in chunks]
+    # The first call is complete as soon as the second one starts
+    assert completed[3] == [("add", {"x": 1, "y": 2})]
+    assert completed[-1] == [("multiply", {"x": 3, "y": 4})]
+    assert accumulator.finish_reason == "tool_calls"
+
+def gated_stream(events, gate, after_index):
+    """Yield `events`, blocking after `after_index` until `gate` is set."""
+    for i, event in enumerate(events):
+        yield event
+        if i == after_index:
+            assert gate.wait(2), "tool was not started while streaming"
+
+def test_claude_stream_starts_tool_before_stream_ends():
+    started = threading.Event()
+
+    def lookup(key: str) -> str:
+        """
+        Look up a key.
+
+        key: The key to look up
+        """
+        started.set()
+        return key.upper()
+
+    chat = Chat(tools=[lookup], api_key="test", stream=True)
+    events = claude_stream(("lookup", '{"key": "a"}'), ("lookup", '{"key": "b"}'))
+    first_stop = next(i for i, e in enumerate(events) if e.type == "content_block_stop")
+    create = FakeCreate([
+        gated_stream(events, started, first_stop),
+        claude_stream(text="done"),
+    ])
+    chat.client.client = fake_anthropic(create)
+    assert chat("Look up a and b") == "B"
+    assert create.calls[0]["stream"] is True
+    follow_up = create.calls[1]["messages"][-1]["content"][0]["text"]
+    assert follow_up == (
+        "\nFunction lookup was called and returned a value of A"
+        "\nFunction lookup was called and returned a value of B"
+    )
+    assert chat.get_messages()[-1] == {"role": "assistant", "content": "done"}
+
+def test_gpt_stream_runs_tools():
+    chat = Chat(model="gpt-4o", tools=[add, multiply], api_key="test", stream=True)
+    create = FakeCreate([
+        openai_stream(("add", '{"x": 1, "y": 2}'), ("multiply", '{"x": 3, "y": 4}')),
+        openai_stream(text="done"),
+    ])
+    chat.client.client = fake_openai(create)
+    assert chat("Add and multiply") == 12
+    follow_up = create.calls[1]["messages"][-1]["content"][0]["text"]
+    assert "returned a value of 3" in follow_up
+    assert chat.get_messages()[-1] == {"role": "assistant", "content": "done"}
+
+def test_async_claude_stream_runs_tools():
+    chat = AsyncChat(tools=[add], api_key="test", stream=True)
+    create = AsyncFakeCreate([
+        AsyncStream(claude_stream(("add", '{"x": 2, "y": 5}'))),
+        AsyncStream(claude_stream(text="done")),
+    ])
+    chat.client.client = fake_anthropic(create)
+    assert asyncio.run(chat("Add 2 and 5")) == 7
+
+def test_async_gpt_stream_runs_tools():
+    chat = AsyncChat(model="gpt-4o", tools=[multiply], api_key="test", stream=True)
+    create = AsyncFakeCreate([
+        AsyncStream(openai_stream(("multiply", '{"x": 3, "y": 4}'))),
+        AsyncStream(openai_stream(text="done")),
+    ])
+    chat.client.client = fake_openai(create)
+    assert asyncio.run(chat("Multiply 3 and 4")) == 12
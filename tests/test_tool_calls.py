@@ -0,0 +1,104 @@
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from toolla.chat import Chat, AsyncChat
+from toolla.utils import run_tool_calls, tool_results_prompt
+from .tools import add, multiply
+from .fakes import (
+    FakeCreate,
+    AsyncFakeCreate,
+    claude_text,
+    claude_tool_use,
+    openai_text,
+    openai_tool_calls,
+    fake_anthropic,
+    fake_openai,
+)
+
+def slow_lookup(key: str) -> str:
+    """
+    Look up a key in a slow store.
+
+    key: The key to look up
+    """
+    time.sleep(0.2)
+    return key.upper()
+
+def test_run_tool_calls_preserves_order():
+    calls = [("add", {"x": 1, "y": 2}), ("multiply", {"x": 3, "y": 4})]
+    fns = {"add": add, "multiply": multiply}
+    assert run_tool_calls(fns, calls) == [3, 12]
+
+def test_tool_results_prompt_single_message():
+    calls = [("add", {}), ("multiply", {})]
+    prompt = tool_results_prompt(calls, [3, 12])
+    assert prompt == (
+        "\nFunction add was called and returned a value of 3"
+        "\nFunction multiply was called and returned a value of 12"
+    )
+
+def test_claude_runs_every_tool_use_block_concurrently():
+    chat = Chat(
+        tools=[slow_lookup],
+        api_key="test",
+        tool_executor=ThreadPoolExecutor(max_workers=4),
+    )
+    create = FakeCreate([
+        claude_tool_use(
+            ("slow_lookup", {"key": "a"}),
+            ("slow_lookup", {"key": "b"}),
+            ("slow_lookup", {"key": "c"}),
+            ("slow_lookup", {"key": "d"}),
+        ),
+        claude_text("done"),
+    ])
+    chat.client.client = fake_anthropic(create)
+    start = time.monotonic()
+    r = chat("Look up a, b, c and d")
+    assert time.monotonic() - start < 0.6
+    assert r == "D"
+    follow_up = create.calls[1]["messages"][-1]["content"][0]["text"]
+    for key in "ABCD":
+        assert f"returned a value of {key}" in follow_up
+
+def test_openai_runs_every_tool_call():
+    chat = Chat(model="gpt-4o", tools=[add, multiply], api_key="test")
+    create = FakeCreate([
+        openai_tool_calls(
+            ("add", '{"x": 2, "y": 3}'),
+            ("multiply", '{"x": 4, "y": 5}'),
+        ),
+        openai_text("done"),
+    ])
+    chat.client.client = fake_openai(create)
+    assert chat("What is 2+3 and 4*5?") == 20
+    follow_up = create.calls[1]["messages"][-1]["content"][0]["text"]
+    assert "add was called and returned a value of 5" in follow_up
+    assert "multiply was called and returned a value of 20" in follow_up
+
+def test_async_claude_runs_tool_use_blocks_concurrently():
+    chat = AsyncChat(tools=[slow_lookup], api_key="test")
+    chat.client.client = fake_anthropic(AsyncFakeCreate([
+        claude_tool_use(("slow_lookup", {"key": "a"}), ("slow_lookup", {"key": "b"})),
+        claude_text("done"),
+    ]))
+    start = time.monotonic()
+    assert asyncio.run(chat("Look up a and b")) == "B"
+    assert time.monotonic() - start < 0.35
+
+def test_openai_compatible_runs_every_tool_call_in_reply():
+    chat = Chat(model="llama3.1", tools=[add, multiply], base_url="http://localhost:11434/v1", api_key="test")
+    create = FakeCreate([
+        openai_text(
+            'I will add then multiply.\n```json\n{"tool": "add", "inputs": {"x": "1", "y": "2"}}\n```\n'
+            '```json\n{"tool": "multiply", "inputs": {"x": 3, "y": 4}}\n```'
+        ),
+        openai_text("The answers are 3 and 12."),
+    ])
+    chat.client.client = fake_openai(create)
+    assert chat("Add 1 and 2, multiply 3 and 4") == 12
+    follow_up = create.calls[1]["messages"][-1]["content"]
+    assert follow_up == (
+        "\nFunction add was called and returned a value of 3"
+        "\nFunction multiply was called and returned a value of 12"
+    )
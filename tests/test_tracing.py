@@ -0,0 +1,76 @@
+import json
+from types import SimpleNamespace
+from toolla.chat import Chat
+from toolla.rate_limit import RateLimiter
+from toolla.tracing import Tracer, JsonlExporter, ChromeTraceExporter, use_tracer
+from .tools import add, multiply
+from .fakes import FakeCreate, claude_text, claude_tool_use, fake_anthropic
+
+class ListExporter:
+    def __init__(self):
+        self.records = []
+
+    def export(self, record):
+        self.records.append(record)
+
+    def close(self):
+        pass
+
+def test_chat_call_records_nested_spans(tmp_path):
+    jsonl_path = tmp_path / "trace.jsonl"
+    chrome_path = tmp_path / "trace.json"
+    tracer = Tracer([JsonlExporter(str(jsonl_path)), ChromeTraceExporter(str(chrome_path))])
+    chat = Chat(tools=[add, multiply], api_key="test", tracer=tracer)
+    chat.client.client = fake_anthropic(FakeCreate([
+        claude_tool_use(("add", {"x": 1, "y": 2}), ("multiply", {"x": 3, "y": 4})),
+        claude_text("done"),
+    ]))
+    chat("Add and multiply")
+    tracer.close()
+
+    records = [json.loads(line) for line in jsonl_path.read_text().splitlines()]
+    names = [r["name"] for r in records]
+    assert names.count("schema_build") == 1
+    assert names.count("request") == 2
+    assert names.count("step") == 2
+    assert sorted(r["args"]["tool"] for r in records if r["name"] == "tool") == ["add", "multiply"]
+    assert "truncation" in names and "tool_calls" in names
+    chat_span = next(r for r in records if r["name"] == "chat")
+    for r in records:
+        if r["name"] in ("step", "request", "tool", "truncation"):
+            assert chat_span["ts"] <= r["ts"]
+            assert r["ts"] + r["dur"] <= chat_span["ts"] + chat_span["dur"]
+    trace = json.loads(chrome_path.read_text())
+    assert len(trace["traceEvents"]) == len(records)
+    assert all(e["ph"] == "X" for e in trace["traceEvents"])
+
+def test_failed_span_records_error():
+    exporter = ListExporter()
+    chat = Chat(api_key="test", tracer=Tracer([exporter]))
+    chat.client.client = fake_anthropic(FakeCreate([]))
+    try:
+        chat("Hello")
+    except IndexError:
+        pass
+    request = next(r for r in exporter.records if r["name"] == "request")
+    assert "IndexError" in request["args"]["error"]
+
+def test_rate_limit_retry_is_an_event():
+    exporter = ListExporter()
+    limiter = RateLimiter(backoff_base=0.01)
+    attempts = []
+
+    def create(**kwargs):
+        attempts.append(kwargs)
+        if len(attempts) == 1:
+            error = Exception("throttled")
+            error.status_code = 429
+            error.response = SimpleNamespace(headers={"retry-after-ms": "10"})
+            raise error
+        return "ok"
+
+    with use_tracer(Tracer([exporter])):
+        assert limiter.call(create, {}) == "ok"
+    names = [r["name"] for r in exporter.records]
+    assert names == ["retry", "rate_limit_wait"]
+    assert exporter.records[0]["args"] == {"attempt": 1, "status_code": 429}
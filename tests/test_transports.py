@@ -0,0 +1,79 @@
+import asyncio
+import gc
+from toolla.chat import Chat
+from toolla.transports import LoopBoundClient, TransportPool, transport_pool
+
+def test_sync_clients_shared_per_key():
+    pool = TransportPool()
+    assert pool.anthropic_client("a") is pool.anthropic_client("a")
+    assert pool.anthropic_client("a") is not pool.anthropic_client("b")
+    assert pool.openai_client("a", "http://x/v1") is not pool.openai_client("a", "http://y/v1")
+    assert pool.stats() == {"hits": 2, "misses": 4, "clients": 4, "async_clients": 0}
+
+def test_stats_do_not_expose_api_keys():
+    pool = TransportPool()
+    pool.anthropic_client("sk-secret")
+    assert all("sk-secret" not in str(key) for key in pool._clients)
+
+def test_chats_reuse_pooled_connections():
+    first = Chat(api_key="shared-key")
+    second = Chat(api_key="shared-key")
+    pooled = transport_pool.anthropic_client("shared-key")
+    # The rate limited copies share the pooled HTTP client
+    assert first.client.client._client is pooled._client
+    assert second.client.client._client is pooled._client
+
+def test_async_clients_pooled_per_event_loop():
+    pool = TransportPool()
+
+    async def get_two():
+        return pool.async_anthropic_client("a"), pool.async_anthropic_client("a")
+
+    first, second = asyncio.run(get_two())
+    assert first is second
+    third, _ = asyncio.run(get_two())
+    assert third is not first
+
+def test_configure_rebuilds_clients():
+    pool = TransportPool()
+    client = pool.session("http://localhost:11434")
+    pool.configure(max_connections=10, keepalive_expiry=30)
+    assert pool.session("http://localhost:11434") is not client
+    assert pool.max_connections == 10
+
+def test_configure_leaves_clients_in_use_open():
+    pool = TransportPool()
+    client = pool.openai_client("a", "http://x/v1")
+    pool.configure(max_connections=10)
+    assert not client.is_closed()
+    assert pool.openai_client("a", "http://x/v1") is not client
+
+def test_async_clients_are_closed_and_dropped_with_their_loop():
+    from toolla.chat import AsyncChat
+    from toolla.mock_server import MockServer, text_reply
+    pool = TransportPool()
+    built = []
+
+    with MockServer(script=[text_reply("hi")]) as server:
+        # Built outside a loop, it still talks through each loop's pool
+        chat = AsyncChat(model="llama3.1", base_url=server.url + "/v1", api_key="mock")
+
+        def get():
+            client = pool.async_openai_client("mock", server.url + "/v1")
+            if client not in built:
+                built.append(client)
+            return client
+
+        chat.client.client = LoopBoundClient(get)
+
+        async def twice():
+            await chat("Hello")
+            await chat("Hello")
+
+        for _ in range(5):
+            asyncio.run(twice())
+            gc.collect()
+    assert len(built) == 5
+    assert all(client.is_closed() for client in built)
+    assert len(pool._async_clients) <= 1
+    assert pool.stats()["hits"] == 5
@@ -1,16 +1,20 @@
 import pytest
 import base64
+import os
 from pathlib import Path
 from toolla.utils import (
     build_claude_tool_schema,
     build_openai_tool_schema,
     load_file_base64,
+    BASE64_CHUNK_SIZE,
     get_image_mime_type,
     parse_descriptions,
     extract_json_from_text,
+    extract_json_objects,
     load_json,
     parse_and_cast_input_types,
 )
+from toolla.streaming import JsonObjectScanner
 from toolla.exceptions import InvalidDescriptionException
 from .tools import add, question, multiply
 
@@ -64,6 +68,24 @@ def test_extract_json_block_succeed_without_json_tag():
     assert parsed_s['inputs']['x'] == 1313
     assert parsed_s['inputs']['y'] == 10
 
+def test_extract_json_ignores_braces_in_strings():
+    s = 'Use {"tool": "echo", "inputs": {"text": "a } and a \\" {"}} now'
+    parsed_s = extract_json_from_text(s)
+    assert parsed_s == {"tool": "echo", "inputs": {"text": 'a } and a " {'}}
+
+def test_extract_json_objects_returns_every_object():
+    s = 'First {"tool": "add", "inputs": {"x": 1, "y": 2}} then {not json} and {"tool": "multiply", "inputs": {"x": 3, "y": 4}}'
+    objects = extract_json_objects(s)
+    assert [o["tool"] for o in objects] == ["add", "multiply"]
+
+def test_json_scanner_accepts_chunks():
+    s = 'Sure: {"tool": "echo", "inputs": {"text": "line\\"\nbreak }"}} done'
+    scanner = JsonObjectScanner()
+    found = []
+    for i in range(0, len(s), 3):
+        found += scanner.feed(s[i:i+3])
+    assert found == [{"tool": "echo", "inputs": {"text": 'line"\nbreak }'}}]
+
 def test_parse_description_succeed():
     descriptions = parse_descriptions(add.__doc__)
     assert descriptions['fn_description'] == "An adder function that allows for all types."
@@ -189,6 +211,22 @@ def test_load_file_base64():
         # Clean up the temporary file
         test_file.unlink()
 
+def test_load_file_base64_large_file(tmp_path):
+    import tracemalloc
+    test_file = tmp_path / "large.bin"
+    # Several chunks, the last one needing padding
+    test_content = os.urandom(3 * BASE64_CHUNK_SIZE + 1)
+    test_file.write_bytes(test_content)
+    tracemalloc.start()
+    try:
+        result = load_file_base64(test_file)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert result == base64.b64encode(test_content).decode('ascii')
+    # The encoding, its str and a chunk being encoded, not also a list of encoded chunks
+    assert peak < 2 * len(result) + 2 * BASE64_CHUNK_SIZE
+
 def test_get_jpeg_mime():
     fpath = Path('arrakis.jpg')
     t = get_image_mime_type(fpath)